@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Parallel multi-seed, multi-split benchmark runner with aggregated confidence intervals."""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from threadpoolctl import threadpool_limits
+
+import classical_al_baselines
+import qgpr_benchmark
+import qsvr_benchmark
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+DEFAULT_OUTPUT_DIR = BASE_DIR / "data" / "qml" / "benchmark_runs"
+
+SCRIPTS = {
+    "qsvr": lambda data, **kw: qsvr_benchmark.evaluate_models(dataset=data, write_outputs=False, **kw),
+    "qgpr": lambda data, **kw: qgpr_benchmark.evaluate(dataset=data[:2], write_outputs=False, **kw),
+    "classical_al": lambda data, **kw: classical_al_baselines.run_simulation(dataset=data[:2], write_outputs=False, **kw),
+}
+PAIRED_METRICS = {"rmse": ("rmse_classical", "rmse_quantum"), "mae": ("mae_classical", "mae_quantum")}
+
+_WORKER: Dict[str, object] = {}
+
+
+def _init_worker(features_path: str, target_path: str, feature_names: List[str], threads: int) -> None:
+    # One read-only memory map per worker; BLAS is pinned so processes do not oversubscribe cores.
+    _WORKER["data"] = (np.load(features_path, mmap_mode="r"), np.load(target_path, mmap_mode="r"), feature_names)
+    _WORKER["limits"] = threadpool_limits(threads)
+
+
+def _run_job(job: dict) -> dict:
+    start = time.perf_counter()
+    metrics = SCRIPTS[job["script"]](
+        _WORKER["data"], random_state=job["seed"], split_state=job["split"], **job.get("options", {})
+    )
+    record = {
+        "script": job["script"],
+        "seed": job["seed"],
+        "split": job["split"],
+        "options_hash": job["options_hash"],
+        "seconds": time.perf_counter() - start,
+    }
+    record.update({key: val for key, val in metrics.items() if isinstance(val, (int, float)) and not isinstance(val, bool)})
+    return record
+
+
+def options_hash(options: dict) -> str:
+    """Stable short digest of a job's keyword overrides, part of its resume key."""
+    return hashlib.sha1(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def _job_key(row: dict) -> tuple:
+    return row["script"], row["seed"], row["split"], row.get("options_hash")
+
+
+def _read_results(path: Path) -> List[dict]:
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+def mean_ci(values: np.ndarray, confidence: float = 0.95) -> dict:
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    mean = float(values.mean())
+    std = float(values.std(ddof=1)) if n > 1 else 0.0
+    half = float(stats.t.ppf(0.5 + confidence / 2, n - 1) * std / np.sqrt(n)) if n > 1 else float("nan")
+    return {"n": n, "mean": mean, "std": std, "ci_low": mean - half, "ci_high": mean + half}
+
+
+def aggregate(results: pd.DataFrame, confidence: float = 0.95) -> dict:
+    """Per-script metric means with t intervals and paired classical-vs-quantum statistics."""
+    summary: Dict[str, dict] = {}
+    if results.empty:
+        return summary
+    for script, group in results.groupby("script"):
+        # Rows from other scripts leave their metric columns empty here.
+        group = group.dropna(axis=1, how="all")
+        numeric = group.drop(columns=["seed", "split", "options_hash"], errors="ignore").select_dtypes("number")
+        entry = {"metrics": {col: mean_ci(numeric[col].dropna(), confidence) for col in numeric.columns}}
+        paired = {}
+        for name, (classical_col, quantum_col) in PAIRED_METRICS.items():
+            if classical_col not in group or quantum_col not in group:
+                continue
+            pairs = group[[classical_col, quantum_col]].dropna()
+            diff = (pairs[quantum_col] - pairs[classical_col]).to_numpy()
+            record = {"difference_quantum_minus_classical": mean_ci(diff, confidence)}
+            record["quantum_better_fraction"] = float((diff < 0).mean())
+            if len(diff) > 1 and np.any(diff != 0):
+                record["paired_t_pvalue"] = float(stats.ttest_rel(pairs[quantum_col], pairs[classical_col]).pvalue)
+                record["wilcoxon_pvalue"] = float(stats.wilcoxon(diff).pvalue)
+            paired[name] = record
+        if paired:
+            entry["paired"] = paired
+        summary[script] = entry
+    return summary
+
+
+def run_benchmarks(
+    scripts: List[str],
+    seeds: List[int],
+    splits: Optional[List[int]] = None,
+    output_dir: Path = DEFAULT_OUTPUT_DIR,
+    n_jobs: Optional[int] = None,
+    options: Optional[Dict[str, dict]] = None,
+    threads_per_job: int = 1,
+) -> dict:
+    """Fan (script, seed, split) jobs over a process pool, streaming rows to results.jsonl.
+
+    With ``splits=None`` every model seed also draws its own train/test split
+    (``split == seed``); otherwise each seed runs on every split in ``splits``. Several
+    scripts (exact QSVR, exact QGPR without restarts) are deterministic given the split,
+    so repeating one split across seeds would only replicate a single job.
+
+    Jobs already present in results.jsonl with the same options are skipped, so an
+    interrupted sweep resumes.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    X, y, features = qsvr_benchmark.load_dataset()
+    features_path, target_path = output_dir / "features.npy", output_dir / "target.npy"
+    np.save(features_path, np.ascontiguousarray(X))
+    np.save(target_path, np.ascontiguousarray(y))
+
+    results_path = output_dir / "results.jsonl"
+    done = {_job_key(row) for row in _read_results(results_path)}
+    options = options or {}
+    pairs = [(seed, seed) for seed in seeds] if splits is None else list(itertools.product(seeds, splits))
+    wanted = [
+        {"script": script, "seed": seed, "split": split, "options": options.get(script, {})}
+        for script, (seed, split) in itertools.product(scripts, pairs)
+    ]
+    for job in wanted:
+        job["options_hash"] = options_hash(job["options"])
+    jobs = [job for job in wanted if _job_key(job) not in done]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=n_jobs or os.cpu_count(),
+        initializer=_init_worker,
+        initargs=(str(features_path), str(target_path), features, threads_per_job),
+    ) as pool, results_path.open("a", encoding="utf-8") as handle:
+        futures = [pool.submit(_run_job, job) for job in jobs]
+        for future in as_completed(futures):
+            handle.write(json.dumps(future.result()) + "\n")
+            handle.flush()
+    wall = time.perf_counter() - start
+
+    keys = {_job_key(job) for job in wanted}
+    results = pd.DataFrame([row for row in _read_results(results_path) if _job_key(row) in keys])
+    results.to_csv(output_dir / "results.csv", index=False)
+    summary = {
+        "jobs_run": len(jobs),
+        "jobs_total": int(len(results)),
+        "wall_seconds": wall,
+        "job_seconds": float(results["seconds"].sum()) if "seconds" in results else 0.0,
+        "options": options,
+        "scripts": aggregate(results),
+    }
+    (output_dir / "summary.json").write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    return summary
+
+
+def parse_options(pairs: List[str]) -> Dict[str, dict]:
+    """Parse ``script.key=value`` overrides; values are read as JSON when possible."""
+    options: Dict[str, dict] = {}
+    for pair in pairs:
+        target, value = pair.split("=", 1)
+        script, key = target.split(".", 1)
+        try:
+            parsed = json.loads(value)
+        except json.JSONDecodeError:
+            parsed = value
+        options.setdefault(script, {})[key] = parsed
+    return options
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run benchmark scripts over many seeds and splits in parallel")
+    parser.add_argument("--scripts", nargs="+", choices=sorted(SCRIPTS), default=["qsvr", "qgpr"])
+    parser.add_argument("--seeds", type=int, default=10, help="Number of model seeds")
+    parser.add_argument(
+        "--splits", type=int, default=None, help="Split seeds crossed with every model seed (default: one split per seed)"
+    )
+    parser.add_argument("--seed-offset", type=int, default=0)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    parser.add_argument("--threads-per-job", type=int, default=1)
+    parser.add_argument("--output-dir", type=Path, default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument(
+        "--option", action="append", default=[], help="Per-script keyword override, e.g. qsvr.kernel_mode=nystroem"
+    )
+    args = parser.parse_args()
+
+    seeds = list(range(args.seed_offset, args.seed_offset + args.seeds))
+    splits = None if args.splits is None else list(range(args.seed_offset, args.seed_offset + args.splits))
+    summary = run_benchmarks(
+        args.scripts, seeds, splits, args.output_dir, args.n_jobs, parse_options(args.option), args.threads_per_job
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Persistent cross-run deduplication index of canonicalized compositions."""
+from __future__ import annotations
+
+import argparse
+import json
+import warnings
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from property_surrogate import parse_compositions
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+INDEX_PATH = BASE_DIR / "data" / "qml" / "candidate_dedup_index.npz"
+TRAINING_PATH = BASE_DIR / "data" / "processed" / "hea_features.parquet"
+
+DEFAULT_TOLERANCE = 0.01
+INDEX_KINDS = ("set", "bloom")
+BLOOM_CAPACITY = 10_000_000
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer; uint64 arithmetic wraps."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def symbol_codes(symbols: Sequence[str]) -> np.ndarray:
+    """Run-independent nonzero code per element symbol (its two ASCII bytes)."""
+    return np.array([(ord(s[0]) << 8) | (ord(s[1]) if len(s) > 1 else 0) for s in symbols], dtype=np.uint64)
+
+
+def canonical_keys(codes: np.ndarray, fractions: np.ndarray, tolerance: float = DEFAULT_TOLERANCE) -> np.ndarray:
+    """64-bit keys of padded composition rows (``codes == 0`` marks padding).
+
+    Fractions are renormalized and quantized to multiples of ``tolerance``; elements are
+    hashed in symbol order, so element order and padding width do not change the key.
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    fractions = np.where(codes > 0, fractions, 0.0)
+    order = np.argsort(codes, axis=1, kind="stable")
+    codes = np.take_along_axis(codes, order, axis=1)
+    fractions = np.take_along_axis(fractions, order, axis=1)
+    # Summed column by column in symbol order: padding adds exact zeros, so a fraction on a
+    # quantum boundary rounds the same way whatever the row width or element order.
+    total = np.zeros(len(codes))
+    for j in range(codes.shape[1]):
+        total += fractions[:, j]
+    quanta = np.rint(fractions / np.maximum(total, 1e-12)[:, None] / tolerance).astype(np.uint64)
+    keys = np.full(len(codes), _GOLDEN)
+    with np.errstate(over="ignore"):
+        for j in range(codes.shape[1]):
+            mixed = _mix((keys ^ ((codes[:, j] << np.uint64(32)) | quanta[:, j])) + _GOLDEN)
+            keys = np.where(codes[:, j] > 0, mixed, keys)
+    return keys
+
+
+def composition_keys(
+    elements: np.ndarray, fractions: np.ndarray, symbols: Sequence[str], tolerance: float = DEFAULT_TOLERANCE
+) -> np.ndarray:
+    """Keys of a padded element-index block (``-1`` = padding), as in ``CompositionBatch``."""
+    codes = np.append(symbol_codes(symbols), np.uint64(0))[np.asarray(elements)]
+    return canonical_keys(codes, fractions, tolerance)
+
+
+def formula_keys(formulas: Sequence[str] | pa.Array, tolerance: float = DEFAULT_TOLERANCE) -> np.ndarray:
+    """Keys of formula strings; a symbol repeated within a formula has its amounts summed."""
+    n, rows, found, amount = parse_compositions(formulas)
+    encoded = pc.dictionary_encode(found)
+    codes = symbol_codes(encoded.dictionary.to_pylist())
+    column = encoded.indices.to_numpy(zero_copy_only=False)
+    amounts = np.bincount(rows * len(codes) + column, weights=amount, minlength=n * len(codes)).reshape(n, len(codes))
+    # Pack each row's elements to the left so canonical_keys only walks the widest row.
+    width = int((amounts > 0).sum(axis=1).max(initial=0))
+    order = np.argsort(amounts <= 0, axis=1, kind="stable")[:, :width]
+    amounts = np.take_along_axis(amounts, order, axis=1)
+    return canonical_keys(np.where(amounts > 0, codes[order], np.uint64(0)), amounts, tolerance)
+
+
+def _first_occurrence(keys: np.ndarray) -> np.ndarray:
+    first = np.zeros(len(keys), dtype=bool)
+    first[np.unique(keys, return_index=True)[1]] = True
+    return first
+
+
+class DedupIndex:
+    """Exact set of keys kept as a sorted ``uint64`` array in an ``.npz`` file.
+
+    Lookups are one ``searchsorted`` per batch; 10^8 keys take 800 MB. False positives
+    only occur on 64-bit hash collisions.
+    """
+
+    kind = "set"
+
+    def __init__(self, path: Optional[Path] = INDEX_PATH, tolerance: float = DEFAULT_TOLERANCE) -> None:
+        self.path = None if path is None else Path(path)
+        self.tolerance = tolerance
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.dropped = 0
+        if self.path is not None and self.path.exists():
+            self._load(np.load(self.path))
+
+    def _load(self, data) -> None:
+        if str(data["kind"]) != self.kind:
+            raise ValueError(f"{self.path} holds a {data['kind']} index, not a {self.kind} index")
+        if not np.isclose(float(data["tolerance"]), self.tolerance):
+            raise ValueError(f"{self.path} was built with tolerance {float(data['tolerance'])}, not {self.tolerance}")
+        self._restore(data)
+
+    def _restore(self, data) -> None:
+        self.keys = data["keys"]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        slots = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        return self.keys[slots] == keys if len(self.keys) else np.zeros(len(keys), dtype=bool)
+
+    def add(self, keys: np.ndarray) -> None:
+        self.keys = np.union1d(self.keys, keys)
+
+    def keep_new(self, keys: np.ndarray) -> np.ndarray:
+        """Mask of keys seen neither before nor earlier in the batch; the kept keys are added."""
+        keep = _first_occurrence(keys) & ~self.contains(keys)
+        self.add(keys[keep])
+        self.dropped += int(len(keys) - keep.sum())
+        return keep
+
+    def _arrays(self) -> dict:
+        return {"keys": self.keys}
+
+    def save(self, path: Optional[Path] = None) -> None:
+        """Write atomically to ``path`` (default: the file the index was opened from)."""
+        path = Path(path) if path is not None else self.path
+        if path is None:
+            return
+        tmp = path.with_name(path.stem + ".tmp.npz")
+        np.savez(tmp, kind=self.kind, tolerance=self.tolerance, **self._arrays())
+        tmp.replace(path)
+
+
+class BloomDedupIndex(DedupIndex):
+    """Bloom filter over the same keys: fixed memory, no false negatives, tunable false positives.
+
+    ``capacity`` keys at ``error_rate`` need ``-capacity ln(error_rate) / ln(2)^2`` bits; the
+    ``k`` probe positions come from double hashing of the 64-bit key. The filter is sized
+    once, so a saved index keeps its capacity, and filling it past capacity warns because
+    the false-positive rate then grows quickly.
+    """
+
+    kind = "bloom"
+
+    def __init__(
+        self,
+        path: Optional[Path] = INDEX_PATH,
+        tolerance: float = DEFAULT_TOLERANCE,
+        capacity: int = BLOOM_CAPACITY,
+        error_rate: float = 1e-4,
+    ) -> None:
+        self.capacity = capacity
+        bits = int(np.ceil(-capacity * np.log(error_rate) / np.log(2) ** 2))
+        self.num_bits = (bits + 7) // 8 * 8
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * np.log(2))))
+        self.bits = np.zeros(self.num_bits // 8, dtype=np.uint8)
+        self.count = 0
+        super().__init__(path, tolerance)
+
+    def _restore(self, data) -> None:
+        self.bits, self.num_hashes, self.count = data["bits"], int(data["num_hashes"]), int(data["count"])
+        self.num_bits = len(self.bits) * 8
+        if "capacity" in data:
+            self.capacity = int(data["capacity"])
+        self._check_capacity()
+
+    def _check_capacity(self) -> None:
+        if self.count > self.capacity:
+            warnings.warn(
+                f"Bloom index holds {self.count} keys, over its capacity of {self.capacity}; "
+                "rebuild it with a larger capacity to keep false positives near the error rate",
+                RuntimeWarning,
+                stacklevel=3,
+            )
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        h1 = keys.astype(np.uint64)
+        with np.errstate(over="ignore"):
+            h2 = _mix(h1 + _GOLDEN) | np.uint64(1)
+            probes = h1[:, None] + np.arange(self.num_hashes, dtype=np.uint64)[None, :] * h2[:, None]
+        return probes % np.uint64(self.num_bits)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        positions = self._positions(keys)
+        hits = self.bits[positions >> np.uint64(3)] & (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8))
+        return (hits > 0).all(axis=1)
+
+    def add(self, keys: np.ndarray) -> None:
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8))
+        was_within = self.count <= self.capacity
+        self.count += len(keys)
+        if was_within:
+            self._check_capacity()
+
+    def _arrays(self) -> dict:
+        return {"bits": self.bits, "num_hashes": self.num_hashes, "count": self.count, "capacity": self.capacity}
+
+
+def open_index(
+    path: Optional[Path] = INDEX_PATH, kind: str = "set", tolerance: float = DEFAULT_TOLERANCE, **bloom
+) -> DedupIndex:
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind {kind!r}; expected one of {INDEX_KINDS}")
+    return DedupIndex(path, tolerance) if kind == "set" else BloomDedupIndex(path, tolerance, **bloom)
+
+
+def seed_with_training(index: DedupIndex, path: Path = TRAINING_PATH) -> int:
+    """Add every HEA training composition; returns the number of new keys."""
+    keys = formula_keys(pd.read_parquet(path, columns=["formula"])["formula"].unique(), index.tolerance)
+    new = keys[_first_occurrence(keys) & ~index.contains(keys)]
+    index.add(new)
+    return len(new)
+
+
+def _file_keys(path: Path, tolerance: float) -> np.ndarray:
+    """Keys of a candidate file (``composition`` column) or a dataset (``formula`` column)."""
+    from qgan_prototype import read_candidates
+
+    columns = pq.ParquetFile(path).schema.names if path.suffix == ".parquet" else pd.read_csv(path, nrows=0).columns
+    column = "composition" if "composition" in columns else "formula"
+    keys: List[np.ndarray] = []
+    for frame in read_candidates(path, columns=[column]):
+        keys.append(formula_keys(frame[column], tolerance))
+    return np.concatenate(keys) if keys else np.empty(0, dtype=np.uint64)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build or query the candidate deduplication index")
+    parser.add_argument("--index", type=Path, default=INDEX_PATH)
+    parser.add_argument("--kind", choices=INDEX_KINDS, default="set")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument(
+        "--bloom-capacity", type=int, default=BLOOM_CAPACITY, help="Keys a new bloom index is sized for (saved indexes keep theirs)"
+    )
+    parser.add_argument("--seed-training", action="store_true", help="Add the HEA training compositions")
+    parser.add_argument("--add", type=Path, nargs="*", default=[], help="Candidate CSV/Parquet files to add")
+    parser.add_argument("--check", type=Path, nargs="*", default=[], help="Candidate files to test for duplicates")
+    args = parser.parse_args()
+
+    bloom = {"capacity": args.bloom_capacity} if args.kind == "bloom" else {}
+    index = open_index(args.index, args.kind, args.tolerance, **bloom)
+    report = {"index": str(args.index), "kind": index.kind, "tolerance": index.tolerance, "keys_before": len(index)}
+    if index.kind == "bloom":
+        report["capacity"] = index.capacity
+    for path in args.check:
+        keys = _file_keys(path, index.tolerance)
+        report[f"check:{path.name}"] = {
+            "rows": int(len(keys)),
+            "already_indexed": int(index.contains(keys).sum()),
+            "repeated_within_file": int(len(keys) - len(np.unique(keys))),
+        }
+    if args.seed_training:
+        report["training_added"] = seed_with_training(index)
+    for path in args.add:
+        before = len(index)
+        index.keep_new(_file_keys(path, index.tolerance))
+        report[f"add:{path.name}"] = len(index) - before
+    if args.seed_training or args.add:
+        index.save()
+    report["keys_after"] = len(index)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""Gate-level IR for the feature-map families with routing, cancellation and resource estimates."""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+from qml_utils import entangler_pairs
+from quantum_kernels import FAMILY_QUBITS
+
+TOPOLOGIES = ("all_to_all", "heavy_hex")
+SELF_INVERSE = {"h", "cx", "cz", "swap"}
+# Heavy-hex row length; 4k + 1 puts a bridge at both ends of even rows.
+HEAVY_HEX_ROW = 13
+
+
+@dataclass(frozen=True)
+class Gate:
+    name: str
+    qubits: Tuple[int, ...]
+
+    @property
+    def two_qubit(self) -> bool:
+        return len(self.qubits) == 2
+
+
+@dataclass(frozen=True)
+class Device:
+    """Nominal gate and readout durations (microseconds) of a target backend."""
+
+    name: str
+    topology: str
+    one_qubit_us: float
+    two_qubit_us: float
+    readout_us: float
+
+
+DEVICES = {
+    "ionq": Device("ionq", "all_to_all", one_qubit_us=10.0, two_qubit_us=210.0, readout_us=130.0),
+    "ibm": Device("ibm", "heavy_hex", one_qubit_us=0.036, two_qubit_us=0.32, readout_us=4.0),
+}
+
+
+@dataclass(frozen=True)
+class CompiledCircuit:
+    family: str
+    layers: int
+    qubits: int
+    topology: str
+    gates: Tuple[Gate, ...]
+    layout: Tuple[int, ...]
+    swaps: int
+    cancelled: int
+
+    @property
+    def two_qubit_count(self) -> int:
+        return sum(gate.two_qubit for gate in self.gates)
+
+    @property
+    def one_qubit_count(self) -> int:
+        return len(self.gates) - self.two_qubit_count
+
+    @property
+    def depth(self) -> int:
+        return int(critical_path(self.gates, 1.0, 1.0))
+
+    @property
+    def two_qubit_depth(self) -> int:
+        return int(critical_path(self.gates, 0.0, 1.0))
+
+    def runtime_us(self, device: Device) -> float:
+        """Critical-path duration of one shot, including readout."""
+        return critical_path(self.gates, device.one_qubit_us, device.two_qubit_us) + device.readout_us
+
+
+def feature_map_circuit(family: str, layers: int, qubits: int) -> List[Gate]:
+    """Logical circuit of a family, gate for gate as ``quantum_kernels._encode_block`` simulates it.
+
+    ``zz`` is the two-qubit phase ``exp(-i a Z_q Z_r / 2)`` and ``cz`` the ladder entangler.
+    """
+    if family not in FAMILY_QUBITS:
+        raise ValueError(f"Unknown feature-map family {family!r}; expected one of {sorted(FAMILY_QUBITS)}")
+    wires = range(qubits)
+    gates: List[Gate] = []
+    for layer in range(layers):
+        if family == "composition_encoding":
+            gates += [Gate("ry", (q,)) for q in wires]
+            gates += [Gate("zz", tuple(pair)) for pair in entangler_pairs(qubits, "ring").tolist()]
+        elif family == "local_environment":
+            gates += [Gate("ry", (q,)) for q in wires] + [Gate("rz", (q,)) for q in wires]
+            gates += [Gate("cz", (q, q + 1)) for q in range(qubits - 1)]
+        else:
+            gates += [Gate("h" if layer == 0 else "ry", (q,)) for q in wires] + [Gate("rz", (q,)) for q in wires]
+            gates += [Gate("zz", tuple(pair)) for pair in entangler_pairs(qubits, "all").tolist()]
+    return gates
+
+
+@lru_cache(maxsize=None)
+def heavy_hex_coupling(num_qubits: int) -> Tuple[Tuple[int, int], ...]:
+    """Smallest stack of heavy-hex rows with at least ``num_qubits`` qubits.
+
+    Rows are lines of ``HEAVY_HEX_ROW`` qubits; a bridge qubit joins rows ``i`` and ``i + 1``
+    at every fourth column, offset by two on odd rows, as on IBM Eagle/Heron devices.
+    """
+    rows = 1
+    while rows * HEAVY_HEX_ROW + (rows - 1) * ((HEAVY_HEX_ROW + 3) // 4) < num_qubits:
+        rows += 1
+    node = {(i, j): i * HEAVY_HEX_ROW + j for i in range(rows) for j in range(HEAVY_HEX_ROW)}
+    edges = [(node[i, j], node[i, j + 1]) for i in range(rows) for j in range(HEAVY_HEX_ROW - 1)]
+    bridge = rows * HEAVY_HEX_ROW
+    for i in range(rows - 1):
+        for j in range(0 if i % 2 == 0 else 2, HEAVY_HEX_ROW, 4):
+            edges += [(node[i, j], bridge), (bridge, node[i + 1, j])]
+            bridge += 1
+    return tuple(edges)
+
+
+def _adjacency(edges: Sequence[Tuple[int, int]]) -> Dict[int, List[int]]:
+    adjacency: Dict[int, List[int]] = {}
+    for a, b in edges:
+        adjacency.setdefault(a, []).append(b)
+        adjacency.setdefault(b, []).append(a)
+    return adjacency
+
+
+def _distances(adjacency: Dict[int, List[int]]) -> Dict[int, Dict[int, int]]:
+    distances = {}
+    for source in adjacency:
+        dist = {source: 0}
+        queue = deque([source])
+        while queue:
+            current = queue.popleft()
+            for nxt in adjacency[current]:
+                if nxt not in dist:
+                    dist[nxt] = dist[current] + 1
+                    queue.append(nxt)
+        distances[source] = dist
+    return distances
+
+
+def _snake_layout(adjacency: Dict[int, List[int]], num_qubits: int) -> List[int]:
+    """Greedy path from qubit 0 that stays on a row while it can, then nearest free qubits."""
+    path, seen = [0], {0}
+    while len(path) < num_qubits:
+        free = [q for q in adjacency[path[-1]] if q not in seen]
+        if not free:
+            break
+        # Row qubits are numbered below bridge qubits; consecutive numbers share a row.
+        nxt = min(free, key=lambda q: (abs(q - path[-1]) != 1, q))
+        path.append(nxt)
+        seen.add(nxt)
+    if len(path) < num_qubits:
+        distances = _distances(adjacency)
+        by_distance = sorted(adjacency, key=lambda q: min(distances[q][p] for p in path))
+        path += [q for q in by_distance if q not in seen][: num_qubits - len(path)]
+    return path
+
+
+def route(gates: Sequence[Gate], num_qubits: int, topology: str) -> Tuple[List[Gate], Tuple[int, ...], int]:
+    """Map logical gates onto physical qubits, inserting SWAPs next to each distant two-qubit gate.
+
+    Local greedy routing: the first operand walks along a shortest path toward the second
+    until they are coupled. Returns physical gates, the initial layout and the SWAP count.
+    """
+    if topology == "all_to_all":
+        return list(gates), tuple(range(num_qubits)), 0
+    if topology != "heavy_hex":
+        raise ValueError(f"Unknown topology {topology!r}; expected one of {TOPOLOGIES}")
+    adjacency = _adjacency(heavy_hex_coupling(num_qubits))
+    distances = _distances(adjacency)
+    layout = _snake_layout(adjacency, num_qubits)
+    physical = dict(enumerate(layout))
+    logical = {p: q for q, p in physical.items()}
+    routed, swaps = [], 0
+    for gate in gates:
+        if gate.two_qubit:
+            a, b = gate.qubits
+            while distances[physical[a]][physical[b]] > 1:
+                here, target = physical[a], physical[b]
+                step = next(q for q in adjacency[here] if distances[q][target] == distances[here][target] - 1)
+                routed.append(Gate("swap", (here, step)))
+                swaps += 1
+                other = logical.get(step)
+                physical[a], logical[step] = step, a
+                if other is None:
+                    del logical[here]
+                else:
+                    physical[other], logical[here] = here, other
+        routed.append(Gate(gate.name, tuple(physical[q] for q in gate.qubits)))
+    return routed, tuple(layout), swaps
+
+
+def decompose(gates: Sequence[Gate]) -> List[Gate]:
+    """Lower to single-qubit rotations and CX: ZZ = CX RZ CX, CZ = H CX H, SWAP = 3 CX."""
+    lowered = []
+    for gate in gates:
+        if gate.name == "zz":
+            a, b = gate.qubits
+            lowered += [Gate("cx", (a, b)), Gate("rz", (b,)), Gate("cx", (a, b))]
+        elif gate.name == "cz":
+            a, b = gate.qubits
+            lowered += [Gate("h", (b,)), Gate("cx", (a, b)), Gate("h", (b,))]
+        elif gate.name == "swap":
+            a, b = gate.qubits
+            lowered += [Gate("cx", (a, b)), Gate("cx", (b, a)), Gate("cx", (a, b))]
+        else:
+            lowered.append(gate)
+    return lowered
+
+
+def cancel(gates: Sequence[Gate]) -> Tuple[List[Gate], int]:
+    """Cancel adjacent self-inverse pairs and fuse runs of single-qubit gates into one ``u``.
+
+    A gate is adjacent to the last surviving gate on each of its qubits, so removing a
+    pair can expose further cancellations (e.g. ``CX (H H) CX``).
+    """
+    out: List[Gate | None] = []
+    last: Dict[int, List[int]] = {}
+    removed = 0
+    for gate in gates:
+        stacks = [last.setdefault(q, []) for q in gate.qubits]
+        previous = {stack[-1] if stack else None for stack in stacks}
+        prev = previous.pop() if len(previous) == 1 else None
+        if prev is not None and out[prev] == gate and gate.name in SELF_INVERSE:
+            out[prev] = None
+            for stack in stacks:
+                stack.pop()
+            removed += 2
+            continue
+        if prev is not None and not gate.two_qubit and not out[prev].two_qubit:
+            out[prev] = Gate("u", gate.qubits)
+            removed += 1
+            continue
+        out.append(gate)
+        for stack in stacks:
+            stack.append(len(out) - 1)
+    return [gate for gate in out if gate is not None], removed
+
+
+def critical_path(gates: Sequence[Gate], one_qubit: float, two_qubit: float) -> float:
+    """Longest weighted path through the circuit (ASAP schedule)."""
+    ready: Dict[int, float] = {}
+    for gate in gates:
+        start = max(ready.get(q, 0.0) for q in gate.qubits)
+        end = start + (two_qubit if gate.two_qubit else one_qubit)
+        for q in gate.qubits:
+            ready[q] = end
+    return max(ready.values(), default=0.0)
+
+
+@lru_cache(maxsize=None)
+def compile_feature_map(family: str, layers: int, qubits: int, topology: str) -> CompiledCircuit:
+    """Route, lower and simplify one configuration; cached by its full key."""
+    routed, layout, swaps = route(feature_map_circuit(family, layers, qubits), qubits, topology)
+    gates, cancelled = cancel(decompose(routed))
+    return CompiledCircuit(family, layers, qubits, topology, tuple(gates), layout, swaps, cancelled)
+
+
+def resource_record(family: str, layers: int, qubits: int) -> dict:
+    """Compiled depth, two-qubit counts and per-shot runtime on every device in ``DEVICES``."""
+    record = {}
+    for name, device in DEVICES.items():
+        compiled = compile_feature_map(family, layers, qubits, device.topology)
+        record[f"{name}_depth"] = compiled.depth
+        record[f"{name}_two_qubit_count"] = compiled.two_qubit_count
+        record[f"{name}_swaps"] = compiled.swaps
+        record[f"{name}_runtime_us"] = round(compiled.runtime_us(device), 3)
+    return record
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compile feature-map circuits and report resources")
+    parser.add_argument("--families", nargs="+", choices=sorted(FAMILY_QUBITS), default=sorted(FAMILY_QUBITS))
+    parser.add_argument("--layers", type=int, nargs="+", default=[1, 2, 3, 4, 5])
+    parser.add_argument("--qubits", type=int, nargs="+", default=None, help="Default: each family's own width")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    records = []
+    for family, layers in itertools.product(args.families, args.layers):
+        for qubits in args.qubits or [FAMILY_QUBITS[family]]:
+            records.append({"family": family, "layers": layers, "qubits": qubits, **resource_record(family, layers, qubits)})
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"configurations": len(records), "seconds": elapsed, "records": records}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,13 @@ from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.gaussian_process.kernels import RBF, WhiteKernel
 from sklearn.metrics import mean_squared_error
 from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+from gp_hyperopt import HyperparameterService, KernelSpec
+from kernel_approximation import rbf_kernel_fn
+from kernel_gp import ExactKernelGP, IncrementalGP
+from kernel_store import IncrementalKernelStore
+from quantum_kernels import FAMILY_QUBITS, FeatureMap, encode_states, fidelity_from_states
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 DATA_PATH = BASE_DIR / "data" / "processed" / "perovskites_features.parquet"
@@ -26,34 +33,91 @@ def load_dataset():
     return X, y
 
 
-def run_simulation(random_state: int = 42, init_size: int = 50, query_batch: int = 25, iterations: int = 10) -> dict:
-    X, y = load_dataset()
-    X_train, X_pool, y_train, y_pool = train_test_split(X, y, test_size=0.8, random_state=random_state)
-
-    rng = np.random.default_rng(random_state)
-    indices = rng.choice(len(X_train), size=init_size, replace=False)
+def al_streams(random_state: int) -> tuple[np.random.Generator, np.random.Generator, np.random.Generator]:
+    """Independent generators for the initial labels, random acquisition and evaluation rows.
+
+    Used by the ``rank_update`` and ``incremental`` modes, so the incremental loop, which
+    skips random acquisition, labels and evaluates the same rows as ``rank_update``. The
+    ``sklearn`` mode keeps its single ``default_rng(random_state)`` stream.
+    """
+    return tuple(np.random.default_rng(seed) for seed in np.random.SeedSequence(random_state).spawn(3))
+
+
+def run_simulation(
+    random_state: int = 42,
+    init_size: int = 50,
+    query_batch: int = 25,
+    iterations: int = 10,
+    split_state: int | None = None,
+    dataset: tuple[np.ndarray, np.ndarray] | None = None,
+    write_outputs: bool = True,
+    kernel_mode: str = "sklearn",
+    feature_map: FeatureMap | None = None,
+    reoptimize_every: int = 5,
+    hyperopt: str = "sklearn",
+    restarts: int = 4,
+    n_jobs: int | None = None,
+) -> dict:
+    X, y = load_dataset() if dataset is None else dataset
+    X_train, X_pool, y_train, y_pool = train_test_split(
+        X, y, test_size=0.8, random_state=random_state if split_state is None else split_state
+    )
+    if kernel_mode == "incremental":
+        return run_incremental(
+            X_train, X_pool, y_train, y_pool, random_state, init_size, query_batch, iterations, feature_map, write_outputs
+        )
+    if kernel_mode not in ("sklearn", "rank_update"):
+        raise ValueError(f"Unknown kernel mode {kernel_mode!r}")
+    if hyperopt not in ("sklearn", "service"):
+        raise ValueError(f"Unknown hyperparameter optimizer {hyperopt!r}")
+
+    if kernel_mode == "sklearn":
+        init_rng = acquisition_rng = eval_rng = np.random.default_rng(random_state)
+    else:
+        init_rng, acquisition_rng, eval_rng = al_streams(random_state)
+    indices = init_rng.choice(len(X_train), size=init_size, replace=False)
     labeled_X = X_train[indices]
     labeled_y = y_train[indices]
 
     remaining_idx = [i for i in range(len(X_pool))]
 
     kernel = RBF(length_scale=1.0) + WhiteKernel(noise_level=1e-3)
-    model = GaussianProcessRegressor(kernel=kernel, alpha=1e-3, random_state=random_state)
+    service = None
+    if hyperopt == "service":
+        # Cached distances, parallel restarts, each fit warm-started from the previous optimum.
+        service = HyperparameterService(
+            KernelSpec("rbf", alpha=1e-3), kernel, restarts, n_jobs=n_jobs, random_state=random_state
+        )
+    if kernel_mode == "rank_update":
+        # Block Cholesky appends per batch; hyperparameters re-optimised every few iterations.
+        model = IncrementalGP(
+            kernel,
+            alpha=1e-3,
+            reoptimize_every=reoptimize_every,
+            random_state=random_state,
+            optimizer=None if service is None else service.fit,
+        )
+    else:
+        model = GaussianProcessRegressor(kernel=kernel, alpha=1e-3, random_state=random_state)
 
     histories = []
 
     for step in range(iterations):
-        model.fit(labeled_X, labeled_y)
+        if kernel_mode == "sklearn" and service is not None:
+            model = GaussianProcessRegressor(kernel=service.fit(labeled_X, labeled_y), alpha=1e-3, optimizer=None)
+            model.fit(labeled_X, labeled_y)
+        elif kernel_mode == "sklearn" or step == 0:
+            model.fit(labeled_X, labeled_y)
         preds, stds = model.predict(X_pool[remaining_idx], return_std=True)
 
         # random acquisition
-        random_candidates = rng.choice(remaining_idx, size=query_batch, replace=False)
+        random_candidates = acquisition_rng.choice(remaining_idx, size=query_batch, replace=False)
         # uncertainty sampling (highest std)
         std_indices = np.argsort(stds)[-query_batch:]
         uncertainty_candidates = [remaining_idx[i] for i in std_indices]
 
         # evaluate on hold-out portion of original training set for comparison
-        eval_idx = rng.choice(len(X_train), size=200, replace=False)
+        eval_idx = eval_rng.choice(len(X_train), size=200, replace=False)
         y_true = y_train[eval_idx]
         y_pred = model.predict(X_train[eval_idx])
         rmse = mean_squared_error(y_true, y_pred) ** 0.5
@@ -70,21 +134,116 @@ def run_simulation(random_state: int = 42, init_size: int = 50, query_batch: int
         labeled_X = np.vstack([labeled_X, X_pool[new_indices]])
         labeled_y = np.concatenate([labeled_y, y_pool[new_indices]])
         remaining_idx = [idx for idx in remaining_idx if idx not in new_indices]
+        if kernel_mode == "rank_update" and step + 1 < iterations:
+            model.update(X_pool[new_indices], y_pool[new_indices])
+
+    metrics = {
+        "final_rmse": histories[-1]["rmse"],
+        "iterations": iterations,
+        "history": histories,
+    }
+    if kernel_mode == "rank_update":
+        metrics.update(kernel_mode=kernel_mode, reoptimize_every=reoptimize_every, refits=model.refits_)
+    if service is not None:
+        metrics["hyperopt"] = {**service.summary(), "log": service.log}
+    if write_outputs:
+        OUT_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+    return metrics
+
+
+def run_incremental(
+    X_train: np.ndarray,
+    X_pool: np.ndarray,
+    y_train: np.ndarray,
+    y_pool: np.ndarray,
+    random_state: int = 42,
+    init_size: int = 50,
+    query_batch: int = 25,
+    iterations: int = 10,
+    feature_map: FeatureMap | None = None,
+    write_outputs: bool = True,
+    noise: float = 1e-2,
+) -> dict:
+    """Same loop with fixed kernel hyperparameters and an incrementally grown kernel store.
+
+    Rows of ``X_train`` and ``X_pool`` share one store, so each iteration only evaluates
+    the kernel columns of the newly labeled batch. The kernel is RBF(length_scale=1) on the
+    raw features, or the fidelity kernel of ``feature_map`` on standardized features.
+    """
+    X_all = np.vstack([X_train, X_pool])
+    y_all = np.concatenate([y_train, y_pool])
+    if feature_map is None:
+        store = IncrementalKernelStore(X_all, rbf_kernel_fn(0.5), capacity=init_size + iterations * query_batch)
+    else:
+        states = encode_states(StandardScaler().fit(X_train).transform(X_all), feature_map)
+        store = IncrementalKernelStore(states, fidelity_from_states, capacity=init_size + iterations * query_batch)
+    offset = len(X_train)
+
+    init_rng, _, eval_rng = al_streams(random_state)
+    store.add(init_rng.choice(len(X_train), size=init_size, replace=False))
+    remaining_idx = np.arange(len(X_pool))
+
+    histories = []
+    for step in range(iterations):
+        labeled = store.labeled_indices
+        model = ExactKernelGP(noise=noise).fit(store.gram(), y_all[labeled])
+        _, stds = model.predict(store.cross(offset + remaining_idx), return_std=True)
+
+        std_indices = np.argsort(stds)[-query_batch:]
+
+        eval_idx = eval_rng.choice(len(X_train), size=200, replace=False)
+        y_pred = model.predict(store.cross(eval_idx))
+        rmse = mean_squared_error(y_train[eval_idx], y_pred) ** 0.5
+
+        histories.append({
+            "iteration": step,
+            "rmse": rmse,
+            "random_mean_std": float(stds.mean()),
+            "uncertainty_max_std": float(stds[std_indices].mean()),
+            "kernel_entries": int(store.entries_computed),
+        })
+
+        store.add(offset + remaining_idx[std_indices])
+        remaining_idx = np.delete(remaining_idx, std_indices)
 
     metrics = {
         "final_rmse": histories[-1]["rmse"],
         "iterations": iterations,
+        "kernel_mode": "incremental",
+        "feature_map": None if feature_map is None else feature_map.to_dict(),
         "history": histories,
     }
-    OUT_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+    if write_outputs:
+        OUT_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
     return metrics
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--random-state", type=int, default=42)
+    parser.add_argument("--kernel-mode", choices=["sklearn", "rank_update", "incremental"], default="sklearn")
+    parser.add_argument("--feature-map", choices=sorted(FAMILY_QUBITS), default=None, help="Fidelity kernel (incremental mode)")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--reoptimize-every", type=int, default=5, help="Hyperparameter refit period (rank_update)")
+    parser.add_argument("--hyperopt", choices=["sklearn", "service"], default="sklearn")
+    parser.add_argument("--restarts", type=int, default=4, help="Random restarts of the first service fit")
+    parser.add_argument("--n-jobs", type=int, default=None)
     args = parser.parse_args()
-    metrics = run_simulation(args.random_state)
+    feature_map = None
+    if args.feature_map is not None:
+        feature_map = FeatureMap(args.feature_map, layers=args.layers, bandwidth=args.bandwidth)
+    metrics = run_simulation(
+        args.random_state,
+        iterations=args.iterations,
+        kernel_mode=args.kernel_mode,
+        feature_map=feature_map,
+        reoptimize_every=args.reoptimize_every,
+        hyperopt=args.hyperopt,
+        restarts=args.restarts,
+        n_jobs=args.n_jobs,
+    )
     print(json.dumps(metrics, indent=2))
 
 
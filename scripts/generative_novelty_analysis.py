@@ -10,8 +10,10 @@ import numpy as np
 import pandas as pd
 from sklearn.neighbors import NearestNeighbors
 
+from qgan_prototype import read_candidates
+from qgan_property_conditioning import conditioned_candidates_path
+
 BASE_DIR = Path(__file__).resolve().parents[1]
-QUANTUM_CSV = BASE_DIR / "data" / "qml" / "qgan_conditioned_candidates.csv"
 CLASSICAL_CSV = BASE_DIR / "data" / "qml" / "classical_baseline_candidates.csv"
 CONSTRAINT_PATH = BASE_DIR / "data" / "metadata" / "hea_constraints.yaml"
 METRICS_JSON = BASE_DIR / "data" / "qml" / "generative_novelty_metrics.json"
@@ -69,11 +71,12 @@ def feasibility_rate(df: pd.DataFrame) -> float:
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Novelty comparison")
-    parser.add_argument("--quantum", default=str(QUANTUM_CSV))
+    parser.add_argument("--quantum", type=Path, default=None, help="Conditioned candidates (CSV or Parquet); default: the latest written")
     parser.add_argument("--classical", default=str(CLASSICAL_CSV))
     args = parser.parse_args()
 
-    quantum_df = pd.read_csv(args.quantum)
+    quantum_path = args.quantum or conditioned_candidates_path()
+    quantum_df = pd.concat(read_candidates(quantum_path, columns=["composition", "valid"]), ignore_index=True)
     allowed_elements = load_constraints_elements()
     element_index = {el: idx for idx, el in enumerate(allowed_elements)}
     vector_size = len(allowed_elements)
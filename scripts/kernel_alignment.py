@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Screen feature maps by centered kernel-target alignment on stratified subsamples."""
+from __future__ import annotations
+
+import argparse
+import itertools
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from quantum_kernels import LAYER_RANGES, FeatureMap, load_dataset, load_features, quantum_kernel
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+OUT_CSV = BASE_DIR / "data" / "qml" / "feature_map_alignment.csv"
+
+DEFAULT_BANDWIDTHS = (0.25, 0.5, 1.0)
+
+
+def centered_alignment(kernel: np.ndarray, y: np.ndarray) -> float:
+    """<K_c, y_c y_c^T>_F / (||K_c||_F ||y_c||^2) with K_c = HKH."""
+    row_mean = kernel.mean(axis=0)
+    centered = kernel - row_mean[None, :] - row_mean[:, None] + row_mean.mean()
+    y_c = y - y.mean()
+    denom = np.linalg.norm(centered) * (y_c @ y_c)
+    return float(y_c @ centered @ y_c / denom) if denom > 0 else 0.0
+
+
+def stratified_subsample(y: np.ndarray, size: int, rng: np.random.Generator, bins: int = 10) -> np.ndarray:
+    """``size`` rows drawn equally from ``bins`` rank strata, so every subsample spans the target range.
+
+    Strata are equal-count slices of the rank order with ties broken at random, so a target
+    value shared by many rows (a third of the band gaps are exactly 0) spreads over several
+    strata in proportion to its frequency instead of collapsing quantile edges.
+    """
+    n = len(y)
+    if size >= n:
+        return rng.permutation(n)
+    order = np.lexsort((rng.random(n), y))
+    strata = np.empty(n, dtype=np.int64)
+    strata[order] = np.arange(n) * bins // n
+    quota = np.full(bins, size // bins)
+    quota[rng.choice(bins, size=size % bins, replace=False)] += 1
+    chosen = [rng.choice(np.flatnonzero(strata == b), size=quota[b], replace=False) for b in range(bins)]
+    return rng.permutation(np.concatenate(chosen))
+
+
+def screen_feature_maps(
+    X: np.ndarray,
+    y: np.ndarray,
+    feature_maps: Sequence[FeatureMap],
+    subsample: int = 500,
+    min_rounds: int = 3,
+    max_rounds: int = 10,
+    confidence: float = 0.95,
+    top_k: int = 3,
+    random_state: int = 42,
+) -> pd.DataFrame:
+    """Rank feature maps by mean alignment over repeated stratified subsamples.
+
+    All surviving maps see the same subsample in a round, so comparisons are paired.
+    After ``min_rounds`` a map is dropped once its upper confidence bound falls below the
+    lower bound of the ``top_k``-th best map; screening ends when only ``top_k`` remain.
+    """
+    rng = np.random.default_rng(random_state)
+    scores: List[List[float]] = [[] for _ in feature_maps]
+    active = set(range(len(feature_maps)))
+    eliminated_at = {}
+
+    def t_crit(n: int) -> float:
+        return stats.t.ppf(0.5 + confidence / 2, n - 1)
+
+    for round_ in range(max_rounds):
+        idx = stratified_subsample(y, subsample, rng)
+        for i in sorted(active):
+            scores[i].append(centered_alignment(quantum_kernel(X[idx], feature_map=feature_maps[i]), y[idx]))
+        if round_ + 1 < min_rounds or len(active) <= top_k:
+            continue
+        n = round_ + 1
+        means = {i: np.mean(scores[i]) for i in active}
+        half = {i: t_crit(n) * np.std(scores[i], ddof=1) / np.sqrt(n) for i in active}
+        threshold = sorted((means[i] - half[i] for i in active), reverse=True)[top_k - 1]
+        for i in list(active):
+            if means[i] + half[i] < threshold:
+                active.discard(i)
+                eliminated_at[i] = n
+        if len(active) <= top_k:
+            break
+
+    records = []
+    for i, feature_map in enumerate(feature_maps):
+        values = np.asarray(scores[i])
+        n = len(values)
+        half = t_crit(n) * values.std(ddof=1) / np.sqrt(n) if n > 1 else float("nan")
+        records.append(
+            {
+                **feature_map.to_dict(),
+                "alignment_mean": float(values.mean()),
+                "alignment_std": float(values.std(ddof=1)) if n > 1 else float("nan"),
+                "ci_low": float(values.mean() - half),
+                "ci_high": float(values.mean() + half),
+                "rounds": n,
+                "eliminated_round": eliminated_at.get(i),
+            }
+        )
+    table = pd.DataFrame(records)
+    table["survived"] = table["eliminated_round"].isna()
+    table = table.sort_values(["survived", "alignment_mean"], ascending=False).reset_index(drop=True)
+    table.insert(0, "rank", np.arange(1, len(table) + 1))
+    table["selected_for_training"] = table["rank"] <= top_k
+    return table
+
+
+def default_feature_maps(bandwidths: Sequence[float] = DEFAULT_BANDWIDTHS) -> List[FeatureMap]:
+    return [
+        FeatureMap(family, layers=layers, bandwidth=bandwidth)
+        for family, layer_range in LAYER_RANGES.items()
+        for layers, bandwidth in itertools.product(layer_range, bandwidths)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rank feature maps by kernel-target alignment")
+    parser.add_argument("--bandwidths", type=float, nargs="+", default=list(DEFAULT_BANDWIDTHS))
+    parser.add_argument("--subsample", type=int, default=500)
+    parser.add_argument("--min-rounds", type=int, default=3)
+    parser.add_argument("--max-rounds", type=int, default=10)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--random-state", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=OUT_CSV)
+    args = parser.parse_args()
+
+    X, _ = load_features()
+    _, y, _ = load_dataset()
+    table = screen_feature_maps(
+        X,
+        y,
+        default_feature_maps(args.bandwidths),
+        args.subsample,
+        args.min_rounds,
+        args.max_rounds,
+        top_k=args.top_k,
+        random_state=args.random_state,
+    )
+    table.to_csv(args.output, index=False)
+    print(table.head(args.top_k).to_string(index=False))
+    print(f"Wrote alignment ranking to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Low-rank Nystrom and random-feature approximations for quantum and classical kernels."""
+from __future__ import annotations
+
+import argparse
+import json
+from typing import Callable, Optional
+
+import numpy as np
+
+from quantum_kernels import (
+    DEFAULT_BATCH_SIZE,
+    FAMILY_QUBITS,
+    FeatureMap,
+    encode_states,
+    fidelity_from_states,
+    iter_batches,
+    load_features,
+)
+
+KernelFn = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+LANDMARK_METHODS = ("uniform", "kmeans++", "leverage")
+
+
+def _unit_diagonal(X: np.ndarray) -> np.ndarray:
+    # Fidelity and RBF kernels both satisfy k(x, x) = 1.
+    return np.ones(len(X))
+
+
+def kmeanspp_landmarks(
+    X: np.ndarray, m: int, kernel_fn: KernelFn, rng: np.random.Generator, diag: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """k-means++ seeding in the kernel-induced feature space."""
+    diag = _unit_diagonal(X) if diag is None else diag
+    chosen = [int(rng.integers(len(X)))]
+    dist2 = np.maximum(diag + diag[chosen[0]] - 2 * kernel_fn(X, X[chosen[0]:chosen[0] + 1])[:, 0], 0.0)
+    for _ in range(1, m):
+        total = dist2.sum()
+        if total <= 0:
+            remaining = np.setdiff1d(np.arange(len(X)), chosen)
+            chosen.extend(rng.choice(remaining, size=m - len(chosen), replace=False).tolist())
+            break
+        idx = int(rng.choice(len(X), p=dist2 / total))
+        chosen.append(idx)
+        new = np.maximum(diag + diag[idx] - 2 * kernel_fn(X, X[idx:idx + 1])[:, 0], 0.0)
+        dist2 = np.minimum(dist2, new)
+    return np.asarray(chosen)
+
+
+def leverage_landmarks(
+    X: np.ndarray,
+    m: int,
+    kernel_fn: KernelFn,
+    rng: np.random.Generator,
+    reg: float = 1e-2,
+    sketch: Optional[int] = None,
+    diag: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Sample landmarks proportional to ridge leverage scores estimated from a uniform sketch."""
+    diag = _unit_diagonal(X) if diag is None else diag
+    sketch = min(len(X), sketch or 2 * m)
+    S = rng.choice(len(X), size=sketch, replace=False)
+    K_ss = kernel_fn(X[S], X[S])
+    chol = np.linalg.cholesky(K_ss + reg * len(S) * np.eye(len(S)))
+    scores = np.empty(len(X))
+    for block in iter_batches(len(X), DEFAULT_BATCH_SIZE):
+        v = np.linalg.solve(chol, kernel_fn(X[S], X[block]))
+        scores[block] = np.maximum(diag[block] - (v ** 2).sum(axis=0), 1e-12)
+    return rng.choice(len(X), size=m, replace=False, p=scores / scores.sum())
+
+
+class NystroemMap:
+    """Explicit features phi(x) with phi(x) . phi(y) ~ k(x, y) from m landmarks."""
+
+    def __init__(
+        self,
+        kernel_fn: KernelFn,
+        n_components: int = 500,
+        landmarks: str = "uniform",
+        random_state: int = 42,
+        rcond: float = 1e-10,
+    ) -> None:
+        if landmarks not in LANDMARK_METHODS:
+            raise ValueError(f"Unknown landmark method {landmarks!r}; expected one of {LANDMARK_METHODS}")
+        self.kernel_fn = kernel_fn
+        self.n_components = n_components
+        self.landmarks = landmarks
+        self.random_state = random_state
+        self.rcond = rcond
+
+    def fit(self, X: np.ndarray) -> "NystroemMap":
+        rng = np.random.default_rng(self.random_state)
+        m = min(self.n_components, len(X))
+        if self.landmarks == "uniform":
+            idx = rng.choice(len(X), size=m, replace=False)
+        elif self.landmarks == "kmeans++":
+            idx = kmeanspp_landmarks(X, m, self.kernel_fn, rng)
+        else:
+            idx = leverage_landmarks(X, m, self.kernel_fn, rng)
+        self.landmark_index_ = np.asarray(idx)
+        self.landmarks_ = X[self.landmark_index_]
+        K_mm = self.kernel_fn(self.landmarks_, self.landmarks_)
+        # The pseudo-inverse square root is taken in double precision even for float32 kernels.
+        eigvals, eigvecs = np.linalg.eigh(K_mm.astype(np.float64))
+        keep = eigvals > self.rcond * eigvals.max()
+        self.normalization_ = (eigvecs[:, keep] / np.sqrt(eigvals[keep])).astype(K_mm.dtype)
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        features = np.empty((len(X), self.normalization_.shape[1]), dtype=self.normalization_.dtype)
+        for block in iter_batches(len(X), DEFAULT_BATCH_SIZE):
+            features[block] = self.kernel_fn(X[block], self.landmarks_) @ self.normalization_
+        return features
+
+    def fit_transform(self, X: np.ndarray) -> np.ndarray:
+        return self.fit(X).transform(X)
+
+
+class RandomFourierMap:
+    """Random Fourier features for the shift-invariant RBF kernel exp(-gamma ||x - y||^2)."""
+
+    def __init__(self, gamma: float, n_components: int = 500, random_state: int = 42) -> None:
+        self.gamma = gamma
+        self.n_components = n_components
+        self.random_state = random_state
+
+    def fit(self, X: np.ndarray) -> "RandomFourierMap":
+        rng = np.random.default_rng(self.random_state)
+        self.weights_ = rng.normal(scale=np.sqrt(2 * self.gamma), size=(X.shape[1], self.n_components))
+        self.offsets_ = rng.uniform(0, 2 * np.pi, size=self.n_components)
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        return np.sqrt(2.0 / self.n_components) * np.cos(X @ self.weights_ + self.offsets_)
+
+    def fit_transform(self, X: np.ndarray) -> np.ndarray:
+        return self.fit(X).transform(X)
+
+
+def approximation_error(
+    features: np.ndarray, X: np.ndarray, kernel_fn: KernelFn, sample: int = 1000, random_state: int = 42
+) -> dict:
+    """Compare phi phi^T against the exact kernel on a random subsample of rows."""
+    rng = np.random.default_rng(random_state)
+    idx = rng.choice(len(X), size=min(sample, len(X)), replace=False)
+    exact = kernel_fn(X[idx], X[idx])
+    approx = features[idx] @ features[idx].T
+    return {
+        "sample": int(len(idx)),
+        "relative_frobenius_error": float(np.linalg.norm(exact - approx) / np.linalg.norm(exact)),
+        "max_abs_error": float(np.abs(exact - approx).max()),
+    }
+
+
+def rbf_kernel_fn(gamma: float) -> KernelFn:
+    def kernel(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+        sq = (A ** 2).sum(axis=1)[:, None] + (B ** 2).sum(axis=1)[None, :] - 2 * A @ B.T
+        return np.exp(-gamma * np.maximum(sq, 0.0))
+
+    return kernel
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure Nystrom approximation error for a feature-map kernel")
+    parser.add_argument("--family", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument("--components", type=int, nargs="*", default=[50, 100, 200, 400])
+    parser.add_argument("--landmarks", choices=LANDMARK_METHODS, default="kmeans++")
+    parser.add_argument("--sample", type=int, default=1000)
+    args = parser.parse_args()
+
+    X, _ = load_features()
+    feature_map = FeatureMap(args.family, layers=args.layers, bandwidth=args.bandwidth)
+    states = encode_states(X, feature_map)
+    report = {"feature_map": feature_map.to_dict(), "landmarks": args.landmarks, "errors": []}
+    for m in args.components:
+        phi = NystroemMap(fidelity_from_states, m, args.landmarks).fit_transform(states)
+        report["errors"].append({"components": m, **approximation_error(phi, states, fidelity_from_states, args.sample)})
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
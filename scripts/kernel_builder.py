@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Tiled, symmetry-aware kernel matrix construction with memory-mapped, resumable output."""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from quantum_kernels import FAMILY_QUBITS, FeatureMap, encode_states, fidelity_from_states, load_features
+
+DEFAULT_TILE_SIZE = 2048
+CHECKPOINT_SECONDS = 30.0
+
+TileFn = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+def _fingerprint(A: np.ndarray, B: Optional[np.ndarray], tag: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for arr in (A, B):
+        if arr is None:
+            digest.update(b"symmetric")
+            continue
+        arr = np.ascontiguousarray(arr)
+        digest.update(str((arr.shape, arr.dtype.str)).encode())
+        digest.update(arr.view(np.uint8).reshape(-1))
+    digest.update(tag.encode())
+    return digest.hexdigest()
+
+
+def tile_grid(n_rows: int, n_cols: int, tile_size: int, symmetric: bool) -> Iterator[Tuple[int, int]]:
+    """Tile coordinates to evaluate; symmetric builds only visit the upper triangle."""
+    for i in range(-(-n_rows // tile_size)):
+        for j in range(i if symmetric else 0, -(-n_cols // tile_size)):
+            yield i, j
+
+
+def _open_outputs(
+    out_path: Path, shape: Tuple[int, int], dtype: np.dtype, tile_shape: Tuple[int, int], meta: dict
+) -> Tuple[np.ndarray, np.ndarray]:
+    tiles_path = out_path.with_suffix(".tiles.npy")
+    meta_path = out_path.with_suffix(".json")
+    resumable = out_path.exists() and tiles_path.exists() and meta_path.exists()
+    if resumable:
+        previous = json.loads(meta_path.read_text())
+        resumable = previous == meta
+    if resumable:
+        kernel = np.load(out_path, mmap_mode="r+")
+        tiles = np.load(tiles_path, mmap_mode="r+")
+        return kernel, tiles
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    kernel = np.lib.format.open_memmap(out_path, mode="w+", dtype=dtype, shape=shape)
+    tiles = np.lib.format.open_memmap(tiles_path, mode="w+", dtype=bool, shape=tile_shape)
+    meta_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return kernel, tiles
+
+
+def build_kernel_matrix(
+    A: np.ndarray,
+    B: Optional[np.ndarray] = None,
+    tile_fn: TileFn = fidelity_from_states,
+    out_path: Optional[Path] = None,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    dtype: str | np.dtype = np.float64,
+    n_jobs: Optional[int] = None,
+    tag: str = "",
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Evaluate tile_fn over (A, B) tiles in parallel threads.
+
+    With ``B=None`` the Gram matrix of ``A`` is built from upper-triangle tiles only and
+    mirrored. With ``out_path`` the result is an ``.npy`` memmap plus a ``.tiles.npy``
+    completion map, so rerunning an interrupted build only evaluates the missing tiles.
+    ``out`` fills a preallocated in-memory array (e.g. a shared-memory buffer) instead.
+    """
+    symmetric = B is None
+    B_rows = A if symmetric else B
+    dtype = np.dtype(dtype)
+    shape = (len(A), len(B_rows))
+    tile_shape = (-(-shape[0] // tile_size), -(-shape[1] // tile_size))
+
+    if out_path is None:
+        kernel = np.empty(shape, dtype=dtype) if out is None else out
+        tiles = np.zeros(tile_shape, dtype=bool)
+    else:
+        meta = {
+            "shape": list(shape),
+            "dtype": dtype.str,
+            "tile_size": tile_size,
+            "symmetric": symmetric,
+            "fingerprint": _fingerprint(A, B, tag),
+        }
+        kernel, tiles = _open_outputs(Path(out_path), shape, dtype, tile_shape, meta)
+
+    todo = [(i, j) for i, j in tile_grid(shape[0], shape[1], tile_size, symmetric) if not tiles[i, j]]
+
+    def compute(i: int, j: int) -> Tuple[int, int, np.ndarray]:
+        rows = slice(i * tile_size, min((i + 1) * tile_size, shape[0]))
+        cols = slice(j * tile_size, min((j + 1) * tile_size, shape[1]))
+        return i, j, tile_fn(A[rows], B_rows[cols]).astype(dtype, copy=False)
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    pending: list[Tuple[int, int]] = []
+    last_checkpoint = time.monotonic()
+
+    def checkpoint() -> None:
+        # Tiles are only marked complete once their data has been flushed to disk.
+        if isinstance(kernel, np.memmap):
+            kernel.flush()
+        for i, j in pending:
+            tiles[i, j] = True
+        if isinstance(tiles, np.memmap):
+            tiles.flush()
+        pending.clear()
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        queue = iter(todo)
+        in_flight = set()
+        while True:
+            while len(in_flight) < 2 * n_jobs:
+                coords = next(queue, None)
+                if coords is None:
+                    break
+                in_flight.add(pool.submit(compute, *coords))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, j, tile = future.result()
+                r0, c0 = i * tile_size, j * tile_size
+                kernel[r0:r0 + tile.shape[0], c0:c0 + tile.shape[1]] = tile
+                if symmetric and i != j:
+                    kernel[c0:c0 + tile.shape[1], r0:r0 + tile.shape[0]] = tile.T
+                pending.append((i, j))
+            if out_path is not None and time.monotonic() - last_checkpoint > CHECKPOINT_SECONDS:
+                checkpoint()
+                last_checkpoint = time.monotonic()
+    checkpoint()
+    return kernel
+
+
+def build_quantum_kernel(
+    X_a: np.ndarray,
+    X_b: Optional[np.ndarray] = None,
+    feature_map: Optional[FeatureMap] = None,
+    out_path: Optional[Path] = None,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    dtype: str | np.dtype = np.float64,
+    n_jobs: Optional[int] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Fidelity kernel of a feature map: states are encoded once, tiles are state-block products.
+
+    A float32 ``dtype`` also stores the states as complex64, so tiles are single-precision GEMMs.
+    """
+    if feature_map is None:
+        feature_map = FeatureMap("composition_encoding")
+    precision = np.dtype(dtype).name
+    states_a = encode_states(X_a, feature_map, precision=precision)
+    states_b = None if X_b is None else encode_states(X_b, feature_map, precision=precision)
+    kernel = build_kernel_matrix(
+        states_a,
+        states_b,
+        fidelity_from_states,
+        out_path=out_path,
+        tile_size=tile_size,
+        dtype=dtype,
+        n_jobs=n_jobs,
+        tag=json.dumps(feature_map.to_dict(), sort_keys=True),
+        out=out,
+    )
+    if X_b is None:
+        np.fill_diagonal(kernel, 1.0)
+    return kernel
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build a tiled quantum kernel matrix on disk")
+    parser.add_argument("--family", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument("--samples", type=int, default=None)
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float32")
+    parser.add_argument("--n-jobs", type=int, default=None)
+    parser.add_argument("--output", type=Path, required=True, help="Target .npy file (resumed if present)")
+    args = parser.parse_args()
+
+    X, _ = load_features()
+    if args.samples is not None:
+        X = X[: args.samples]
+    feature_map = FeatureMap(args.family, layers=args.layers, bandwidth=args.bandwidth)
+    start = time.perf_counter()
+    kernel = build_quantum_kernel(
+        X, feature_map=feature_map, out_path=args.output, tile_size=args.tile_size, dtype=args.dtype, n_jobs=args.n_jobs
+    )
+    summary = {
+        "output": str(args.output),
+        "shape": list(kernel.shape),
+        "dtype": str(kernel.dtype),
+        "seconds": time.perf_counter() - start,
+        "feature_map": feature_map.to_dict(),
+    }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Persistent on-disk kernel cache keyed by data fingerprint, row indices and kernel spec."""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from kernel_builder import DEFAULT_TILE_SIZE, build_quantum_kernel
+from quantum_kernels import FeatureMap
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+DEFAULT_CACHE_DIR = BASE_DIR / "data" / "kernel_cache"
+DEFAULT_BUDGET_BYTES = 16 * 1024 ** 3
+
+BuildFn = Callable[[np.ndarray, Optional[np.ndarray], Path], np.ndarray]
+
+
+def array_fingerprint(arr: np.ndarray) -> str:
+    arr = np.ascontiguousarray(arr)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((arr.shape, arr.dtype.str)).encode())
+    digest.update(arr.view(np.uint8).reshape(-1))
+    return digest.hexdigest()
+
+
+def _positions(stored: np.ndarray, wanted: np.ndarray) -> Optional[np.ndarray]:
+    """Positions of ``wanted`` indices inside ``stored``, or None if any are missing."""
+    order = np.argsort(stored, kind="stable")
+    loc = np.searchsorted(stored, wanted, sorter=order)
+    loc = np.clip(loc, 0, len(stored) - 1)
+    pos = order[loc]
+    if not np.array_equal(stored[pos], wanted):
+        return None
+    return pos
+
+
+class KernelCache:
+    """LRU cache of kernel blocks stored as ``.npy`` memmaps under a byte budget.
+
+    Entries are keyed by (dataset fingerprint, row-index set, column-index set, kernel
+    spec, precision). A request whose rows and columns are covered by a cached block
+    with the same dataset and spec is served as a sub-matrix of that block.
+    """
+
+    def __init__(self, root: Path = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_BUDGET_BYTES) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / "index.json"
+        self._dataset_fingerprints: Dict[int, tuple[np.ndarray, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _load_index(self) -> Dict[str, dict]:
+        if not self.index_path.exists():
+            return {}
+        return json.loads(self.index_path.read_text())
+
+    def _save_index(self, index: Dict[str, dict]) -> None:
+        tmp = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(index, indent=2), encoding="utf-8")
+        os.replace(tmp, self.index_path)
+
+    def _dataset_fingerprint(self, X: np.ndarray) -> str:
+        cached = self._dataset_fingerprints.get(id(X))
+        if cached is not None and cached[0] is X:
+            return cached[1]
+        fingerprint = array_fingerprint(X)
+        self._dataset_fingerprints[id(X)] = (X, fingerprint)
+        return fingerprint
+
+    def _touch(self, index: Dict[str, dict], key: str) -> None:
+        index[key]["last_access"] = time.time()
+        self._save_index(index)
+
+    def _evict(self, index: Dict[str, dict], keep: str) -> None:
+        total = sum(entry["bytes"] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= index[key]["bytes"]
+            for suffix in (".npy", ".rows.npy", ".cols.npy", ".tiles.npy", ".json"):
+                (self.root / f"{key}{suffix}").unlink(missing_ok=True)
+            del index[key]
+
+    def get(
+        self,
+        X: np.ndarray,
+        rows: np.ndarray,
+        cols: Optional[np.ndarray],
+        spec: dict,
+        build_fn: BuildFn,
+        precision: str = "float64",
+    ) -> np.ndarray:
+        """Kernel between X[rows] and X[cols] (X[rows] with itself when cols is None)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        symmetric = cols is None
+        cols = rows if symmetric else np.asarray(cols, dtype=np.int64)
+        dataset = self._dataset_fingerprint(X)
+        spec_json = json.dumps(spec, sort_keys=True)
+        rows_fp, cols_fp = array_fingerprint(rows), array_fingerprint(cols)
+        key = hashlib.blake2b(
+            "|".join([dataset, rows_fp, cols_fp, spec_json, precision]).encode(), digest_size=16
+        ).hexdigest()
+
+        index = self._load_index()
+        if key in index and (self.root / f"{key}.npy").exists():
+            self.hits += 1
+            self._touch(index, key)
+            return np.load(self.root / f"{key}.npy", mmap_mode="r")
+
+        for other, entry in sorted(index.items(), key=lambda item: item[1]["bytes"]):
+            if (entry["dataset"], entry["spec"], entry["precision"]) != (dataset, spec_json, precision):
+                continue
+            stored_rows = np.load(self.root / f"{other}.rows.npy")
+            stored_cols = np.load(self.root / f"{other}.cols.npy")
+            row_pos, col_pos = _positions(stored_rows, rows), _positions(stored_cols, cols)
+            transposed = False
+            if row_pos is None or col_pos is None:
+                # Kernels are symmetric in their arguments, so K(b, a) serves K(a, b).T.
+                row_pos, col_pos = _positions(stored_cols, rows), _positions(stored_rows, cols)
+                transposed = True
+                if row_pos is None or col_pos is None:
+                    continue
+            self.hits += 1
+            self._touch(index, other)
+            block = np.load(self.root / f"{other}.npy", mmap_mode="r")
+            if transposed:
+                return block[np.ix_(col_pos, row_pos)].T
+            return block[np.ix_(row_pos, col_pos)]
+
+        self.misses += 1
+        out_path = self.root / f"{key}.npy"
+        kernel = build_fn(X[rows], None if symmetric else X[cols], out_path)
+        np.save(self.root / f"{key}.rows.npy", rows)
+        np.save(self.root / f"{key}.cols.npy", cols)
+        index = self._load_index()
+        index[key] = {
+            "dataset": dataset,
+            "spec": spec_json,
+            "precision": precision,
+            "rows": int(len(rows)),
+            "cols": int(len(cols)),
+            "symmetric": symmetric,
+            "bytes": int(kernel.nbytes),
+            "created": time.time(),
+            "last_access": time.time(),
+        }
+        self._evict(index, keep=key)
+        self._save_index(index)
+        return kernel
+
+    def quantum_kernel(
+        self,
+        X: np.ndarray,
+        rows: np.ndarray,
+        cols: Optional[np.ndarray],
+        feature_map: FeatureMap,
+        dtype: str = "float64",
+        tile_size: int = DEFAULT_TILE_SIZE,
+        n_jobs: Optional[int] = None,
+    ) -> np.ndarray:
+        def build(A: np.ndarray, B: Optional[np.ndarray], out_path: Path) -> np.ndarray:
+            return build_quantum_kernel(
+                A, B, feature_map=feature_map, out_path=out_path, tile_size=tile_size, dtype=dtype, n_jobs=n_jobs
+            )
+
+        spec = {"kernel": "fidelity", **feature_map.to_dict()}
+        return self.get(X, rows, cols, spec, build, precision=np.dtype(dtype).name)
+
+    def summary(self) -> dict:
+        index = self._load_index()
+        return {
+            "root": str(self.root),
+            "entries": len(index),
+            "bytes": int(sum(entry["bytes"] for entry in index.values())),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect or prune the kernel cache")
+    parser.add_argument("--root", type=Path, default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--budget-gb", type=float, default=DEFAULT_BUDGET_BYTES / 1024 ** 3)
+    parser.add_argument("--prune", action="store_true", help="Evict least recently used entries over the budget")
+    args = parser.parse_args()
+
+    cache = KernelCache(args.root, int(args.budget_gb * 1024 ** 3))
+    if args.prune:
+        index = cache._load_index()
+        cache._evict(index, keep="")
+        cache._save_index(index)
+    print(json.dumps(cache.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
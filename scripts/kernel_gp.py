@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""Exact Gaussian process regression on precomputed kernels with shared factorizations."""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, cholesky, solve_triangular
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import Kernel
+
+from kernel_approximation import kmeanspp_landmarks
+from kernel_builder import build_kernel_matrix
+from quantum_kernels import DEFAULT_BATCH_SIZE, FAMILY_QUBITS, FeatureMap, iter_batches, load_features, quantum_kernel
+
+KernelFn = Callable[[np.ndarray, np.ndarray], np.ndarray]
+DiagFn = Callable[[np.ndarray], np.ndarray]
+
+DEFAULT_BLOCK_SIZE = 2048
+
+
+def unit_diagonal(X: np.ndarray) -> np.ndarray:
+    return np.ones(len(X))
+
+
+def _normalize_targets(Y: np.ndarray, normalize_y: bool) -> tuple[np.ndarray, np.ndarray, np.ndarray, bool]:
+    Y = np.asarray(Y, dtype=float)
+    single = Y.ndim == 1
+    Y = Y.reshape(len(Y), -1)
+    if normalize_y:
+        mean = Y.mean(axis=0)
+        scale = np.where(Y.std(axis=0) > 0, Y.std(axis=0), 1.0)
+    else:
+        mean, scale = np.zeros(Y.shape[1]), np.ones(Y.shape[1])
+    return (Y - mean) / scale, mean, scale, single
+
+
+class ExactKernelGP:
+    """GP posterior from a precomputed Gram matrix, solved for every target column at once.
+
+    The Cholesky factor of ``K + noise * I`` depends only on the inputs, so all targets are
+    handled as right-hand sides of one factorization. With ``normalize_y`` each target is
+    centred and scaled to unit variance, so the kernel acts as a correlation prior and a
+    single ``noise`` level is shared across targets.
+    """
+
+    def __init__(self, noise: float = 1e-3, normalize_y: bool = True) -> None:
+        self.noise = noise
+        self.normalize_y = normalize_y
+
+    def fit(self, K: np.ndarray, Y: np.ndarray) -> "ExactKernelGP":
+        self.Y_, self.y_mean_, self.y_scale_, self.single_target_ = _normalize_targets(Y, self.normalize_y)
+        # Kernels may be float32; the factorization itself always runs in float64.
+        K = np.array(K, dtype=np.float64)
+        K[np.diag_indices_from(K)] += self.noise
+        self.L_ = cho_factor(K, lower=True, overwrite_a=True)
+        self.alpha_ = cho_solve(self.L_, self.Y_)
+        return self
+
+    def _shape(self, values: np.ndarray) -> np.ndarray:
+        return values[:, 0] if self.single_target_ else values
+
+    def predict(
+        self,
+        K_cross: np.ndarray,
+        K_diag: Optional[np.ndarray] = None,
+        return_std: bool = False,
+        include_noise: bool = True,
+    ) -> np.ndarray | tuple[np.ndarray, np.ndarray]:
+        """Posterior mean (and std) for test rows given ``K_cross = k(X_test, X_train)``.
+
+        ``K_diag`` defaults to ones, which holds for fidelity and RBF kernels. The std is
+        that of a new observation unless ``include_noise`` is False.
+        """
+        mean = self._shape(K_cross @ self.alpha_ * self.y_scale_ + self.y_mean_)
+        if not return_std:
+            return mean
+        v = solve_triangular(self.L_[0], K_cross.T, lower=True, check_finite=False)
+        prior = np.ones(len(K_cross)) if K_diag is None else K_diag
+        # The latent variance is shared; each target rescales it by its own variance.
+        var = np.maximum(prior - (v ** 2).sum(axis=0), 0.0) + (self.noise if include_noise else 0.0)
+        return mean, self._shape(np.sqrt(var)[:, None] * self.y_scale_)
+
+    def log_marginal_likelihood(self) -> np.ndarray:
+        """Per-target log evidence of the normalized targets."""
+        n = len(self.Y_)
+        log_det = 2 * np.log(np.diag(self.L_[0])).sum()
+        fit = (self.Y_ * self.alpha_).sum(axis=0)
+        return -0.5 * (fit + log_det + n * np.log(2 * np.pi))
+
+
+def blocked_cholesky(A: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+    """Overwrite the lower triangle of SPD ``A`` (e.g. a memmap) with its Cholesky factor.
+
+    Right-looking block algorithm: only a handful of ``block_size`` squares are in memory at
+    a time, so ``A`` can be larger than RAM. The upper triangle is left untouched.
+    """
+    blocks = list(iter_batches(len(A), block_size))
+    for k, bk in enumerate(blocks):
+        L_kk = cholesky(np.asarray(A[bk, bk]), lower=True)
+        A[bk, bk] = L_kk
+        trailing = blocks[k + 1:]
+        for bi in trailing:
+            A[bi, bk] = solve_triangular(L_kk, np.asarray(A[bi, bk]).T, lower=True).T
+        for i, bi in enumerate(trailing):
+            panel = np.asarray(A[bi, bk])
+            for bj in trailing[: i + 1]:
+                A[bi, bj] -= panel @ np.asarray(A[bj, bk]).T
+    return A
+
+
+def _block_tril(L: np.ndarray, bi: slice, bj: slice) -> np.ndarray:
+    block = np.asarray(L[bi, bj])
+    return np.tril(block) if bi == bj else block
+
+
+def blocked_forward(L: np.ndarray, B: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+    """Solve ``L Z = B`` for a blocked lower factor, streaming ``L`` one block at a time."""
+    Z = np.array(B, dtype=np.float64)
+    blocks = list(iter_batches(len(L), block_size))
+    for i, bi in enumerate(blocks):
+        for bj in blocks[:i]:
+            Z[bi] -= np.asarray(L[bi, bj]) @ Z[bj]
+        Z[bi] = solve_triangular(_block_tril(L, bi, bi), Z[bi], lower=True, check_finite=False)
+    return Z
+
+
+def blocked_backward(L: np.ndarray, Z: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+    """Solve ``L^T X = Z`` for a blocked lower factor."""
+    X = np.array(Z, dtype=np.float64)
+    blocks = list(iter_batches(len(L), block_size))
+    for i in reversed(range(len(blocks))):
+        bi = blocks[i]
+        for bj in blocks[i + 1:]:
+            X[bi] -= np.asarray(L[bj, bi]).T @ X[bj]
+        X[bi] = solve_triangular(_block_tril(L, bi, bi), X[bi], lower=True, trans="T", check_finite=False)
+    return X
+
+
+class BlockedExactGP:
+    """Exact GP whose covariance and Cholesky factor live in a memory-mapped ``.npy`` file.
+
+    The covariance is written tile by tile with ``kernel_builder.build_kernel_matrix`` and
+    factored in place by ``blocked_cholesky``; solves and predictive variances stream the
+    factor block by block, so the full training set is used without an in-RAM n x n matrix.
+    """
+
+    def __init__(
+        self,
+        kernel_fn: KernelFn,
+        diag_fn: DiagFn = unit_diagonal,
+        noise: float = 1e-3,
+        normalize_y: bool = True,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        workdir: Optional[Path] = None,
+    ) -> None:
+        self.kernel_fn = kernel_fn
+        self.diag_fn = diag_fn
+        self.noise = noise
+        self.normalize_y = normalize_y
+        self.block_size = block_size
+        self.workdir = workdir
+
+    def fit(self, X: np.ndarray, Y: np.ndarray) -> "BlockedExactGP":
+        self.Y_, self.y_mean_, self.y_scale_, self.single_target_ = _normalize_targets(Y, self.normalize_y)
+        if self.workdir is None:
+            self._tmp = tempfile.TemporaryDirectory(prefix="blocked_gp_")
+            workdir = Path(self._tmp.name)
+        else:
+            workdir = Path(self.workdir)
+        self.X_ = X
+        self.L_ = build_kernel_matrix(
+            X, None, self.kernel_fn, out_path=workdir / "covariance.npy", tile_size=self.block_size, dtype=np.float64
+        )
+        for block in iter_batches(len(X), self.block_size):
+            rows = np.arange(block.start, block.stop)
+            self.L_[rows, rows] += self.noise
+        blocked_cholesky(self.L_, self.block_size)
+        self.alpha_ = blocked_backward(self.L_, blocked_forward(self.L_, self.Y_, self.block_size), self.block_size)
+        return self
+
+    def predict(
+        self, X: np.ndarray, return_std: bool = False, include_noise: bool = True, batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> np.ndarray | tuple[np.ndarray, np.ndarray]:
+        mean = np.empty((len(X), self.Y_.shape[1]))
+        std = np.empty(len(X))
+        for batch in iter_batches(len(X), batch_size):
+            K_cross = np.empty((batch.stop - batch.start, len(self.X_)))
+            for cols in iter_batches(len(self.X_), self.block_size):
+                K_cross[:, cols] = self.kernel_fn(X[batch], self.X_[cols])
+            mean[batch] = K_cross @ self.alpha_
+            if return_std:
+                v = blocked_forward(self.L_, K_cross.T, self.block_size)
+                var = np.maximum(self.diag_fn(X[batch]) - (v ** 2).sum(axis=0), 0.0)
+                std[batch] = np.sqrt(var + (self.noise if include_noise else 0.0))
+        mean = mean * self.y_scale_ + self.y_mean_
+        mean = mean[:, 0] if self.single_target_ else mean
+        if not return_std:
+            return mean
+        std = std[:, None] * self.y_scale_
+        return mean, std[:, 0] if self.single_target_ else std
+
+    def log_marginal_likelihood(self) -> np.ndarray:
+        n = len(self.Y_)
+        log_det = 0.0
+        for block in iter_batches(n, self.block_size):
+            rows = np.arange(block.start, block.stop)
+            log_det += 2 * np.log(np.asarray(self.L_[rows, rows])).sum()
+        return -0.5 * ((self.Y_ * self.alpha_).sum(axis=0) + log_det + n * np.log(2 * np.pi))
+
+
+class SparseGP:
+    """Inducing-point GP (Titsias collapsed bound / SGPR) with batched predictions.
+
+    ``K_mn`` is never materialised: training streams row batches to accumulate the m x m
+    statistics ``A A^T`` and ``A y``, so memory is O(m^2 + batch * m) for any n.
+    Inducing points are k-means++ landmarks in the kernel feature space.
+    """
+
+    def __init__(
+        self,
+        kernel_fn: KernelFn,
+        diag_fn: DiagFn = unit_diagonal,
+        inducing: int = 500,
+        noise: float = 1e-3,
+        normalize_y: bool = True,
+        jitter: float = 1e-6,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        random_state: int = 42,
+    ) -> None:
+        self.kernel_fn = kernel_fn
+        self.diag_fn = diag_fn
+        self.inducing = inducing
+        self.noise = noise
+        self.normalize_y = normalize_y
+        self.jitter = jitter
+        self.batch_size = batch_size
+        self.random_state = random_state
+
+    def fit(self, X: np.ndarray, Y: np.ndarray, Z: Optional[np.ndarray] = None) -> "SparseGP":
+        self.Y_, self.y_mean_, self.y_scale_, self.single_target_ = _normalize_targets(Y, self.normalize_y)
+        if Z is None:
+            rng = np.random.default_rng(self.random_state)
+            idx = kmeanspp_landmarks(X, min(self.inducing, len(X)), self.kernel_fn, rng, self.diag_fn(X))
+            Z = X[idx]
+        self.Z_ = Z
+        K_mm = np.asarray(self.kernel_fn(Z, Z), dtype=np.float64)
+        K_mm[np.diag_indices_from(K_mm)] += self.jitter * max(np.trace(K_mm) / len(Z), 1.0)
+        self.L_mm_ = cholesky(K_mm, lower=True)
+        sigma = np.sqrt(self.noise)
+        AAt = np.zeros((len(Z), len(Z)))
+        Ay = np.zeros((len(Z), self.Y_.shape[1]))
+        trace_knn = 0.0
+        for batch in iter_batches(len(X), self.batch_size):
+            A = solve_triangular(self.L_mm_, np.asarray(self.kernel_fn(Z, X[batch]), dtype=np.float64), lower=True) / sigma
+            AAt += A @ A.T
+            Ay += A @ self.Y_[batch]
+            trace_knn += float(self.diag_fn(X[batch]).sum())
+        self.L_B_ = cholesky(np.eye(len(Z)) + AAt, lower=True)
+        self.c_ = solve_triangular(self.L_B_, Ay, lower=True) / sigma
+        n = len(X)
+        # Collapsed evidence lower bound per target.
+        self.elbo_ = (
+            -0.5 * n * np.log(2 * np.pi * self.noise)
+            - np.log(np.diag(self.L_B_)).sum()
+            - 0.5 * (self.Y_ ** 2).sum(axis=0) / self.noise
+            + 0.5 * (self.c_ ** 2).sum(axis=0)
+            - 0.5 * trace_knn / self.noise
+            + 0.5 * np.trace(AAt)
+        )
+        return self
+
+    def predict(
+        self, X: np.ndarray, return_std: bool = False, include_noise: bool = True
+    ) -> np.ndarray | tuple[np.ndarray, np.ndarray]:
+        mean = np.empty((len(X), self.Y_.shape[1]))
+        std = np.empty(len(X))
+        for batch in iter_batches(len(X), self.batch_size):
+            tmp1 = solve_triangular(self.L_mm_, np.asarray(self.kernel_fn(self.Z_, X[batch]), dtype=np.float64), lower=True)
+            tmp2 = solve_triangular(self.L_B_, tmp1, lower=True)
+            mean[batch] = tmp2.T @ self.c_
+            if return_std:
+                var = self.diag_fn(X[batch]) - (tmp1 ** 2).sum(axis=0) + (tmp2 ** 2).sum(axis=0)
+                std[batch] = np.sqrt(np.maximum(var, 0.0) + (self.noise if include_noise else 0.0))
+        mean = mean * self.y_scale_ + self.y_mean_
+        mean = mean[:, 0] if self.single_target_ else mean
+        if not return_std:
+            return mean
+        std = std[:, None] * self.y_scale_
+        return mean, std[:, 0] if self.single_target_ else std
+
+
+class IncrementalGP:
+    """GP regressor that grows by block Cholesky updates instead of refitting.
+
+    ``fit`` optimises the sklearn ``kernel`` hyperparameters (as GaussianProcessRegressor
+    does) and factors ``K + alpha I``. ``update`` appends ``k`` labeled rows in
+    O(n^2 k): ``L21 = K12^T L11^-T`` and ``L22 = chol(K22 - L21 L21^T)``, keeping the
+    hyperparameters fixed. Every ``reoptimize_every`` updates the model is refitted from
+    scratch with a fresh optimisation (0 disables re-optimisation). ``optimizer``, a
+    callable ``(X, y) -> Kernel`` such as ``HyperparameterService.fit``, replaces the
+    sklearn optimisation. ``predict`` mirrors GaussianProcessRegressor.predict with
+    ``normalize_y=False``.
+    """
+
+    def __init__(
+        self,
+        kernel: Kernel,
+        alpha: float = 1e-10,
+        reoptimize_every: int = 5,
+        capacity: int = 1024,
+        random_state: Optional[int] = None,
+        optimizer: Optional[Callable[[np.ndarray, np.ndarray], Kernel]] = None,
+    ) -> None:
+        self.kernel = kernel
+        self.alpha = alpha
+        self.reoptimize_every = reoptimize_every
+        self.capacity = capacity
+        self.random_state = random_state
+        self.optimizer = optimizer
+
+    def fit(self, X: np.ndarray, y: np.ndarray) -> "IncrementalGP":
+        if self.optimizer is not None:
+            self.kernel_ = self.optimizer(X, y)
+        else:
+            gpr = GaussianProcessRegressor(kernel=self.kernel, alpha=self.alpha, random_state=self.random_state)
+            self.kernel_ = gpr.fit(X, y).kernel_
+        self.n_ = len(X)
+        size = max(self.capacity, self.n_)
+        self.X_ = np.empty((size, X.shape[1]))
+        self.y_ = np.empty(size)
+        self.L_ = np.zeros((size, size))
+        self.X_[: self.n_], self.y_[: self.n_] = X, y
+        K = self.kernel_(X)
+        K[np.diag_indices_from(K)] += self.alpha
+        self.L_[: self.n_, : self.n_] = cholesky(K, lower=True)
+        self.updates_ = 0
+        self.refits_ = getattr(self, "refits_", 0) + 1
+        self._solve()
+        return self
+
+    def _reserve(self, extra: int) -> None:
+        size = len(self.y_)
+        if self.n_ + extra <= size:
+            return
+        size = max(2 * size, self.n_ + extra)
+        X, y, L = np.empty((size, self.X_.shape[1])), np.empty(size), np.zeros((size, size))
+        X[: self.n_], y[: self.n_] = self.X_[: self.n_], self.y_[: self.n_]
+        L[: self.n_, : self.n_] = self.L_[: self.n_, : self.n_]
+        self.X_, self.y_, self.L_ = X, y, L
+
+    def _solve(self) -> None:
+        L = self.L_[: self.n_, : self.n_]
+        self.alpha_ = cho_solve((L, True), self.y_[: self.n_], check_finite=False)
+
+    def update(self, X_new: np.ndarray, y_new: np.ndarray) -> "IncrementalGP":
+        """Append labeled rows; re-optimises instead when the schedule says so."""
+        if self.reoptimize_every and self.updates_ + 1 >= self.reoptimize_every:
+            X = np.vstack([self.X_[: self.n_], X_new])
+            return self.fit(X, np.concatenate([self.y_[: self.n_], y_new]))
+        self._reserve(len(X_new))
+        n, k = self.n_, len(X_new)
+        L11 = self.L_[:n, :n]
+        L21 = solve_triangular(L11, self.kernel_(self.X_[:n], X_new), lower=True, check_finite=False).T
+        K22 = self.kernel_(X_new)
+        K22[np.diag_indices_from(K22)] += self.alpha
+        self.L_[n:n + k, :n] = L21
+        self.L_[n:n + k, n:n + k] = cholesky(K22 - L21 @ L21.T, lower=True)
+        self.X_[n:n + k], self.y_[n:n + k] = X_new, y_new
+        self.n_ += k
+        self.updates_ += 1
+        self._solve()
+        return self
+
+    def predict(self, X: np.ndarray, return_std: bool = False) -> np.ndarray | tuple[np.ndarray, np.ndarray]:
+        K_cross = self.kernel_(X, self.X_[: self.n_])
+        mean = K_cross @ self.alpha_
+        if not return_std:
+            return mean
+        v = solve_triangular(self.L_[: self.n_, : self.n_], K_cross.T, lower=True, check_finite=False)
+        return mean, np.sqrt(np.maximum(self.kernel_.diag(X) - (v ** 2).sum(axis=0), 0.0))
+
+
+def linear_kernel(A: np.ndarray, B: np.ndarray, sigma_0: float = 1.0) -> np.ndarray:
+    """sklearn's DotProduct kernel: sigma_0^2 + a . b."""
+    return A @ B.T + sigma_0 ** 2
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time one shared factorization against per-target refits")
+    parser.add_argument("--family", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument("--samples", type=int, default=3000)
+    parser.add_argument("--targets", type=int, default=3)
+    args = parser.parse_args()
+
+    X, _ = load_features()
+    X = X[: args.samples]
+    K = quantum_kernel(X, feature_map=FeatureMap(args.family, layers=args.layers, bandwidth=args.bandwidth))
+    Y = np.random.default_rng(0).normal(size=(len(X), args.targets))
+    start = time.perf_counter()
+    ExactKernelGP(noise=0.1).fit(K, Y)
+    shared = time.perf_counter() - start
+    start = time.perf_counter()
+    for t in range(args.targets):
+        ExactKernelGP(noise=0.1).fit(K, Y[:, t])
+    separate = time.perf_counter() - start
+    print(json.dumps({"samples": len(X), "targets": args.targets, "shared_seconds": shared, "separate_seconds": separate}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
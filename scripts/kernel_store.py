@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Incrementally grown kernel columns for pool-based active learning."""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Callable
+
+import numpy as np
+
+from quantum_kernels import (
+    DEFAULT_BATCH_SIZE,
+    FAMILY_QUBITS,
+    FeatureMap,
+    encode_states,
+    fidelity_from_states,
+    iter_batches,
+    load_features,
+)
+
+KernelFn = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+class IncrementalKernelStore:
+    """Kernel values of every row against the labeled set, one column per labeled sample.
+
+    Labeling ``b`` new rows evaluates only ``k(X, X_new)`` (``n * b`` entries); the
+    labeled Gram matrix and the pool-vs-labeled cross kernel are both slices of the
+    stored columns, so nothing already computed is ever recomputed.
+    """
+
+    def __init__(self, X: np.ndarray, kernel_fn: KernelFn, capacity: int = 256, dtype: str | np.dtype = np.float64) -> None:
+        self.X = X
+        self.kernel_fn = kernel_fn
+        self.columns = np.empty((len(X), capacity), dtype=dtype)
+        self.labeled = np.empty(capacity, dtype=np.int64)
+        self.is_labeled = np.zeros(len(X), dtype=bool)
+        self.size = 0
+        self.entries_computed = 0
+
+    def _reserve(self, extra: int) -> None:
+        capacity = self.columns.shape[1]
+        if self.size + extra <= capacity:
+            return
+        capacity = max(2 * capacity, self.size + extra)
+        columns = np.empty((len(self.X), capacity), dtype=self.columns.dtype)
+        columns[:, : self.size] = self.columns[:, : self.size]
+        labeled = np.empty(capacity, dtype=np.int64)
+        labeled[: self.size] = self.labeled[: self.size]
+        self.columns, self.labeled = columns, labeled
+
+    def add(self, indices: np.ndarray) -> None:
+        """Move rows from the pool to the labeled set, computing only their kernel columns."""
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.is_labeled[indices].any() or len(np.unique(indices)) != len(indices):
+            raise ValueError("Rows are already labeled or repeated")
+        self._reserve(len(indices))
+        new = slice(self.size, self.size + len(indices))
+        X_new = self.X[indices]
+        for rows in iter_batches(len(self.X), DEFAULT_BATCH_SIZE):
+            self.columns[rows, new] = self.kernel_fn(self.X[rows], X_new)
+        self.labeled[new] = indices
+        self.is_labeled[indices] = True
+        self.size += len(indices)
+        self.entries_computed += len(self.X) * len(indices)
+
+    @property
+    def labeled_indices(self) -> np.ndarray:
+        return self.labeled[: self.size]
+
+    @property
+    def pool_indices(self) -> np.ndarray:
+        return np.flatnonzero(~self.is_labeled)
+
+    def gram(self) -> np.ndarray:
+        """Labeled-vs-labeled kernel, ordered as ``labeled_indices``."""
+        return self.columns[self.labeled_indices, : self.size]
+
+    def cross(self, rows: np.ndarray) -> np.ndarray:
+        """Kernel of arbitrary rows (pool, evaluation) against the labeled set."""
+        return self.columns[rows, : self.size]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare incremental kernel growth with full recomputation")
+    parser.add_argument("--family", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument("--init-size", type=int, default=50)
+    parser.add_argument("--query-batch", type=int, default=25)
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    X, _ = load_features()
+    states = encode_states(X, FeatureMap(args.family, layers=args.layers, bandwidth=args.bandwidth))
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(X))
+    store = IncrementalKernelStore(states, fidelity_from_states)
+    start = time.perf_counter()
+    store.add(order[: args.init_size])
+    for step in range(args.iterations):
+        lo = args.init_size + step * args.query_batch
+        store.add(order[lo : lo + args.query_batch])
+    incremental = time.perf_counter() - start
+
+    start = time.perf_counter()
+    full_entries = 0
+    for step in range(args.iterations + 1):
+        labeled = order[: args.init_size + step * args.query_batch]
+        for rows in iter_batches(len(X), DEFAULT_BATCH_SIZE):
+            fidelity_from_states(states[rows], states[labeled])
+        full_entries += len(X) * len(labeled)
+    recompute = time.perf_counter() - start
+    summary = {
+        "rows": len(X),
+        "labeled": int(store.size),
+        "incremental_seconds": incremental,
+        "incremental_entries": store.entries_computed,
+        "recompute_seconds": recompute,
+        "recompute_entries": full_entries,
+    }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Kernel-reuse cross-validation and (bandwidth, C, epsilon) grid search for QSVR."""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, mean_squared_error
+from sklearn.model_selection import KFold
+from sklearn.svm import SVR
+
+from kernel_builder import DEFAULT_TILE_SIZE, build_quantum_kernel
+from kernel_cache import KernelCache
+from qml_utils import pool_context
+from quantum_kernels import FAMILY_QUBITS, FeatureMap, load_dataset
+
+DEFAULT_C_GRID = (1.0, 3.0, 10.0, 30.0, 100.0)
+DEFAULT_EPSILON_GRID = (0.01, 0.05, 0.1, 0.2)
+DEFAULT_BANDWIDTHS = (0.25, 0.5, 1.0)
+
+Fold = Tuple[np.ndarray, np.ndarray]
+
+_WORKER: dict = {}
+
+
+def _attach_kernel(
+    name: str, shape: Tuple[int, int], dtype: str, y: np.ndarray, folds: List[Fold], untrack: bool
+) -> None:
+    shm = shared_memory.SharedMemory(name=name)
+    if untrack:
+        # Spawned workers run their own resource tracker, which would unlink the parent's
+        # segment on exit; forked workers share the parent's tracker and must not unregister.
+        resource_tracker.unregister(shm._name, "shared_memory")
+    _WORKER.update(shm=shm, kernel=np.ndarray(shape, dtype=dtype, buffer=shm.buf), y=y, folds=folds)
+
+
+def _score_cell(task: Tuple[float, float, int]) -> dict:
+    C, epsilon, fold = task
+    kernel, y = _WORKER["kernel"], _WORKER["y"]
+    train, test = _WORKER["folds"][fold]
+    model = SVR(kernel="precomputed", C=C, epsilon=epsilon)
+    model.fit(kernel[np.ix_(train, train)], y[train])
+    pred = model.predict(kernel[np.ix_(test, train)])
+    return {
+        "C": C,
+        "epsilon": epsilon,
+        "fold": fold,
+        "rmse": float(mean_squared_error(y[test], pred) ** 0.5),
+        "mae": float(mean_absolute_error(y[test], pred)),
+        "support_vectors": int(len(model.support_)),
+    }
+
+
+class SharedKernel:
+    """Kernel matrix allocated in a shared-memory segment that pool workers attach to."""
+
+    def __init__(self, shape: Tuple[int, int], dtype: str | np.dtype = np.float64) -> None:
+        dtype = np.dtype(dtype)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+
+    def __enter__(self) -> "SharedKernel":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        del self.array
+        self.shm.close()
+        self.shm.unlink()
+
+
+def cross_validate_kernel(
+    shared: SharedKernel,
+    y: np.ndarray,
+    folds: List[Fold],
+    C_grid: Sequence[float] = DEFAULT_C_GRID,
+    epsilon_grid: Sequence[float] = DEFAULT_EPSILON_GRID,
+    n_jobs: Optional[int] = None,
+) -> List[dict]:
+    """Score every (C, epsilon, fold) cell against the kernel held in shared memory.
+
+    Only the full matrix is shared; each cell copies its fold's train/test blocks out of
+    it with ``np.ix_``, so a worker's peak memory grows with the fold size.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    tasks = list(itertools.product(C_grid, epsilon_grid, range(len(folds))))
+    context = pool_context()
+    untrack = context.get_start_method() != "fork"
+    with ProcessPoolExecutor(
+        max_workers=n_jobs,
+        mp_context=context,
+        initializer=_attach_kernel,
+        initargs=(shared.shm.name, shared.array.shape, shared.array.dtype.str, y, folds, untrack),
+    ) as pool:
+        return list(pool.map(_score_cell, tasks, chunksize=max(1, len(tasks) // (4 * n_jobs))))
+
+
+def grid_search_qsvr(
+    X: np.ndarray,
+    y: np.ndarray,
+    feature_maps: Sequence[FeatureMap],
+    C_grid: Sequence[float] = DEFAULT_C_GRID,
+    epsilon_grid: Sequence[float] = DEFAULT_EPSILON_GRID,
+    n_splits: int = 5,
+    random_state: int = 42,
+    n_jobs: Optional[int] = None,
+    kernel_cache: Optional[KernelCache] = None,
+    tile_size: int = DEFAULT_TILE_SIZE,
+) -> Tuple[pd.DataFrame, dict]:
+    """Build one training kernel per feature map and reuse it for every fold and grid cell.
+
+    Returns the per-cell CV table and the best configuration by mean validation RMSE.
+    """
+    folds = list(KFold(n_splits=n_splits, shuffle=True, random_state=random_state).split(X))
+    records = []
+    for feature_map in feature_maps:
+        with SharedKernel((len(X), len(X))) as shared:
+            if kernel_cache is not None:
+                shared.array[:] = kernel_cache.quantum_kernel(
+                    X, np.arange(len(X)), None, feature_map, tile_size=tile_size, n_jobs=n_jobs
+                )
+            else:
+                build_quantum_kernel(X, feature_map=feature_map, tile_size=tile_size, n_jobs=n_jobs, out=shared.array)
+            for record in cross_validate_kernel(shared, y, folds, C_grid, epsilon_grid, n_jobs):
+                records.append({**feature_map.to_dict(), **record})
+
+    results = pd.DataFrame(records)
+    keys = ["family", "layers", "bandwidth", "qubits", "C", "epsilon"]
+    summary = (
+        results.groupby(keys, as_index=False)
+        .agg(rmse_mean=("rmse", "mean"), rmse_std=("rmse", "std"), mae_mean=("mae", "mean"))
+        .sort_values("rmse_mean")
+    )
+    best = {key: getattr(val, "item", lambda: val)() for key, val in summary.iloc[0].to_dict().items()}
+    best.update(kernel_builds=len(feature_maps), grid_cells=len(results), folds=n_splits)
+    return results, best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cross-validated QSVR grid search with kernel reuse")
+    parser.add_argument("--family", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidths", type=float, nargs="+", default=list(DEFAULT_BANDWIDTHS))
+    parser.add_argument("--C-grid", type=float, nargs="+", default=list(DEFAULT_C_GRID))
+    parser.add_argument("--epsilon-grid", type=float, nargs="+", default=list(DEFAULT_EPSILON_GRID))
+    parser.add_argument("--cv-folds", type=int, default=5)
+    parser.add_argument("--samples", type=int, default=4000)
+    parser.add_argument("--random-state", type=int, default=42)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    from sklearn.preprocessing import StandardScaler
+
+    X, y, _ = load_dataset()
+    rng = np.random.default_rng(args.random_state)
+    idx = rng.choice(len(X), size=min(args.samples, len(X)), replace=False)
+    X = StandardScaler().fit_transform(X[idx])
+    feature_maps = [FeatureMap(args.family, layers=args.layers, bandwidth=b) for b in args.bandwidths]
+    _, best = grid_search_qsvr(
+        X, y[idx], feature_maps, args.C_grid, args.epsilon_grid, args.cv_folds, args.random_state, args.n_jobs
+    )
+    print(json.dumps(best, indent=2))
+
+
+if __name__ == "__main__":
+    main()
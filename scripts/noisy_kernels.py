@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""Fidelity kernels under depolarizing, amplitude-damping and readout noise."""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from qml_utils import cz_ladder_signs, entangler_pairs, z_signs
+from quantum_kernels import (
+    DEFAULT_BATCH_SIZE,
+    FAMILY_QUBITS,
+    FeatureMap,
+    apply_single_qubit,
+    diagonal_phase,
+    fidelity_from_states,
+    iter_batches,
+    load_features,
+    qubit_angles,
+    quantum_kernel,
+    ry_matrices,
+    state_dtype,
+)
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+CALIBRATION_PATH = BASE_DIR / "data" / "qml" / "noise_calibration.json"
+
+SIMULATORS = ("auto", "density", "trajectory")
+DENSITY_MAX_QUBITS = 8
+# Density features hold dim^2 floats per sample (2 GB is 8,192 eight-qubit rows in float64).
+DENSITY_MAX_BYTES = 2 ** 31
+DEFAULT_TRAJECTORIES = 32
+# Overlap entries (rows x trajectories^2 x columns) per block of a trajectory kernel.
+TRAJECTORY_BLOCK_ENTRIES = 2 ** 25
+
+HADAMARD = np.array([[1, 1], [1, -1]], dtype=np.complex128) / np.sqrt(2)
+PAULIS = np.array([[[1, 0], [0, 1]], [[0, 1], [1, 0]], [[0, -1j], [1j, 0]], [[1, 0], [0, -1]]], dtype=np.complex128)
+
+
+@dataclass(frozen=True)
+class NoiseModel:
+    """Per-gate depolarizing probabilities, T1 amplitude damping and readout assignment errors.
+
+    Every single-qubit rotation layer is followed by ``depolarizing_1q`` and the damping of
+    ``one_qubit_us`` on each qubit; every two-qubit interaction by ``depolarizing_2q`` on
+    the pair and the damping of ``two_qubit_us`` on both qubits. Z rotations are virtual and
+    noiseless. ``readout_p01`` is P(read 1 | 0) and ``readout_p10`` is P(read 0 | 1); they act on
+    the measured bit string, not on the state (see ``readout_assignment``).
+    """
+
+    depolarizing_1q: float = 0.0
+    depolarizing_2q: float = 0.0
+    t1_us: float = float("inf")
+    one_qubit_us: float = 0.0
+    two_qubit_us: float = 0.0
+    readout_p01: float = 0.0
+    readout_p10: float = 0.0
+
+    @property
+    def damping_1q(self) -> float:
+        return float(-np.expm1(-self.one_qubit_us / self.t1_us))
+
+    @property
+    def damping_2q(self) -> float:
+        return float(-np.expm1(-self.two_qubit_us / self.t1_us))
+
+    @classmethod
+    def from_calibration(cls, path: Path = CALIBRATION_PATH, backend: str = "ionq") -> "NoiseModel":
+        calibration = json.loads(Path(path).read_text(encoding="utf-8"))
+        if backend not in calibration:
+            raise ValueError(f"Backend {backend!r} not in {path}; expected one of {sorted(calibration)}")
+        fields = cls.__dataclass_fields__
+        return cls(**{key: float(value) for key, value in calibration[backend].items() if key in fields})
+
+
+@dataclass
+class NoisyStates:
+    """Encoded samples: real density features (``density``) or pure-state trajectories."""
+
+    simulator: str
+    data: np.ndarray
+    num_qubits: int
+    noise: NoiseModel
+
+    def measured(self, fidelities: np.ndarray) -> np.ndarray:
+        """Apply this model's readout assignment errors to state overlaps."""
+        return readout_assignment(fidelities, self.noise, self.num_qubits)
+
+
+def _program(angles: np.ndarray, feature_map: FeatureMap) -> List[Tuple[str, np.ndarray, np.ndarray]]:
+    """The gate layers of ``quantum_kernels._encode_block`` as (kind, operand, pairs) steps."""
+    n = feature_map.num_qubits
+    no_pairs = np.empty((0, 2), dtype=int)
+    steps = []
+    if feature_map.family == "composition_encoding":
+        ring = entangler_pairs(n, "ring")
+        zz = diagonal_phase(angles, ring, n, single=False)
+        for _ in range(feature_map.layers):
+            steps += [("ry", angles, no_pairs), ("phase", zz, ring)]
+    elif feature_map.family == "local_environment":
+        ladder = np.stack([np.arange(n - 1), np.arange(1, n)], axis=1)
+        phases = diagonal_phase(angles, no_pairs, n) * cz_ladder_signs(n)
+        for _ in range(feature_map.layers):
+            steps += [("ry", angles, no_pairs), ("phase", phases, ladder)]
+    else:
+        every = entangler_pairs(n, "all")
+        phases = diagonal_phase(angles, every, n)
+        steps += [("h", HADAMARD, no_pairs), ("phase", phases, every)]
+        for _ in range(feature_map.layers - 1):
+            steps += [("ry", np.full_like(angles, np.pi / 2), no_pairs), ("phase", phases, every)]
+    return steps
+
+
+# --- channels -----------------------------------------------------------------------------
+
+
+def depolarizing_kraus(p: float, qubits: int = 1) -> np.ndarray:
+    """rho -> (1 - p) rho + p I / 2^k as Pauli-string Kraus operators (first qubit most significant)."""
+    paulis = [np.array([[1.0 + 0j]])]
+    for _ in range(qubits):
+        paulis = [np.kron(a, b) for a in paulis for b in PAULIS]
+    weights = np.full(len(paulis), p / 4 ** qubits)
+    weights[0] = 1 - p * (4 ** qubits - 1) / 4 ** qubits
+    return np.sqrt(weights)[:, None, None] * np.array(paulis)
+
+
+def damping_kraus(gamma: float) -> np.ndarray:
+    return np.array([[[1, 0], [0, np.sqrt(1 - gamma)]], [[0, np.sqrt(gamma)], [0, 0]]], dtype=np.complex128)
+
+
+def readout_assignment(fidelities: np.ndarray, noise: NoiseModel, num_qubits: int) -> np.ndarray:
+    """P(read 0...0) of compute-uncompute circuits whose true all-zeros probability is ``fidelities``.
+
+    Assignment errors are the per-qubit confusion matrix [[1 - p01, p10], [p01, 1 - p10]] on
+    the measured bit string. The true outcomes other than 0...0 are taken as uniform over the
+    remaining 2^n - 1 strings, which makes the correction an affine map of the fidelity.
+    """
+    keep = (1 - noise.readout_p01) ** num_qubits
+    leak = ((1 - noise.readout_p01 + noise.readout_p10) ** num_qubits - keep) / (2 ** num_qubits - 1)
+    return keep * fidelities + leak * (1 - fidelities)
+
+
+def superoperator(kraus: np.ndarray) -> np.ndarray:
+    """Row-major vec(sum_m K X K^dag) = S vec(X) with S = sum_m K (x) conj(K); batched over a leading axis."""
+    d = kraus.shape[-1]
+    return np.einsum("...mij,...mkl->...ikjl", kraus, kraus.conj()).reshape(kraus.shape[:-3] + (d * d, d * d))
+
+
+# --- density-matrix backend ----------------------------------------------------------
+
+
+def _qubit_view(rho: np.ndarray, qubits: Tuple[int, ...], n: int) -> np.ndarray:
+    """View of ``rho`` (batch, dim, dim) with the row axes then column axes of ``qubits`` last.
+
+    Untouched qubits stay grouped into as few axes as possible; a view with one axis per
+    qubit is several times slower to copy on eight qubits.
+    """
+    shape, axis_of, above = [], {}, n
+    # Qubit q is bit q of the basis index, so higher qubits are slower axes.
+    for q in sorted(qubits, reverse=True):
+        shape.append(2 ** (above - q - 1))
+        axis_of[q] = len(shape)
+        shape.append(2)
+        above = q
+    shape.append(2 ** above)
+    tensor = rho.reshape((len(rho),) + tuple(shape) * 2)
+    rows = [1 + axis_of[q] for q in qubits]
+    cols = [1 + len(shape) + axis_of[q] for q in qubits]
+    return np.moveaxis(tensor, rows + cols, range(-2 * len(qubits), 0))
+
+
+def _dm_channel(rho: np.ndarray, qubits: Tuple[int, ...], superop: np.ndarray, n: int) -> None:
+    """In place: apply a shared (4^k, 4^k) or per-sample (batch, 4^k, 4^k) superoperator to ``qubits``."""
+    view = _qubit_view(rho, qubits, n)
+    block = np.ascontiguousarray(view).reshape(len(rho), -1, 4 ** len(qubits))
+    block = block @ np.swapaxes(superop, -1, -2)
+    view[...] = block.reshape(view.shape)
+
+
+def density_matrices(angles: np.ndarray, feature_map: FeatureMap, noise: NoiseModel) -> np.ndarray:
+    """Noisy encoded states (batch, dim, dim) by exact density-matrix evolution.
+
+    Each gate and the noise that follows it are fused into one superoperator, so every
+    qubit (or pair) costs a single pass over the batch of density matrices.
+    """
+    n, dim = feature_map.num_qubits, feature_map.dim
+    after_1q = superoperator(damping_kraus(noise.damping_1q)) @ superoperator(depolarizing_kraus(noise.depolarizing_1q))
+    damping = damping_kraus(noise.damping_2q)
+    damp_pair = superoperator(np.array([np.kron(a, b) for a in damping for b in damping]))
+    after_2q = damp_pair @ superoperator(depolarizing_kraus(noise.depolarizing_2q, 2))
+    rho = np.zeros((len(angles), dim, dim), dtype=np.complex128)
+    rho[:, 0, 0] = 1.0
+    for kind, operand, pairs in _program(angles, feature_map):
+        if kind == "phase":
+            rho *= operand[:, :, None] * operand.conj()[:, None, :]
+            for pair in pairs.tolist():
+                _dm_channel(rho, tuple(pair), after_2q, n)
+            continue
+        for q in range(n):
+            gate = operand if kind == "h" else ry_matrices(operand[:, q])
+            _dm_channel(rho, (q,), after_1q @ superoperator(gate[..., None, :, :]), n)
+    return rho
+
+
+def density_features(rho: np.ndarray, dtype: np.dtype = np.float64) -> np.ndarray:
+    """Real vectors whose inner products are Tr(rho_i rho_j), of length dim^2.
+
+    Hermiticity leaves the diagonal plus sqrt(2)-scaled real and imaginary upper triangles.
+    """
+    dim = rho.shape[1]
+    upper = np.triu_indices(dim, k=1)
+    off = rho[:, upper[0], upper[1]] * np.sqrt(2)
+    return np.hstack([np.diagonal(rho, axis1=1, axis2=2).real, off.real, off.imag]).astype(dtype)
+
+
+# --- trajectory backend ---------------------------------------------------------------
+
+
+def _populations(states: np.ndarray, qubit: int, n: int) -> np.ndarray:
+    """P(qubit = 1) per row."""
+    return (np.abs(states) ** 2) @ ((1 - z_signs(n)[qubit]) / 2)
+
+
+def _jump(states: np.ndarray, qubit: int, kraus: np.ndarray, probabilities: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Apply one Kraus operator per row, drawn with the given (rows, ops) probabilities, and renormalise."""
+    cumulative = np.cumsum(probabilities, axis=1)
+    choice = (rng.random((len(states), 1)) > cumulative[:, :-1]).sum(axis=1)
+    states = apply_single_qubit(states, qubit, kraus[choice])
+    return states / np.linalg.norm(states, axis=1, keepdims=True)
+
+
+def _traj_depolarize(states: np.ndarray, qubits: Tuple[int, ...], p: float, rng: np.random.Generator) -> np.ndarray:
+    """Identity with probability 1 - p (4^k - 1) / 4^k, otherwise a uniform non-identity Pauli string."""
+    if p <= 0:
+        return states
+    k = len(qubits)
+    strings = rng.integers(1, 4 ** k, size=len(states))
+    strings[rng.random(len(states)) >= p * (4 ** k - 1) / 4 ** k] = 0
+    for i, q in enumerate(qubits):
+        states = apply_single_qubit(states, q, PAULIS[(strings >> (2 * i)) & 3])
+    return states
+
+
+def _traj_damp(states: np.ndarray, qubit: int, gamma: float, n: int, rng: np.random.Generator) -> np.ndarray:
+    if gamma <= 0:
+        return states
+    jump = gamma * _populations(states, qubit, n)
+    return _jump(states, qubit, damping_kraus(gamma), np.stack([1 - jump, jump], axis=1), rng)
+
+
+def trajectories(
+    angles: np.ndarray, feature_map: FeatureMap, noise: NoiseModel, count: int, rng: np.random.Generator
+) -> np.ndarray:
+    """``count`` Monte Carlo pure-state trajectories per sample, shape (batch, count, dim)."""
+    n, dim = feature_map.num_qubits, feature_map.dim
+    angles = np.repeat(angles, count, axis=0)
+    states = np.zeros((len(angles), dim), dtype=np.complex128)
+    states[:, 0] = 1.0
+    for kind, operand, pairs in _program(angles, feature_map):
+        if kind == "phase":
+            states = states * operand
+            for a, b in pairs.tolist():
+                states = _traj_depolarize(states, (a, b), noise.depolarizing_2q, rng)
+                states = _traj_damp(states, a, noise.damping_2q, n, rng)
+                states = _traj_damp(states, b, noise.damping_2q, n, rng)
+            continue
+        for q in range(n):
+            states = apply_single_qubit(states, q, operand if kind == "h" else ry_matrices(operand[:, q]))
+            states = _traj_depolarize(states, (q,), noise.depolarizing_1q, rng)
+            states = _traj_damp(states, q, noise.damping_1q, n, rng)
+    return states.reshape(-1, count, dim)
+
+
+# --- kernels ----------------------------------------------------------------------------
+
+
+def noisy_states(
+    X: np.ndarray,
+    feature_map: FeatureMap,
+    noise: NoiseModel,
+    simulator: str = "auto",
+    n_trajectories: int = DEFAULT_TRAJECTORIES,
+    batch_size: Optional[int] = None,
+    precision: str = "float64",
+    random_state: int = 0,
+) -> NoisyStates:
+    """Encode every row of X under ``noise``.
+
+    ``auto`` evolves density matrices up to ``DENSITY_MAX_QUBITS`` qubits while their
+    features fit in ``DENSITY_MAX_BYTES``, and samples trajectories otherwise.
+    """
+    if simulator not in SIMULATORS:
+        raise ValueError(f"Unknown simulator {simulator!r}; expected one of {SIMULATORS}")
+    angles = qubit_angles(X, feature_map)
+    density_bytes = len(angles) * feature_map.dim ** 2 * np.dtype(precision).itemsize
+    if simulator == "auto":
+        fits = feature_map.num_qubits <= DENSITY_MAX_QUBITS and density_bytes <= DENSITY_MAX_BYTES
+        simulator = "density" if fits else "trajectory"
+    elif simulator == "density" and density_bytes > DENSITY_MAX_BYTES:
+        raise ValueError(
+            f"Density features for {len(angles)} samples need {density_bytes / 2 ** 30:.1f} GiB "
+            f"(limit {DENSITY_MAX_BYTES / 2 ** 30:.1f} GiB); use simulator='trajectory'"
+        )
+    if simulator == "density":
+        # Cache-sized batches (4 MB of density matrices) are faster than large ones here.
+        batch_size = batch_size or max(1, 2 ** 18 // feature_map.dim ** 2)
+        data = np.empty((len(angles), feature_map.dim ** 2), dtype=precision)
+        for block in iter_batches(len(angles), batch_size):
+            data[block] = density_features(density_matrices(angles[block], feature_map, noise), precision)
+        return NoisyStates(simulator, data, feature_map.num_qubits, noise)
+    if n_trajectories < 2:
+        raise ValueError("Trajectory kernels need at least two trajectories per sample")
+    batch_size = batch_size or max(1, DEFAULT_BATCH_SIZE // n_trajectories)
+    rng = np.random.default_rng(random_state)
+    data = np.empty((len(angles), n_trajectories, feature_map.dim), dtype=state_dtype(precision))
+    for block in iter_batches(len(angles), batch_size):
+        data[block] = trajectories(angles[block], feature_map, noise, n_trajectories, rng)
+    return NoisyStates(simulator, data, feature_map.num_qubits, noise)
+
+
+def noisy_kernel(states_a: NoisyStates, states_b: Optional[NoisyStates] = None) -> np.ndarray:
+    """K_ij = Tr(rho_i rho_j) between encoded sample sets (states_a with itself when states_b is None).
+
+    Trajectory estimates average ``|<psi_s|phi_t>|^2`` over all trajectory pairs; diagonal
+    entries of a symmetric kernel skip the ``s == t`` pairs so purities stay unbiased.
+    Readout assignment errors are applied to the overlaps last.
+    """
+    a = states_a.data
+    b = a if states_b is None else states_b.data
+    kernel = np.empty((len(a), len(b)), dtype=a.real.dtype)
+    if states_a.simulator == "density":
+        for block in iter_batches(len(a), DEFAULT_BATCH_SIZE):
+            kernel[block] = a[block] @ b.T
+        return states_a.measured(kernel)
+    count, dim = a.shape[1], a.shape[2]
+    flat_b = b.reshape(-1, dim)
+    rows = max(1, TRAJECTORY_BLOCK_ENTRIES // (count * count * len(b)))
+    for block in iter_batches(len(a), rows):
+        overlaps = fidelity_from_states(a[block].reshape(-1, dim), flat_b)
+        kernel[block] = overlaps.reshape(-1, count, len(b), count).mean(axis=(1, 3))
+    if states_b is None:
+        diagonal = np.diagonal(kernel).copy()
+        np.fill_diagonal(kernel, (diagonal * count - 1) / (count - 1))
+    return states_a.measured(kernel)
+
+
+def noisy_quantum_kernel(
+    X_a: np.ndarray,
+    X_b: Optional[np.ndarray] = None,
+    feature_map: Optional[FeatureMap] = None,
+    noise: Optional[NoiseModel] = None,
+    simulator: str = "auto",
+    n_trajectories: int = DEFAULT_TRAJECTORIES,
+    precision: str = "float64",
+    random_state: int = 0,
+) -> np.ndarray:
+    """Noisy counterpart of ``quantum_kernels.quantum_kernel``."""
+    if feature_map is None:
+        feature_map = FeatureMap("composition_encoding")
+    noise = noise or NoiseModel()
+    options = dict(simulator=simulator, n_trajectories=n_trajectories, precision=precision)
+    states_a = noisy_states(X_a, feature_map, noise, random_state=random_state, **options)
+    states_b = None if X_b is None else noisy_states(X_b, feature_map, noise, random_state=random_state + 1, **options)
+    return noisy_kernel(states_a, states_b)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Noisy fidelity kernels against the noiseless simulation")
+    parser.add_argument("--family", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument("--qubits", type=int, default=None)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--calibration", type=Path, default=CALIBRATION_PATH)
+    parser.add_argument("--backend", default="ionq", help="Entry of the calibration file")
+    parser.add_argument("--simulator", choices=SIMULATORS, default="auto")
+    parser.add_argument("--trajectories", type=int, default=DEFAULT_TRAJECTORIES)
+    args = parser.parse_args()
+
+    X, _ = load_features()
+    X = X[: args.samples]
+    feature_map = FeatureMap(args.family, layers=args.layers, bandwidth=args.bandwidth, qubits=args.qubits)
+    noise = NoiseModel.from_calibration(args.calibration, args.backend)
+    exact = quantum_kernel(X, feature_map=feature_map)
+    start = time.perf_counter()
+    states = noisy_states(X, feature_map, noise, args.simulator, args.trajectories)
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    kernel = noisy_kernel(states)
+    kernel_seconds = time.perf_counter() - start
+    off = ~np.eye(len(X), dtype=bool)
+    report = {
+        "feature_map": feature_map.to_dict(),
+        "noise_model": asdict(noise),
+        "simulator": states.simulator,
+        "samples": len(X),
+        "encode_seconds": encode_seconds,
+        "kernel_seconds": kernel_seconds,
+        "mean_purity": float(np.diagonal(kernel).mean()),
+        "mean_off_diagonal_noisy": float(kernel[off].mean()),
+        "mean_off_diagonal_exact": float(exact[off].mean()),
+        "max_abs_deviation": float(np.abs(kernel - exact).max()),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Vectorized composition-based property surrogate: rule of mixtures plus a learned residual (T3.3)."""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from scipy.special import xlogy
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+DATA_PATH = BASE_DIR / "data" / "processed" / "hea_features.parquet"
+DFT_DIR = BASE_DIR / "data" / "dft_handoff"
+METRICS_JSON = BASE_DIR / "data" / "qml" / "property_surrogate_metrics.json"
+
+# Elemental reference values: molar mass (g/mol), density at room temperature (g/cm3),
+# metallic radius (pm, 12-fold coordination), valence electron count, Pauling
+# electronegativity, melting point (K).
+PROPERTY_COLUMNS = ("mass", "density", "radius", "vec", "electronegativity", "melting_k")
+ELEMENT_PROPERTIES: Dict[str, Tuple[float, ...]] = {
+    "Ag": (107.868, 10.49, 144, 11, 1.93, 1235),
+    "Al": (26.982, 2.70, 143, 3, 1.61, 933),
+    "B": (10.81, 2.34, 90, 3, 2.04, 2349),
+    "C": (12.011, 2.27, 77, 4, 2.55, 3823),
+    "Ca": (40.078, 1.55, 197, 2, 1.00, 1115),
+    "Co": (58.933, 8.90, 125, 9, 1.88, 1768),
+    "Cr": (51.996, 7.19, 128, 6, 1.66, 2180),
+    "Cu": (63.546, 8.96, 128, 11, 1.90, 1358),
+    "Fe": (55.845, 7.87, 126, 8, 1.83, 1811),
+    "Ga": (69.723, 5.91, 135, 3, 1.81, 303),
+    "Hf": (178.49, 13.31, 159, 4, 1.30, 2506),
+    "Li": (6.94, 0.534, 152, 1, 0.98, 454),
+    "Mg": (24.305, 1.74, 160, 2, 1.31, 923),
+    "Mn": (54.938, 7.21, 127, 7, 1.55, 1519),
+    "Mo": (95.95, 10.28, 139, 6, 2.16, 2896),
+    "Nb": (92.906, 8.57, 146, 5, 1.60, 2750),
+    "Nd": (144.242, 7.01, 182, 3, 1.14, 1297),
+    "Ni": (58.693, 8.91, 124, 10, 1.91, 1728),
+    "Pd": (106.42, 12.02, 137, 10, 2.20, 1828),
+    "Re": (186.207, 21.02, 137, 7, 1.90, 3459),
+    "Sc": (44.956, 2.99, 162, 3, 1.36, 1814),
+    "Si": (28.085, 2.33, 115, 4, 1.90, 1687),
+    "Sn": (118.71, 7.29, 151, 4, 1.96, 505),
+    "Ta": (180.948, 16.69, 146, 5, 1.50, 3290),
+    "Ti": (47.867, 4.51, 147, 4, 1.54, 1941),
+    "V": (50.942, 6.11, 134, 5, 1.63, 2183),
+    "W": (183.84, 19.25, 139, 6, 2.36, 3695),
+    "Y": (88.906, 4.47, 180, 3, 1.22, 1799),
+    "Zn": (65.38, 7.14, 134, 12, 1.65, 693),
+    "Zr": (91.224, 6.52, 160, 4, 1.33, 2128),
+}
+
+# Surrogate targets and the dataset columns that measure them, in order of preference.
+TARGETS = {
+    "density_g_cm3": ("exp_density_g_cm3", "calc_density_g_cm3"),
+    "vickers_hardness": ("vickers_hardness",),
+    "yield_strength_mpa": ("yield_strength_mpa",),
+}
+# DFT result properties that measure a surrogate target.
+DFT_TARGETS = {"exp_density_g_cm3": "density_g_cm3", "yield_strength_mpa": "yield_strength_mpa"}
+# Mechanical tests away from room temperature are not composition-only targets.
+ROOM_TEMPERATURE_C = (15.0, 30.0)
+DFT_WEIGHT = 5.0
+DEFAULT_RIDGE = 0.1
+
+
+def parse_compositions(compositions: Sequence[str] | pa.Array) -> Tuple[int, np.ndarray, pa.Array, np.ndarray]:
+    """Formula strings as flat ``(row, symbol, amount)`` entries, parsed in Arrow kernels.
+
+    Accepts ``"Al0.25 Co1 Fe1 Ni1"`` and ``"Al0.25Co1Fe1Ni1"``; a bare symbol counts once and a
+    repeated symbol gives one entry per occurrence. Returns the row count with the entries.
+    """
+    strings = compositions if isinstance(compositions, (pa.Array, pa.ChunkedArray)) else pa.array(compositions, pa.string())
+    tokens = pc.utf8_split_whitespace(pc.replace_substring_regex(strings, r"([A-Z])", r" \1"))
+    if isinstance(tokens, pa.ChunkedArray):
+        tokens = tokens.combine_chunks()
+    rows = np.repeat(np.arange(len(tokens)), np.diff(tokens.offsets.to_numpy(zero_copy_only=False)))
+    parts = pc.extract_regex(tokens.flatten(), r"(?P<symbol>[A-Z][a-z]?)(?P<amount>[0-9.]*)")
+    amount = parts.field("amount")
+    amount = pc.if_else(pc.equal(amount, ""), "1", amount).cast(pa.float64()).to_numpy(zero_copy_only=False)
+    # The split leaves an empty token before each leading symbol.
+    symbol = parts.field("symbol")
+    keep = pc.not_equal(symbol, "")
+    mask = keep.to_numpy(zero_copy_only=False)
+    return len(tokens), rows[mask], symbol.filter(keep), amount[mask]
+
+
+def composition_matrix(compositions: Sequence[str] | pa.Array, symbols: Sequence[str]) -> np.ndarray:
+    """Dense ``(n, len(symbols))`` atomic fractions from formula strings; elements outside ``symbols`` are ignored."""
+    n, rows, found, amount = parse_compositions(compositions)
+    column = pc.index_in(found, value_set=pa.array(list(symbols), pa.string())).to_numpy(zero_copy_only=False)
+    known = ~np.isnan(column)
+    matrix = np.zeros((n, len(symbols)))
+    np.add.at(matrix, (rows[known], column[known].astype(np.int64)), amount[known])
+    return matrix / np.maximum(matrix.sum(axis=1, keepdims=True), 1e-12)
+
+
+def dense_fractions(elements: np.ndarray, fractions: np.ndarray, from_symbols: Sequence[str], symbols: Sequence[str]) -> np.ndarray:
+    """Dense fractions from a padded element-index block (``CompositionBatch`` layout)."""
+    # Padding lands in a spare last column; element indices within a row are distinct.
+    lookup = np.array([list(symbols).index(symbol) for symbol in from_symbols] + [len(symbols)])
+    matrix = np.zeros((len(elements), len(symbols) + 1))
+    matrix[np.arange(len(elements))[:, None], lookup[elements]] = fractions
+    return matrix[:, :-1]
+
+
+@dataclass
+class PropertySurrogate:
+    """Rule-of-mixtures baselines plus a ridge correction on composition descriptors.
+
+    ``C @ table`` gives, in one product, the molar mass, molar volume, mean radius, VEC,
+    electronegativity, melting point and the second moments needed for the size and
+    electronegativity mismatch. Density's baseline is the volume-additive mixture
+    ``sum c_i M_i / sum c_i M_i / rho_i``; the other targets start from their training mean.
+    Residuals are a linear model of the fractions themselves and those descriptors, so
+    scoring a batch costs two small matrix products. Predictions are floored at zero since
+    the linear correction can run negative far outside the training compositions.
+    """
+
+    symbols: Tuple[str, ...] = tuple(ELEMENT_PROPERTIES)
+    ridge: float = DEFAULT_RIDGE
+    coef_: Dict[str, np.ndarray] = field(default_factory=dict)
+    baseline_: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def table(self) -> np.ndarray:
+        props = np.array([ELEMENT_PROPERTIES[symbol] for symbol in self.symbols])
+        mass, density, radius, vec, chi, melting = props.T
+        return np.stack([mass, mass / density, radius, radius ** 2, vec, chi, chi ** 2, melting], axis=1)
+
+    def descriptors(self, C: np.ndarray) -> Dict[str, np.ndarray]:
+        mass, volume, radius, radius_sq, vec, chi, chi_sq, melting = (C @ self.table).T
+        entropy = -xlogy(C, C).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {
+                "rom_density": mass / volume,
+                "vec": vec,
+                "size_mismatch": np.sqrt(np.maximum(radius_sq / radius ** 2 - 1, 0.0)),
+                "electronegativity_mismatch": np.sqrt(np.maximum(chi_sq - chi ** 2, 0.0)),
+                "melting_k": melting,
+                "mixing_entropy": entropy,
+            }
+
+    def _features(self, C: np.ndarray, descriptors: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.hstack([C, np.column_stack(list(descriptors.values()))])
+
+    def _baseline(self, target: str, descriptors: Dict[str, np.ndarray]) -> np.ndarray:
+        if target == "density_g_cm3":
+            return descriptors["rom_density"]
+        return np.full(len(descriptors["vec"]), self.baseline_[target])
+
+    def fit(self, C: np.ndarray, targets: pd.DataFrame, weights: Optional[np.ndarray] = None) -> "PropertySurrogate":
+        """Weighted ridge on the residual of each target column (NaNs are skipped per target)."""
+        weights = np.ones(len(C)) if weights is None else np.asarray(weights, dtype=np.float64)
+        descriptors = self.descriptors(C)
+        features = self._features(C, descriptors)
+        for target in targets.columns:
+            y = targets[target].to_numpy(dtype=np.float64)
+            rows = ~np.isnan(y)
+            if target != "density_g_cm3":
+                self.baseline_[target] = float(np.average(y[rows], weights=weights[rows]))
+            residual = y[rows] - self._baseline(target, descriptors)[rows]
+            X, w = features[rows], weights[rows]
+            mean = np.average(X, axis=0, weights=w)
+            std = np.sqrt(np.average((X - mean) ** 2, axis=0, weights=w))
+            std[std == 0] = 1.0
+            Z = (X - mean) / std
+            offset = np.average(residual, weights=w)
+            gram = (Z * w[:, None]).T @ Z + self.ridge * w.sum() * np.eye(Z.shape[1])
+            coef = np.linalg.solve(gram, (Z * w[:, None]).T @ (residual - offset))
+            # Fold the standardization into one weight vector and intercept.
+            self.coef_[target] = np.append(coef / std, offset - (mean / std) @ coef)
+        return self
+
+    def predict(self, C: np.ndarray) -> pd.DataFrame:
+        descriptors = self.descriptors(C)
+        features = self._features(C, descriptors)
+        targets = list(self.coef_)
+        weights = np.column_stack([self.coef_[target][:-1] for target in targets])
+        intercepts = np.array([self.coef_[target][-1] for target in targets])
+        corrections = features @ weights + intercepts
+        predictions = {
+            f"predicted_{target}": np.maximum(self._baseline(target, descriptors) + corrections[:, j], 0.0)
+            for j, target in enumerate(targets)
+        }
+        return pd.DataFrame({**predictions, **descriptors})
+
+    def predict_compositions(self, compositions: Sequence[str] | pa.Array) -> pd.DataFrame:
+        return self.predict(composition_matrix(compositions, self.symbols))
+
+
+def training_targets(path: Path = DATA_PATH) -> Tuple[List[str], pd.DataFrame]:
+    """Per-formula median of every target (mechanical tests at room temperature only)."""
+    df = pd.read_parquet(path)
+    room = df["test_temperature_c"].between(*ROOM_TEMPERATURE_C) | df["test_temperature_c"].isna()
+    columns = {}
+    for target, sources in TARGETS.items():
+        value = df[sources[0]]
+        for source in sources[1:]:
+            value = value.fillna(df[source])
+        if target != "density_g_cm3":
+            value = value.where(room)
+        columns[target] = value
+    targets = pd.DataFrame(columns).groupby(df["formula"]).median()
+    return targets.index.tolist(), targets.reset_index(drop=True)
+
+
+def dft_targets(directory: Path = DFT_DIR) -> Tuple[List[str], pd.DataFrame]:
+    """Completed DFT handoff results with the composition recorded in their request metadata."""
+    formulas, records = [], []
+    for results_path in sorted((directory / "output").glob("*/results.json")):
+        results = json.loads(results_path.read_text())
+        metadata_path = directory / "input" / results_path.parent.name / "metadata.json"
+        if results.get("status") != "completed" or not metadata_path.exists():
+            continue
+        formulas.append(json.loads(metadata_path.read_text())["composition"])
+        properties = results.get("properties", {})
+        records.append({target: properties.get(source, np.nan) for source, target in DFT_TARGETS.items()})
+    return formulas, pd.DataFrame(records, columns=list(TARGETS), dtype=np.float64)
+
+
+def fit_surrogate(ridge: float = DEFAULT_RIDGE, dft_weight: float = DFT_WEIGHT) -> PropertySurrogate:
+    """Surrogate trained on the HEA table plus DFT results (each DFT row weighs ``dft_weight``; 0 leaves them out)."""
+    formulas, targets = training_targets()
+    dft_formulas, dft = dft_targets()
+    if dft_weight <= 0:
+        dft_formulas, dft = [], dft.iloc[:0]
+    surrogate = PropertySurrogate(ridge=ridge)
+    C = composition_matrix(formulas + dft_formulas, surrogate.symbols)
+    weights = np.concatenate([np.ones(len(formulas)), np.full(len(dft_formulas), dft_weight)])
+    return surrogate.fit(C, pd.concat([targets, dft], ignore_index=True), weights)
+
+
+def cross_validate(C: np.ndarray, targets: pd.DataFrame, folds: int = 5, ridge: float = DEFAULT_RIDGE, seed: int = 0) -> Dict:
+    fold = np.random.default_rng(seed).integers(0, folds, len(C))
+    report = {}
+    for target in targets.columns:
+        errors, baseline_errors = [], []
+        for k in range(folds):
+            train, test = fold != k, (fold == k) & targets[target].notna().to_numpy()
+            model = PropertySurrogate(ridge=ridge).fit(C[train], targets.loc[train, [target]])
+            predicted = model.predict(C[test])
+            truth = targets.loc[test, target].to_numpy()
+            errors.append(predicted[f"predicted_{target}"].to_numpy() - truth)
+            baseline_errors.append(model._baseline(target, model.descriptors(C[test])) - truth)
+        errors, baseline_errors = np.concatenate(errors), np.concatenate(baseline_errors)
+        report[target] = {
+            "rows": int(targets[target].notna().sum()),
+            "rmse": float(np.sqrt(np.mean(errors ** 2))),
+            "baseline_rmse": float(np.sqrt(np.mean(baseline_errors ** 2))),
+            "mae": float(np.mean(np.abs(errors))),
+        }
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fit and benchmark the composition property surrogate")
+    parser.add_argument("--ridge", type=float, default=DEFAULT_RIDGE)
+    parser.add_argument("--dft-weight", type=float, default=DFT_WEIGHT)
+    parser.add_argument("--benchmark", type=int, default=1_000_000, help="Compositions to score for timing")
+    args = parser.parse_args()
+
+    from qgan_prototype import CompositionSampler, load_constraints
+
+    formulas, targets = training_targets()
+    surrogate = PropertySurrogate(ridge=args.ridge)
+    cv = cross_validate(composition_matrix(formulas, surrogate.symbols), targets, ridge=args.ridge)
+    surrogate = fit_surrogate(args.ridge, args.dft_weight)
+
+    batch = CompositionSampler.from_constraints(load_constraints()).sample(args.benchmark, np.random.default_rng(0))
+    start = time.perf_counter()
+    C = dense_fractions(batch.elements, batch.fractions, batch.symbols, surrogate.symbols)
+    surrogate.predict(C)
+    matrix_seconds = time.perf_counter() - start
+    strings = pa.array(batch.strings())
+    start = time.perf_counter()
+    surrogate.predict_compositions(strings)
+    string_seconds = time.perf_counter() - start
+
+    metrics = {
+        "formulas": len(formulas),
+        "dft_results": len(dft_targets()[0]),
+        "cross_validation": cv,
+        "benchmark_compositions": args.benchmark,
+        "score_seconds_from_matrix": round(matrix_seconds, 3),
+        "score_seconds_from_strings": round(string_seconds, 3),
+    }
+    METRICS_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+    print(json.dumps(metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,26 +6,31 @@ import argparse
 import json
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 import numpy as np
 import pandas as pd
 
+from qgan_prototype import read_candidates
+from qgan_property_conditioning import conditioned_candidates_path
+
 BASE_DIR = Path(__file__).resolve().parents[1]
-CANDIDATE_PATH = BASE_DIR / "data" / "qml" / "qgan_conditioned_candidates.csv"
 ACQ_METRICS_PATH = BASE_DIR / "data" / "architecture" / "acquisition_metrics.json"
 RUN_SUMMARY_PATH = BASE_DIR / "data" / "architecture" / "qal_run_summary.json"
 MONITORING_LOG = BASE_DIR / "data" / "architecture" / "qal_monitoring_log.jsonl"
 
 
-def orchestrate(random_state: int = 42, top_k: int = 10) -> dict:
+def orchestrate(random_state: int = 42, top_k: int = 10, candidate_path: Optional[Path] = None) -> dict:
     rng = np.random.default_rng(random_state)
-    candidates = pd.read_csv(CANDIDATE_PATH)
     metrics = json.loads(ACQ_METRICS_PATH.read_text())
 
-    # Score candidates using placeholder acquisition metric (expected improvement final RMSE)
-    scores = rng.normal(loc=0.5, scale=0.1, size=len(candidates))
-    candidates["score"] = scores
-    selected = candidates.nlargest(top_k, "score")
+    # Score candidates using placeholder acquisition metric (expected improvement final RMSE),
+    # batch by batch so that only the running top-k is kept in memory.
+    total, selected = 0, None
+    for batch in read_candidates(candidate_path or conditioned_candidates_path()):
+        batch["score"] = rng.normal(loc=0.5, scale=0.1, size=len(batch))
+        total += len(batch)
+        selected = pd.concat([selected, batch.nlargest(top_k, "score")]).nlargest(top_k, "score")
 
     # Simulate DFT submission results
     selected["dft_status"] = rng.choice(["completed", "queued"], size=top_k, p=[0.7, 0.3])
@@ -33,7 +38,7 @@ def orchestrate(random_state: int = 42, top_k: int = 10) -> dict:
 
     summary = {
         "run_id": f"qal-orchestrator-{random_state}",
-        "total_candidates": int(len(candidates)),
+        "total_candidates": int(total),
         "selected": int(len(selected)),
         "dft_completed": int((selected["dft_status"] == "completed").sum()),
         "acquisition_strategy": "expected_improvement",
@@ -54,9 +59,10 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Run QAL orchestrator mock")
     parser.add_argument("--random-state", type=int, default=42)
     parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--candidates", type=Path, default=None, help="Conditioned candidates (CSV or Parquet); default: the latest written")
     args = parser.parse_args()
 
-    summary = orchestrate(args.random_state, args.top_k)
+    summary = orchestrate(args.random_state, args.top_k, args.candidates)
     print(json.dumps(summary, indent=2))
 
 
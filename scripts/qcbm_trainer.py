@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""Phase-conditioned quantum circuit Born machine over HEA element sets (T3.2)."""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from dataclasses import asdict, dataclass
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from qgan_prototype import PHASES, CompositionBatch, CompositionSampler, load_constraints
+from property_surrogate import composition_matrix
+from qml_utils import z_signs
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+DATA_PATH = BASE_DIR / "data" / "processed" / "hea_features.parquet"
+CHECKPOINT_PATH = BASE_DIR / "data" / "qml" / "qcbm_checkpoint.npz"
+METRICS_JSON = BASE_DIR / "data" / "qml" / "qcbm_metrics.json"
+
+# Gaussian widths (in squared Hamming distance) of the MMD kernel mixture.
+MMD_BANDWIDTHS = (0.25, 1.0, 4.0, 16.0)
+
+
+@dataclass(frozen=True)
+class BornMachine:
+    """Real-amplitude circuit on ``elements`` data qubits plus phase-condition qubits.
+
+    The register starts in ``|phase>|0...0>``; each of ``layers`` blocks applies Ry on every
+    qubit, a CZ ring and CZs from each condition qubit to each data qubit, and a final Ry
+    layer precedes measurement of the data qubits. Data qubit ``q`` is the presence of
+    ``symbols[q]``. Ry and CZ keep amplitudes real, so states are stored as float64.
+    """
+
+    symbols: Tuple[str, ...]
+    layers: int = 4
+
+    @property
+    def num_data(self) -> int:
+        return len(self.symbols)
+
+    @property
+    def num_condition(self) -> int:
+        return max(1, int(np.ceil(np.log2(len(PHASES)))))
+
+    @property
+    def num_qubits(self) -> int:
+        return self.num_data + self.num_condition
+
+    @property
+    def num_params(self) -> int:
+        return (self.layers + 1) * self.num_qubits
+
+    @cached_property
+    def entangler(self) -> np.ndarray:
+        z = z_signs(self.num_qubits)
+        n, signs = self.num_qubits, np.ones(2 ** self.num_qubits)
+        pairs = [(q, (q + 1) % n) for q in range(n)]
+        pairs += [(c, q) for c in range(self.num_data, n) for q in range(self.num_data)]
+        for a, b in set(tuple(sorted(pair)) for pair in pairs):
+            signs *= np.where((z[a] < 0) & (z[b] < 0), -1.0, 1.0)
+        return signs
+
+    def probabilities(self, params: np.ndarray, phases: np.ndarray) -> np.ndarray:
+        """Data-register distributions ``(batch, 2**elements)`` for per-row parameters and phases."""
+        params = np.atleast_2d(params).reshape(len(phases), self.layers + 1, self.num_qubits)
+        states = np.zeros((len(phases), 2 ** self.num_qubits))
+        states[np.arange(len(phases)), np.asarray(phases) << self.num_data] = 1.0
+        for layer in range(self.layers + 1):
+            for q in range(self.num_qubits):
+                _ry(states, q, params[:, layer, q])
+            if layer < self.layers:
+                states *= self.entangler
+        probs = states ** 2
+        return probs.reshape(len(phases), -1, 2 ** self.num_data).sum(axis=1)
+
+
+def _ry(states: np.ndarray, qubit: int, theta: np.ndarray) -> None:
+    """In-place per-row Ry on a real register."""
+    batch, dim = states.shape
+    view = states.reshape(batch, dim >> (qubit + 1), 2, 1 << qubit)
+    cos = np.cos(theta / 2)[:, None, None]
+    sin = np.sin(theta / 2)[:, None, None]
+    amp0 = view[:, :, 0, :].copy()
+    view[:, :, 0, :] = cos * amp0 - sin * view[:, :, 1, :]
+    view[:, :, 1, :] = sin * amp0 + cos * view[:, :, 1, :]
+
+
+def mmd_kernel(num_bits: int, bandwidths: Tuple[float, ...] = MMD_BANDWIDTHS) -> np.ndarray:
+    codes = np.arange(2 ** num_bits)
+    bits = (codes[:, None] >> np.arange(num_bits)) & 1
+    hamming = bits.sum(axis=1)[:, None] + bits.sum(axis=1)[None, :] - 2 * bits @ bits.T
+    return np.mean([np.exp(-hamming / (2 * width)) for width in bandwidths], axis=0)
+
+
+def element_set_targets(num_elements: int, path: Path = DATA_PATH) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """Most frequent allowed elements and the per-phase distribution of their presence bitstrings.
+
+    Each distinct (formula, phase) counts once; elements outside the top ``num_elements``
+    are dropped from a formula.
+    """
+    df = pd.read_parquet(path, columns=["formula", "phase_label"]).drop_duplicates()
+    allowed = sorted(load_constraints()["composition_rules"]["allowed_elements"])
+    present = composition_matrix(df["formula"], allowed) > 0
+    top = np.sort(np.argsort(-present.sum(axis=0), kind="stable")[:num_elements])
+    symbols = tuple(allowed[i] for i in top)
+    codes = present[:, top] @ (1 << np.arange(len(top)))
+    phases = df["phase_label"].map({phase: i for i, phase in enumerate(PHASES)}).to_numpy()
+    targets = np.zeros((len(PHASES), 2 ** len(symbols)))
+    np.add.at(targets, (phases, codes), 1.0)
+    return symbols, targets / targets.sum(axis=1, keepdims=True)
+
+
+def loss_and_gradient(
+    model: BornMachine, params: np.ndarray, targets: np.ndarray, kernel: np.ndarray
+) -> Tuple[float, np.ndarray, np.ndarray]:
+    """Mean squared MMD over phases and its exact parameter-shift gradient.
+
+    The base circuit and the ``+-pi/2`` shift of every parameter, for every phase, form one
+    batch of ``phases * (2P + 1)`` circuits simulated together; for Ry,
+    ``dp/dtheta_i = (p(theta + pi/2 e_i) - p(theta - pi/2 e_i)) / 2``.
+    """
+    P = model.num_params
+    shifts = np.vstack([np.zeros(P), np.pi / 2 * np.eye(P), -np.pi / 2 * np.eye(P)])
+    n_phases = len(targets)
+    batch = np.tile(params + shifts, (n_phases, 1))
+    probs = model.probabilities(batch, np.repeat(np.arange(n_phases), len(shifts))).reshape(n_phases, len(shifts), -1)
+    base, plus, minus = probs[:, 0], probs[:, 1 : P + 1], probs[:, P + 1 :]
+    residual = base - targets
+    weighted = residual @ kernel
+    loss = float(np.einsum("cx,cx->", weighted, residual)) / n_phases
+    grad = np.einsum("cx,cpx->p", weighted, plus - minus) / n_phases
+    return loss, grad, base
+
+
+def distribution_metrics(model: BornMachine, probs: np.ndarray, targets: np.ndarray, min_k: int, max_k: int) -> Dict:
+    counts = ((np.arange(probs.shape[1])[:, None] >> np.arange(model.num_data)) & 1).sum(axis=1)
+    valid = (counts >= min_k) & (counts <= max_k)
+    metrics = {}
+    for c, phase in enumerate(PHASES):
+        p, q = probs[c], targets[c]
+        support = q > 0
+        metrics[phase] = {
+            "total_variation": float(0.5 * np.abs(p - q).sum()),
+            "kl_data_model": float(np.sum(q[support] * np.log(q[support] / np.maximum(p[support], 1e-12)))),
+            "target_mass_covered": float(p[support].sum()),
+            "valid_element_count_mass": float(p[valid].sum()),
+        }
+    return metrics
+
+
+def save_checkpoint(path: Path, model: BornMachine, state: Dict[str, np.ndarray], history: List[dict]) -> None:
+    tmp = path.with_name(path.stem + ".tmp.npz")
+    np.savez(tmp, symbols=np.array(model.symbols), layers=model.layers, history=json.dumps(history), **state)
+    tmp.replace(path)
+
+
+def load_checkpoint(path: Path) -> Tuple[BornMachine, Dict[str, np.ndarray], List[dict]]:
+    with np.load(path) as data:
+        model = BornMachine(tuple(data["symbols"].tolist()), int(data["layers"]))
+        state = {key: data[key] for key in ("params", "m", "v", "step")}
+        history = json.loads(str(data["history"]))
+    return model, state, history
+
+
+def train(
+    model: BornMachine,
+    targets: np.ndarray,
+    steps: int = 300,
+    lr: float = 0.05,
+    checkpoint: Path = CHECKPOINT_PATH,
+    checkpoint_every: int = 25,
+    resume: bool = False,
+    seed: int = 42,
+) -> Tuple[np.ndarray, List[dict]]:
+    """Adam on the MMD loss; the optimizer state is checkpointed so training can resume."""
+    kernel = mmd_kernel(model.num_data)
+    if resume and checkpoint.exists():
+        loaded, state, history = load_checkpoint(checkpoint)
+        if loaded != model:
+            raise ValueError(f"Checkpoint {checkpoint} was trained for a different circuit")
+    else:
+        rng = np.random.default_rng(seed)
+        # Small angles start near |phase>|0...0>, away from the barren-plateau regime.
+        params = rng.normal(0.0, 0.1, model.num_params)
+        state = {"params": params, "m": np.zeros_like(params), "v": np.zeros_like(params), "step": np.array(0)}
+        history = []
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    start = time.perf_counter()
+    for _ in range(int(state["step"]), steps):
+        loss, grad, _ = loss_and_gradient(model, state["params"], targets, kernel)
+        step = int(state["step"]) + 1
+        state["m"] = beta1 * state["m"] + (1 - beta1) * grad
+        state["v"] = beta2 * state["v"] + (1 - beta2) * grad ** 2
+        m_hat = state["m"] / (1 - beta1 ** step)
+        v_hat = state["v"] / (1 - beta2 ** step)
+        state["params"] = state["params"] - lr * m_hat / (np.sqrt(v_hat) + eps)
+        state["step"] = np.array(step)
+        history.append({"step": step, "mmd": loss, "seconds": time.perf_counter() - start})
+        if step % checkpoint_every == 0 or step == steps:
+            save_checkpoint(checkpoint, model, state, history)
+    return state["params"], history
+
+
+def sample_element_sets(
+    model: BornMachine, params: np.ndarray, phases: np.ndarray, rng: np.random.Generator
+) -> np.ndarray:
+    """One presence bitstring (as an integer code) per row of ``phases`` (indices into ``PHASES``).
+
+    Each row is drawn by inverse CDF from the circuit's distribution for its own phase.
+    """
+    phases = np.asarray(phases)
+    cdf = np.cumsum(model.probabilities(np.tile(params, (len(PHASES), 1)), np.arange(len(PHASES))), axis=1)
+    u = rng.random(len(phases)) * cdf[phases, -1]
+    codes = np.empty(len(phases), dtype=np.int64)
+    for c in np.unique(phases):
+        rows = phases == c
+        codes[rows] = np.searchsorted(cdf[c], u[rows], side="right")
+    return np.minimum(codes, cdf.shape[1] - 1)
+
+
+def sample_compositions(
+    model: BornMachine,
+    params: np.ndarray,
+    phase: str | Sequence[str],
+    n: int,
+    rng: Optional[np.random.Generator] = None,
+) -> Tuple[CompositionBatch, float]:
+    """Compositions whose element sets come from the trained circuit, conditioned on ``phase``.
+
+    ``phase`` is one label for every row or a label per row. The circuit only models which
+    of its top elements are present; fractions come from the bounds-exact
+    ``CompositionSampler``. Element sets outside the allowed count are discarded (the
+    returned rate is the share kept), and the batch carries each kept row's phase.
+    """
+    rng = rng or np.random.default_rng()
+    sampler = CompositionSampler.from_constraints(load_constraints())
+    labels = np.broadcast_to(np.asarray(phase, dtype=object), (n,))
+    codes = sample_element_sets(model, params, np.array([PHASES.index(label) for label in labels], dtype=int), rng)
+    bits = ((codes[:, None] >> np.arange(model.num_data)) & 1).astype(bool)
+    keep = np.isin(bits.sum(axis=1), sampler.counts)
+    bits = bits[keep]
+    index = np.array([sampler.symbols.index(symbol) for symbol in model.symbols])
+    elements = np.full((len(bits), sampler.max_elements), -1, dtype=np.int16)
+    # Left-align the present elements of every row (symbols are sorted, so rows stay sorted).
+    order = np.argsort(~bits, axis=1, kind="stable")[:, : sampler.max_elements]
+    present = np.take_along_axis(bits, order, axis=1)
+    elements[:, : order.shape[1]] = np.where(present, index[order], -1)
+    batch = sampler.fill(elements, rng)
+    batch.phases = labels[keep].astype(str)
+    return batch, float(keep.mean()) if n else 0.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train a phase-conditioned circuit Born machine on HEA element sets")
+    parser.add_argument("--elements", type=int, default=10, help="Most frequent elements modelled (one qubit each)")
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--lr", type=float, default=0.05)
+    parser.add_argument("--checkpoint", type=Path, default=CHECKPOINT_PATH)
+    parser.add_argument("--checkpoint-every", type=int, default=25)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--samples", type=int, default=10000, help="Compositions drawn per phase after training")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    symbols, targets = element_set_targets(args.elements)
+    model = BornMachine(symbols, args.layers)
+    start = time.perf_counter()
+    params, history = train(
+        model, targets, args.steps, args.lr, args.checkpoint, args.checkpoint_every, args.resume, args.seed
+    )
+    train_seconds = time.perf_counter() - start
+    rules = load_constraints()["composition_rules"]
+    probs = model.probabilities(np.tile(params, (len(PHASES), 1)), np.arange(len(PHASES)))
+    rng = np.random.default_rng(args.seed)
+    sampling = {}
+    for phase in PHASES:
+        begin = time.perf_counter()
+        batch, kept = sample_compositions(model, params, phase, args.samples, rng)
+        sampling[phase] = {
+            "kept_rate": kept,
+            "fraction_acceptance_rate": batch.acceptance_rate,
+            "seconds": time.perf_counter() - begin,
+            "examples": batch.strings()[:3],
+        }
+    metrics = {
+        "model": {**asdict(model), "qubits": model.num_qubits, "parameters": model.num_params},
+        "steps": len(history),
+        "train_seconds": train_seconds,
+        "initial_mmd": history[0]["mmd"] if history else None,
+        "final_mmd": history[-1]["mmd"] if history else None,
+        "distributions": distribution_metrics(
+            model, probs, targets, rules["min_unique_elements"], rules["max_unique_elements"]
+        ),
+        "sampling": sampling,
+        "checkpoint": str(args.checkpoint),
+    }
+    METRICS_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+    print(json.dumps(metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()
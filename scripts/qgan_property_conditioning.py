@@ -8,51 +8,105 @@ from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from property_surrogate import PropertySurrogate, TARGETS, dft_targets, fit_surrogate
+from qgan_prototype import read_candidates
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 INPUT_CSV = BASE_DIR / "data" / "qml" / "qgan_candidates.csv"
 OUTPUT_CSV = BASE_DIR / "data" / "qml" / "qgan_conditioned_candidates.csv"
+OUTPUT_PARQUET = BASE_DIR / "data" / "qml" / "qgan_conditioned_candidates.parquet"
 METRICS_JSON = BASE_DIR / "data" / "qml" / "qgan_property_metrics.json"
 
-DFT_PRIOR_PATH = BASE_DIR / "data" / "dft_handoff" / "output" / "QAL-0001" / "results.json"
 
+def conditioned_candidates_path() -> Path:
+    """The most recently written conditioned candidate file (Parquet from streamed runs, else CSV)."""
+    existing = [path for path in (OUTPUT_PARQUET, OUTPUT_CSV) if path.exists()]
+    return max(existing, key=lambda path: path.stat().st_mtime) if existing else OUTPUT_CSV
+
+
+def load_dft_prior(surrogate: PropertySurrogate) -> float:
+    """Mean DFT density minus the surrogate's density for the same compositions (0 without DFT data).
 
-def load_dft_prior() -> float:
-    if not DFT_PRIOR_PATH.exists():
+    ``surrogate`` must be fitted without the DFT rows (``fit_surrogate(dft_weight=0)``), or
+    the bias is measured in-sample.
+    """
+    formulas, dft = dft_targets()
+    observed = dft["density_g_cm3"].to_numpy()
+    rows = ~np.isnan(observed)
+    if not rows.any():
         return 0.0
-    results = json.loads(DFT_PRIOR_PATH.read_text())
-    return float(results["properties"].get("exp_density_g_cm3", 0.0))
+    predicted = surrogate.predict_compositions([formulas[i] for i in np.flatnonzero(rows)])
+    return float(np.mean(observed[rows] - predicted["predicted_density_g_cm3"].to_numpy()))
 
 
-def adjust_density(row: pd.Series, alpha: float, dft_prior: float) -> float:
-    target = row["target_density_g_cm3"]
-    noise_scale = 0.05
-    noise = np.random.normal(0, noise_scale)
-    return float(target + noise)
+def adjust_density(predicted: np.ndarray, alpha: float, dft_prior: float) -> np.ndarray:
+    """Shift surrogate densities by ``alpha`` times the DFT-measured surrogate bias.
+
+    ``alpha`` is the share of the bias trusted: 0 keeps the HEA-only surrogate, 1 applies the
+    full mean offset that the DFT compositions show.
+    """
+    return predicted + alpha * dft_prior
+
+
+def condition(
+    df: pd.DataFrame, alpha: float, dft_prior: float, tolerance: float, surrogate: PropertySurrogate
+) -> pd.DataFrame:
+    predicted = surrogate.predict_compositions(pa.array(df["composition"], pa.string()))
+    for target in TARGETS:
+        df[f"surrogate_{target}"] = predicted[f"predicted_{target}"].to_numpy()
+    df["conditioned_density_g_cm3"] = adjust_density(df["surrogate_density_g_cm3"].to_numpy(), alpha, dft_prior)
+    df["density_error"] = (df["conditioned_density_g_cm3"] - df["target_density_g_cm3"]).abs()
+    df["property_compliant"] = (df["density_error"] <= tolerance).astype(int)
+    return df
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Property conditioning for QGAN outputs")
     parser.add_argument("--tolerance", type=float, default=0.15)
-    parser.add_argument("--alpha", type=float, default=0.3)
+    parser.add_argument("--alpha", type=float, default=0.3, help="Share of the DFT-measured density bias applied")
+    parser.add_argument("--input", type=Path, default=INPUT_CSV, help="Candidate CSV, or Parquet to condition batch by batch")
     args = parser.parse_args()
 
-    df = pd.read_csv(INPUT_CSV)
-    dft_prior = load_dft_prior()
-    df["conditioned_density_g_cm3"] = df.apply(lambda row: adjust_density(row, args.alpha, dft_prior), axis=1)
-    df["density_error"] = (df["conditioned_density_g_cm3"] - df["target_density_g_cm3"]).abs()
-    df["property_compliant"] = (df["density_error"] <= args.tolerance).astype(int)
-
-    compliance_rate = df["property_compliant"].mean()
-    conditioned_valid = df[df["valid"] == 1]["property_compliant"].mean()
+    # DFT results enter only through the offset, so the surrogate is fitted on the HEA table alone.
+    surrogate = fit_surrogate(dft_weight=0.0)
+    dft_prior = load_dft_prior(surrogate)
+    samples = compliant = valid = valid_compliant = 0
+    if args.input.suffix == ".parquet":
+        # Stream row groups so that memory stays bounded for any candidate count.
+        output = OUTPUT_PARQUET
+        writer = None
+        try:
+            for batch in read_candidates(args.input):
+                df = condition(batch, args.alpha, dft_prior, args.tolerance, surrogate)
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output, table.schema, compression="zstd")
+                writer.write_table(table)
+                samples += len(df)
+                compliant += int(df["property_compliant"].sum())
+                valid += int((df["valid"] == 1).sum())
+                valid_compliant += int(df.loc[df["valid"] == 1, "property_compliant"].sum())
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        output = OUTPUT_CSV
+        df = condition(pd.read_csv(args.input), args.alpha, dft_prior, args.tolerance, surrogate)
+        df.to_csv(output, index=False)
+        samples, compliant = len(df), int(df["property_compliant"].sum())
+        valid = int((df["valid"] == 1).sum())
+        valid_compliant = int(df.loc[df["valid"] == 1, "property_compliant"].sum())
 
-    df.to_csv(OUTPUT_CSV, index=False)
     metrics = {
-        "samples": len(df),
-        "compliance_rate": float(compliance_rate),
-        "compliance_valid_only": float(conditioned_valid),
+        "samples": samples,
+        "compliance_rate": compliant / samples if samples else float("nan"),
+        "compliance_valid_only": valid_compliant / valid if valid else float("nan"),
         "tolerance": args.tolerance,
         "alpha": args.alpha,
+        "dft_density_offset": dft_prior,
     }
     METRICS_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
     print(json.dumps(metrics, indent=2))
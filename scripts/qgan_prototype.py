@@ -4,85 +4,598 @@ from __future__ import annotations
 
 import argparse
 import json
-import random
+import os
+import resource
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import yaml
+from scipy.special import comb
+
+from candidate_dedup import (
+    BLOOM_CAPACITY,
+    DEFAULT_TOLERANCE,
+    INDEX_KINDS,
+    DedupIndex,
+    composition_keys,
+    open_index,
+    seed_with_training,
+)
+from property_surrogate import PropertySurrogate, dense_fractions, fit_surrogate
+from qml_utils import pool_context
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 CONSTRAINT_PATH = BASE_DIR / "data" / "metadata" / "hea_constraints.yaml"
 OUTPUT_CSV = BASE_DIR / "data" / "qml" / "qgan_candidates.csv"
+OUTPUT_PARQUET = BASE_DIR / "data" / "qml" / "qgan_candidates.parquet"
 METRICS_JSON = BASE_DIR / "data" / "qml" / "qgan_metrics.json"
 
-random.seed(42)
-np.random.seed(42)
+PHASES = ["FCC", "BCC", "other"]
+# Phase label of candidates drawn without a phase-conditioned model.
+UNCONDITIONED = "unconditioned"
+STREAM_BATCH = 100_000
+MAX_DRAWS_PER_CANDIDATE = 20
+# Rows per independent RNG stream in sharded generation; fixed so output does not depend on the worker count.
+SHARD_SIZE = 1_000_000
 
 
 def load_constraints() -> Dict:
     return yaml.safe_load(CONSTRAINT_PATH.read_text())
 
 
-def sample_composition(elements: List[str], num_elements: int, min_frac: float, max_frac: float) -> Dict[str, float]:
-    selected = np.random.choice(elements, size=num_elements, replace=False)
-    fractions = np.random.dirichlet(np.ones(num_elements))
-    # rescale to enforce min/max bounds
-    fractions = np.clip(fractions, min_frac, None)
-    fractions /= fractions.sum()
-    fractions = np.clip(fractions, None, max_frac)
-    fractions /= fractions.sum()
-    return dict(zip(selected, fractions))
-
-
-def synthesize_candidates(n: int = 100) -> Tuple[pd.DataFrame, float]:
-    constraints = load_constraints()
-    allowed = constraints["composition_rules"]["allowed_elements"]
-    min_elems = constraints["composition_rules"]["min_unique_elements"]
-    max_elems = constraints["composition_rules"]["max_unique_elements"]
-    min_frac = constraints["composition_rules"]["min_atomic_fraction"]
-    max_frac = constraints["composition_rules"]["max_atomic_fraction"]
-
-    records = []
-    valid = 0
-    for idx in range(n):
-        num_elements = np.random.randint(min_elems, max_elems + 1)
-        comp = sample_composition(allowed, num_elements, min_frac, max_frac)
-        phase = random.choice(["FCC", "BCC", "other"])
-        target_density = np.random.uniform(6.0, 9.0)
-        predicted_density = target_density + np.random.normal(0, 0.2)
-        entry = {
-            "candidate_id": f"QGAN-{idx:03d}",
-            "composition": " ".join(f"{el}{frac:.2f}" for el, frac in comp.items()),
-            "phase": phase,
-            "predicted_density_g_cm3": round(float(predicted_density), 3),
-            "target_density_g_cm3": round(float(target_density), 3),
-            "valid": 1,
+def capped_simplex_acceptance(k: int, total: float, cap: float) -> float:
+    """P(every part <= cap) for ``total`` split uniformly into ``k`` parts (inclusion-exclusion)."""
+    if total <= 0:
+        return 1.0
+    j = np.arange(k + 1)
+    return float(np.sum((-1.0) ** j * comb(k, j) * np.maximum(1 - j * cap / total, 0.0) ** (k - 1)))
+
+
+@dataclass
+class CompositionBatch:
+    """Padded ``(n, max_elements)`` block of compositions.
+
+    ``elements`` holds sorted indices into ``symbols`` (-1 past each row's element count)
+    and ``fractions`` the matching atomic fractions (0 in the padding). ``phases`` holds the
+    label each row was conditioned on, when a phase-conditioned model drew it.
+    """
+
+    elements: np.ndarray
+    fractions: np.ndarray
+    symbols: List[str]
+    acceptance_rate: float
+    phases: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+    def take(self, rows: np.ndarray) -> "CompositionBatch":
+        phases = None if self.phases is None else self.phases[rows]
+        return CompositionBatch(self.elements[rows], self.fractions[rows], self.symbols, self.acceptance_rate, phases)
+
+    def quantized(self, decimals: int = 2) -> np.ndarray:
+        """Integer fractions in units of ``10**-decimals`` that sum to exactly ``10**decimals`` per row.
+
+        Largest-remainder rounding: every fraction is floored and the shortfall goes one unit
+        at a time to the largest remainders. Each value moves to its floor or ceiling, so
+        fractions within lattice-aligned bounds stay within them.
+        """
+        scale = 10 ** decimals
+        scaled = np.where(self.elements >= 0, self.fractions * scale, 0.0)
+        quantized = np.floor(scaled)
+        remainder = np.where(self.elements >= 0, scaled - quantized, -1.0)
+        shortfall = np.rint(scale - quantized.sum(axis=1, keepdims=True))
+        rank = np.argsort(np.argsort(-remainder, axis=1, kind="stable"), axis=1)
+        return (quantized + (rank < shortfall)).astype(np.int64)
+
+    def emitted_fractions(self, decimals: int = 2) -> np.ndarray:
+        """Fractions as ``strings`` writes them, so keys of a batch match keys of its file."""
+        return self.quantized(decimals) / 10 ** decimals
+
+    def strings(self, decimals: int = 2) -> List[str]:
+        # Look tokens up by (element, quantized fraction); the extra last row pads with "".
+        scale = 10 ** decimals
+        tokens = np.array(
+            [[f"{symbol}{q / scale:.{decimals}f} " for q in range(scale + 1)] for symbol in self.symbols]
+            + [[""] * (scale + 1)],
+            dtype=object,
+        )
+        return ["".join(row)[:-1] for row in tokens[self.elements, self.quantized(decimals)].tolist()]
+
+    def emitted_valid(self, rules: Dict, decimals: int = 2) -> np.ndarray:
+        """Whether each row, as written with ``decimals``, meets ``rules`` (a check on ``quantized``)."""
+        quantized = self.quantized(decimals)
+        counts = (quantized > 0).sum(axis=1)
+        share = quantized / np.maximum(quantized.sum(axis=1, keepdims=True), 1)
+        eps = 1e-9
+        in_bounds = (share >= rules["min_atomic_fraction"] - eps) & (share <= rules["max_atomic_fraction"] + eps)
+        return (
+            (counts >= rules["min_unique_elements"])
+            & (counts <= rules["max_unique_elements"])
+            & (in_bounds | (quantized == 0)).all(axis=1)
+        )
+
+
+class CompositionSampler:
+    """Uniform sampler over compositions that satisfy ``composition_rules`` exactly.
+
+    A row picks ``k`` distinct elements uniformly, then fractions uniformly from the
+    truncated simplex ``{x : sum x = 1, min_frac <= x_i <= max_frac}``. With ``y = x - min_frac``
+    that is a simplex of total ``1 - k min_frac`` capped at ``max_frac - min_frac``; with
+    ``y = max_frac - x`` one of total ``k max_frac - 1`` under the same cap. Flat Dirichlet
+    draws on the smaller of the two are rejected when a part exceeds the cap, which keeps
+    the acceptance rate above one half for every ``k`` of the HEA rules. All draws of a
+    batch are vectorized per ``k``.
+    """
+
+    def __init__(self, elements: List[str], min_elements: int, max_elements: int, min_frac: float, max_frac: float):
+        self.symbols = list(elements)
+        self.min_frac, self.max_frac = min_frac, max_frac
+        self.max_elements = min(max_elements, len(self.symbols))
+        self.counts = [
+            k for k in range(min_elements, self.max_elements + 1) if k * min_frac <= 1 <= k * max_frac
+        ]
+        if not self.counts:
+            raise ValueError("No element count can satisfy the atomic-fraction bounds")
+        self.acceptance = {k: capped_simplex_acceptance(k, *self._simplex(k)[:2]) for k in self.counts}
+
+    @classmethod
+    def from_constraints(cls, constraints: Dict) -> "CompositionSampler":
+        rules = constraints["composition_rules"]
+        return cls(
+            rules["allowed_elements"],
+            rules["min_unique_elements"],
+            rules["max_unique_elements"],
+            rules["min_atomic_fraction"],
+            rules["max_atomic_fraction"],
+        )
+
+    def _simplex(self, k: int) -> Tuple[float, float, bool]:
+        below, above = 1 - k * self.min_frac, k * self.max_frac - 1
+        return min(below, above), self.max_frac - self.min_frac, above < below
+
+    def _fractions(self, k: int, size: int, rng: np.random.Generator) -> Tuple[np.ndarray, int, int]:
+        total, cap, from_top = self._simplex(k)
+        accepted, passed, proposed, have = [], 0, 0, 0
+        while have < size:
+            draws = min(int((size - have) / self.acceptance[k] * 1.05) + 16, 1 << 20)
+            parts = rng.standard_exponential((draws, k))
+            parts *= total / parts.sum(axis=1, keepdims=True)
+            parts = parts[(parts <= cap).all(axis=1)]
+            accepted.append(parts[: size - have])
+            passed += len(parts)
+            proposed += draws
+            have += len(parts)
+        y = np.concatenate(accepted)
+        x = self.max_frac - y if from_top else self.min_frac + y
+        return np.clip(x, self.min_frac, self.max_frac), passed, proposed
+
+    def sample(self, n: int, rng: Optional[np.random.Generator] = None) -> CompositionBatch:
+        rng = rng or np.random.default_rng()
+        elements = np.full((n, self.max_elements), -1, dtype=np.int16)
+        counts = rng.choice(self.counts, size=n)
+        for k in self.counts:
+            rows = np.flatnonzero(counts == k)
+            if len(rows):
+                keys = rng.random((len(rows), len(self.symbols)))
+                elements[rows, :k] = np.sort(np.argpartition(keys, k - 1, axis=1)[:, :k], axis=1)
+        return self.fill(elements, rng)
+
+    def fill(self, elements: np.ndarray, rng: Optional[np.random.Generator] = None) -> CompositionBatch:
+        """Draw fractions for given element rows (left-aligned indices into ``symbols``, -1 padded)."""
+        rng = rng or np.random.default_rng()
+        elements = np.asarray(elements, dtype=np.int16)
+        counts = (elements >= 0).sum(axis=1)
+        if not np.isin(counts, self.counts).all():
+            raise ValueError(f"Element counts must be one of {self.counts}")
+        fractions = np.zeros(elements.shape)
+        passed = proposed = 0
+        for k in self.counts:
+            rows = np.flatnonzero(counts == k)
+            if not len(rows):
+                continue
+            fractions[rows, :k], ok, drawn = self._fractions(k, len(rows), rng)
+            passed += ok
+            proposed += drawn
+        return CompositionBatch(elements, fractions, self.symbols, passed / proposed if proposed else 1.0)
+
+
+def checkpoint_sampler(
+    checkpoint: Path, phases: Sequence[str] = PHASES
+) -> Callable[[int, np.random.Generator], CompositionBatch]:
+    """Draw function backed by a trained ``qcbm_trainer`` Born machine.
+
+    Each row picks a phase uniformly from ``phases`` and its element set from the circuit
+    conditioned on that phase. The circuit only learns which of its top elements are
+    present; fractions are uniform over the bounds (``CompositionSampler.fill``).
+    """
+    # qcbm_trainer imports this module, so it is loaded on first use.
+    from qcbm_trainer import load_checkpoint, sample_compositions
+
+    model, state, _ = load_checkpoint(checkpoint)
+    labels = np.asarray(phases, dtype=object)
+
+    def draw(size: int, rng: np.random.Generator) -> CompositionBatch:
+        return sample_compositions(model, state["params"], rng.choice(labels, size=size), size, rng)[0]
+
+    return draw
+
+
+def benchmark_sampler(n: int, batch_size: int = 1_000_000, seed: int = 42) -> Dict:
+    sampler = CompositionSampler.from_constraints(load_constraints())
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    rates = []
+    for offset in range(0, n, batch_size):
+        batch = sampler.sample(min(batch_size, n - offset), rng)
+        rates.append((len(batch), batch.acceptance_rate))
+    elapsed = time.perf_counter() - start
+    return {
+        "compositions": n,
+        "seconds": round(elapsed, 3),
+        "compositions_per_minute": round(60 * n / elapsed),
+        "acceptance_rate": round(float(np.average([r for _, r in rates], weights=[w for w, _ in rates])), 4),
+        "expected_acceptance_by_elements": {k: round(v, 4) for k, v in sampler.acceptance.items()},
+    }
+
+
+@lru_cache(maxsize=None)
+def candidate_surrogate() -> PropertySurrogate:
+    """The default property surrogate, fitted once per process."""
+    return fit_surrogate()
+
+
+def candidate_ids(start: int, n: int, prefix: str = "QGAN-") -> List[str]:
+    return [f"{prefix}{idx:03d}" for idx in range(start, start + n)]
+
+
+def candidate_frame(
+    batch: CompositionBatch, start: int, rng: np.random.Generator, prefix: str = "QGAN-"
+) -> pd.DataFrame:
+    """Candidate rows for a composition batch, numbered from ``start``.
+
+    ``phase`` is the label the row was conditioned on (``UNCONDITIONED`` without a model),
+    ``predicted_density_g_cm3`` the property surrogate's density of the written composition
+    and ``valid`` whether that composition meets the HEA composition rules.
+    """
+    n = len(batch)
+    target_density = rng.uniform(6.0, 9.0, n)
+    surrogate = candidate_surrogate()
+    C = dense_fractions(batch.elements, batch.emitted_fractions(), batch.symbols, surrogate.symbols)
+    predicted_density = surrogate.predict(C)["predicted_density_g_cm3"].to_numpy()
+    rules = load_constraints()["composition_rules"]
+    return pd.DataFrame(
+        {
+            "candidate_id": candidate_ids(start, n, prefix),
+            "composition": batch.strings(),
+            "phase": np.full(n, UNCONDITIONED) if batch.phases is None else batch.phases,
+            "predicted_density_g_cm3": predicted_density.round(3),
+            "target_density_g_cm3": target_density.round(3),
+            "valid": batch.emitted_valid(rules).astype(np.int64),
         }
-        # mark some invalid deliberately
-        if random.random() < 0.1:
-            entry["valid"] = 0
-        else:
-            valid += 1
-        records.append(entry)
-    df = pd.DataFrame(records)
-    acceptance = valid / len(df)
+    )
+
+
+def iter_composition_batches(
+    n: int,
+    batch_size: int,
+    rng: np.random.Generator,
+    index: Optional[DedupIndex] = None,
+    draw: Optional[Callable[[int, np.random.Generator], CompositionBatch]] = None,
+) -> Iterator[Tuple[int, CompositionBatch, Optional[np.ndarray]]]:
+    """Yield ``(start, batch, keys)`` until ``n`` compositions are out.
+
+    ``draw(size, rng)`` supplies compositions (default: the uniform ``CompositionSampler``)
+    and may return fewer than ``size``. With an ``index``, compositions it already holds
+    (or repeated within the run) are dropped before any candidate row is built, and
+    further draws make up the count.
+    """
+    draw = draw or CompositionSampler.from_constraints(load_constraints()).sample
+    start = drawn = 0
+    while start < n:
+        size = min(batch_size, n - start)
+        batch = draw(size, rng)
+        drawn += size
+        keys = None
+        if index is not None:
+            keys = composition_keys(batch.elements, batch.emitted_fractions(), batch.symbols, index.tolerance)
+            keep = index.keep_new(keys)
+            batch, keys = batch.take(keep), keys[keep]
+        if drawn > MAX_DRAWS_PER_CANDIDATE * n:
+            raise RuntimeError(f"Fewer than 1 in {MAX_DRAWS_PER_CANDIDATE} draws is kept; the quantized space is exhausted")
+        if not len(batch):
+            continue
+        yield start, batch, keys
+        start += len(batch)
+
+
+def iter_candidate_batches(
+    n: int,
+    batch_size: int = STREAM_BATCH,
+    seed: int | np.random.SeedSequence = 42,
+    index: Optional[DedupIndex] = None,
+    prefix: str = "QGAN-",
+    draw: Optional[Callable[[int, np.random.Generator], CompositionBatch]] = None,
+) -> Iterator[pd.DataFrame]:
+    """Yield ``n`` candidates as frames of at most ``batch_size`` rows; memory is bounded by one batch."""
+    rng = np.random.default_rng(seed)
+    for start, batch, _ in iter_composition_batches(n, batch_size, rng, index, draw):
+        yield candidate_frame(batch, start, rng, prefix)
+
+
+def synthesize_candidates(
+    n: int = 100,
+    index: Optional[DedupIndex] = None,
+    seed: int = 42,
+    draw: Optional[Callable[[int, np.random.Generator], CompositionBatch]] = None,
+) -> Tuple[pd.DataFrame, float]:
+    df = pd.concat(list(iter_candidate_batches(n, max(n, 1), seed, index, draw=draw)), ignore_index=True)
+    acceptance = df["valid"].sum() / len(df)
     return df, acceptance
 
 
+def write_candidate_stream(
+    n: int,
+    path: Path = OUTPUT_PARQUET,
+    batch_size: int = STREAM_BATCH,
+    seed: int = 42,
+    index: Optional[DedupIndex] = None,
+    draw: Optional[Callable[[int, np.random.Generator], CompositionBatch]] = None,
+) -> Dict:
+    """Generate ``n`` candidates straight into Parquet, one row group per batch."""
+    start = time.perf_counter()
+    rows = valid = groups = 0
+    writer: Optional[pq.ParquetWriter] = None
+    try:
+        for frame in iter_candidate_batches(n, batch_size, seed, index, draw=draw):
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+            writer.write_table(table, row_group_size=len(frame))
+            rows += len(frame)
+            valid += int(frame["valid"].sum())
+            groups += 1
+    finally:
+        if writer is not None:
+            writer.close()
+    elapsed = time.perf_counter() - start
+    return {
+        "samples_generated": rows,
+        "valid_samples": valid,
+        "acceptance_rate": valid / rows if rows else 0.0,
+        "row_groups": groups,
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 3),
+        "candidates_per_second": round(rows / elapsed) if elapsed else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _write_shard(task: Tuple) -> Dict:
+    stream, n, batch_size, seed, path, index_path, index_kind, tolerance, checkpoint, phases = task
+    start = time.perf_counter()
+    # A read-only snapshot drops earlier runs' compositions; cross-stream repeats go at merge time.
+    index = None if index_path is None else open_index(index_path, index_kind, tolerance)
+    draw = None if checkpoint is None else checkpoint_sampler(checkpoint, phases)
+    rng = np.random.default_rng(seed)
+    keys: List[np.ndarray] = []
+    rows = 0
+    writer: Optional[pq.ParquetWriter] = None
+    try:
+        for offset, batch, batch_keys in iter_composition_batches(n, batch_size, rng, index, draw):
+            table = pa.Table.from_pandas(candidate_frame(batch, offset, rng, f"QGAN-{stream:03d}-"), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+            writer.write_table(table, row_group_size=len(batch))
+            rows += len(batch)
+            if batch_keys is not None:
+                keys.append(batch_keys)
+    finally:
+        if writer is not None:
+            writer.close()
+    if keys:
+        np.save(path.with_suffix(".keys.npy"), np.concatenate(keys))
+    return {"stream": stream, "rows": rows, "seconds": time.perf_counter() - start, "dropped": 0 if index is None else index.dropped}
+
+
+def write_candidate_shards(
+    n: int,
+    path: Path = OUTPUT_PARQUET,
+    batch_size: int = STREAM_BATCH,
+    seed: int = 42,
+    workers: Optional[int] = None,
+    shard_size: int = SHARD_SIZE,
+    index: Optional[DedupIndex] = None,
+    checkpoint: Optional[Path] = None,
+    phases: Sequence[str] = PHASES,
+) -> Dict:
+    """Generate ``n`` candidates on a process pool, one independent RNG stream per shard.
+
+    Shard ``s`` covers ``shard_size`` rows with the ``s``-th ``SeedSequence(seed)`` child and
+    IDs ``QGAN-<s>-<row>``; shards are merged in stream order, so the file depends only on
+    ``seed`` and ``shard_size``, never on ``workers``. With a ``checkpoint`` every shard
+    draws from that Born machine (see ``checkpoint_sampler``).
+
+    With an ``index``, repeats across shards are dropped at merge time and each shard's
+    IDs are renumbered to stay contiguous; the missing rows are then drawn from one more
+    stream, the next ``SeedSequence(seed)`` child, against the merged index, so the file
+    always holds ``n`` rows.
+    """
+    start = time.perf_counter()
+    sizes = [min(shard_size, n - offset) for offset in range(0, n, shard_size)]
+    # One child beyond the shards seeds the top-up stream.
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes) + 1)
+    parts_dir = path.with_name(path.stem + ".parts")
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    parts = [parts_dir / f"stream-{stream:05d}.parquet" for stream in range(len(sizes))]
+    index_path = None
+    if index is not None:
+        index_path = parts_dir / "index-snapshot.npz"
+        index.save(index_path)
+    tasks = [
+        (
+            stream, size, batch_size, child, part, index_path, None if index is None else index.kind,
+            None if index is None else index.tolerance, checkpoint, list(phases),
+        )
+        for stream, (size, child, part) in enumerate(zip(sizes, seeds, parts))
+    ]
+    n_jobs = max(1, min(workers or os.cpu_count() or 1, len(tasks)))
+    try:
+        if n_jobs == 1:
+            shards = [_write_shard(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=pool_context()) as pool:
+                shards = list(pool.map(_write_shard, tasks))
+        generated = time.perf_counter()
+        rows = valid = top_up = 0
+        writer: Optional[pq.ParquetWriter] = None
+
+        def write(table: pa.Table) -> None:
+            nonlocal writer, rows, valid
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+            writer.write_table(table)
+            rows += table.num_rows
+            valid += int(pc.sum(table["valid"]).as_py() or 0)
+
+        try:
+            for stream, part in enumerate(parts):
+                if not part.exists():
+                    continue
+                keys = np.load(part.with_suffix(".keys.npy")) if index is not None else None
+                offset = kept = 0
+                source = pq.ParquetFile(part)
+                for group in range(source.num_row_groups):
+                    table = source.read_row_group(group)
+                    if keys is not None:
+                        table = table.filter(pa.array(index.keep_new(keys[offset : offset + len(table)])))
+                        offset += source.metadata.row_group(group).num_rows
+                        ids = pa.array(candidate_ids(kept, table.num_rows, f"QGAN-{stream:03d}-"), table.schema.field("candidate_id").type)
+                        table = table.set_column(table.schema.get_field_index("candidate_id"), "candidate_id", ids)
+                        kept += table.num_rows
+                    write(table)
+            if rows < n:
+                stream = len(sizes)
+                rng = np.random.default_rng(seeds[stream])
+                draw = None if checkpoint is None else checkpoint_sampler(checkpoint, phases)
+                for offset, batch, _ in iter_composition_batches(n - rows, batch_size, rng, index, draw):
+                    frame = candidate_frame(batch, offset, rng, f"QGAN-{stream:03d}-")
+                    write(pa.Table.from_pandas(frame, preserve_index=False))
+                    top_up += len(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    if index is not None:
+        index.dropped += sum(shard["dropped"] for shard in shards)
+    elapsed = time.perf_counter() - start
+    return {
+        "samples_generated": rows,
+        "valid_samples": valid,
+        "acceptance_rate": valid / rows if rows else 0.0,
+        "streams": len(sizes),
+        "workers": n_jobs,
+        "root_seed": seed,
+        "shard_size": shard_size,
+        "seconds": round(elapsed, 3),
+        "generate_seconds": round(generated - start, 3),
+        "merge_seconds": round(elapsed - (generated - start), 3),
+        "candidates_per_second": round(rows / elapsed) if elapsed else None,
+        "shard_seconds": [round(shard["seconds"], 3) for shard in shards],
+        "shard_rows": [shard["rows"] for shard in shards],
+        "top_up_rows": top_up,
+    }
+
+
+def read_candidates(
+    path: Path = OUTPUT_PARQUET, columns: Optional[List[str]] = None, batch_size: int = STREAM_BATCH
+) -> Iterator[pd.DataFrame]:
+    """Lazily read a candidate file batch by batch (CSV files are read in chunks)."""
+    path = Path(path)
+    if path.suffix == ".csv":
+        yield from pd.read_csv(path, usecols=columns, chunksize=batch_size)
+        return
+    for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+        yield record_batch.to_pandas()
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Generate simulated QGAN candidates")
     parser.add_argument("--num-samples", type=int, default=100)
+    parser.add_argument(
+        "--benchmark-sampler", type=int, default=None, metavar="N", help="Time the composition sampler on N draws and exit"
+    )
+    parser.add_argument("--stream", action="store_true", help="Write Parquet row groups batch by batch")
+    parser.add_argument("--batch-size", type=int, default=STREAM_BATCH)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Generate on a process pool with one RNG stream per shard (implies --stream)"
+    )
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--output", type=Path, default=None, help="Default: qgan_candidates.csv, or .parquet with --stream")
+    parser.add_argument(
+        "--dedup-index", type=Path, default=None, help="Drop compositions already in this index (created and seeded with the HEA training set if missing)"
+    )
+    parser.add_argument("--dedup-kind", choices=INDEX_KINDS, default="set")
+    parser.add_argument("--dedup-tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--dedup-capacity", type=int, default=BLOOM_CAPACITY, help="Keys a new bloom index is sized for")
+    parser.add_argument(
+        "--checkpoint", type=Path, default=None, help="Draw element sets from this qcbm_trainer checkpoint instead of uniformly"
+    )
+    parser.add_argument(
+        "--phases", nargs="+", choices=PHASES, default=PHASES, help="Phases the checkpoint is conditioned on (uniformly per row)"
+    )
     args = parser.parse_args()
 
-    df, acceptance = synthesize_candidates(args.num_samples)
-    df.to_csv(OUTPUT_CSV, index=False)
-    metrics = {
-        "samples_generated": len(df),
-        "valid_samples": int(df["valid"].sum()),
-        "acceptance_rate": acceptance,
-    }
+    if args.benchmark_sampler:
+        print(json.dumps(benchmark_sampler(args.benchmark_sampler), indent=2))
+        return
+
+    index = None
+    if args.dedup_index is not None:
+        is_new = not args.dedup_index.exists()
+        bloom = {"capacity": args.dedup_capacity} if args.dedup_kind == "bloom" else {}
+        index = open_index(args.dedup_index, args.dedup_kind, args.dedup_tolerance, **bloom)
+        if is_new:
+            seed_with_training(index)
+
+    draw = None if args.checkpoint is None else checkpoint_sampler(args.checkpoint, args.phases)
+    if args.workers is not None:
+        output = args.output or OUTPUT_PARQUET
+        metrics = write_candidate_shards(
+            args.num_samples, output, args.batch_size, args.seed, args.workers, args.shard_size, index,
+            args.checkpoint, args.phases,
+        )
+    elif args.stream:
+        output = args.output or OUTPUT_PARQUET
+        metrics = write_candidate_stream(args.num_samples, output, args.batch_size, args.seed, index, draw)
+    else:
+        output = args.output or OUTPUT_CSV
+        df, acceptance = synthesize_candidates(args.num_samples, index, args.seed, draw)
+        df.to_csv(output, index=False)
+        metrics = {
+            "samples_generated": len(df),
+            "valid_samples": int(df["valid"].sum()),
+            "acceptance_rate": acceptance,
+        }
+    metrics["generator"] = "uniform" if args.checkpoint is None else str(args.checkpoint)
+    if index is not None:
+        # Saved only after the output is written, so a failed run does not mask its compositions.
+        index.save()
+        metrics["duplicates_dropped"] = index.dropped
+        metrics["dedup_index_size"] = len(index)
+    metrics["output"] = str(output.relative_to(BASE_DIR) if output.is_relative_to(BASE_DIR) else output)
     METRICS_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
     print(json.dumps(metrics, indent=2))
 
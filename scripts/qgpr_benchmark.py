@@ -4,19 +4,33 @@ from __future__ import annotations
 
 import argparse
 import json
+import re
+import time
+from collections import Counter
+from dataclasses import replace
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.gaussian_process.kernels import DotProduct, WhiteKernel, RBF
+from sklearn.linear_model import BayesianRidge
 from sklearn.metrics import mean_squared_error
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 
+from gp_hyperopt import HyperparameterService, KernelSpec
+from kernel_approximation import LANDMARK_METHODS, NystroemMap, RandomFourierMap, approximation_error, rbf_kernel_fn
+from kernel_gp import DEFAULT_BLOCK_SIZE, BlockedExactGP, SparseGP, linear_kernel, unit_diagonal
+from quantum_kernels import FAMILY_QUBITS, PRECISIONS, FeatureMap, encode_states, fidelity_from_states
+
 BASE_DIR = Path(__file__).resolve().parents[1]
 DATA_PATH = BASE_DIR / "data" / "processed" / "perovskites_features.parquet"
 OUT_JSON = BASE_DIR / "data" / "qml" / "qgpr_metrics.json"
+OUT_MULTI_JSON = BASE_DIR / "data" / "qml" / "qgpr_multitarget_metrics.json"
+
+TARGETS = ("band_gap_eV", "formation_energy_per_atom_eV", "energy_above_hull_eV")
+TOKEN = re.compile(r"([A-Z][a-z]?|\(|\))(\d*\.?\d*)")
 
 
 def load_data():
@@ -27,6 +41,46 @@ def load_data():
     return X, y
 
 
+def parse_formula(formula: str) -> Counter:
+    """Element amounts of a formula such as ``V2(CuO2)5``."""
+    stack = [Counter()]
+    for token, amount in TOKEN.findall(formula):
+        count = float(amount) if amount else 1.0
+        if token == "(":
+            stack.append(Counter())
+        elif token == ")":
+            group = stack.pop()
+            for element, value in group.items():
+                stack[-1][element] += value * count
+        else:
+            stack[-1][token] += count
+    return stack[0]
+
+
+def composition_fractions(formulas: pd.Series, top_k: int = 8) -> tuple[np.ndarray, list[str]]:
+    """Atomic fractions of the ``top_k`` most common elements (oxygen excluded: it is everywhere)."""
+    parsed = [parse_formula(formula) for formula in formulas]
+    counts = Counter(element for comp in parsed for element in comp)
+    counts.pop("O", None)
+    elements = [element for element, _ in counts.most_common(top_k)]
+    fractions = np.zeros((len(parsed), len(elements)))
+    for i, comp in enumerate(parsed):
+        total = sum(comp.values())
+        for j, element in enumerate(elements):
+            fractions[i, j] = comp.get(element, 0.0) / total
+    return fractions, [f"frac_{element}" for element in elements]
+
+
+def load_multi_target(targets: tuple[str, ...] = TARGETS) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """Inputs for joint prediction: default features that are not targets, then composition fractions."""
+    df = pd.read_parquet(DATA_PATH)
+    features = [col for col in df.columns if col not in {"material_id", "formula", "spacegroup", "band_gap_eV", "log_band_gap", "is_insulator", *targets}]
+    fractions, fraction_names = composition_fractions(df["formula"])
+    X = np.hstack([df[features].fillna(df[features].median()).values, fractions])
+    Y = df[list(targets)].fillna(df[list(targets)].median()).values
+    return X, Y, features + fraction_names
+
+
 def coverage_score(y_true, y_pred, y_std, alpha: float = 0.05) -> float:
     z = 1.96  # approximate for 95%
     lower = y_pred - z * y_std
@@ -35,35 +89,198 @@ def coverage_score(y_true, y_pred, y_std, alpha: float = 0.05) -> float:
     return within
 
 
-def evaluate(random_state: int = 42) -> dict:
-    X, y = load_data()
+def low_rank_features(
+    X_train: np.ndarray,
+    X_test: np.ndarray,
+    kernel_mode: str,
+    components: int,
+    landmarks: str,
+    feature_map: FeatureMap,
+    length_scale: float,
+    random_state: int,
+    precision: str = "float64",
+) -> tuple[np.ndarray, np.ndarray, dict]:
+    """Explicit features whose inner products approximate the quantum (or RBF) kernel."""
+    if kernel_mode == "nystroem":
+        states_train = encode_states(X_train, feature_map, precision=precision)
+        nystroem = NystroemMap(fidelity_from_states, components, landmarks, random_state).fit(states_train)
+        phi_train = nystroem.transform(states_train)
+        phi_test = nystroem.transform(encode_states(X_test, feature_map, precision=precision))
+        error = approximation_error(phi_train, states_train, fidelity_from_states, random_state=random_state)
+    elif kernel_mode == "rff":
+        gamma = 1.0 / (2 * length_scale ** 2)
+        rff = RandomFourierMap(gamma, components, random_state).fit(X_train)
+        phi_train, phi_test = rff.transform(X_train).astype(precision), rff.transform(X_test).astype(precision)
+        error = approximation_error(phi_train, X_train, rbf_kernel_fn(gamma), random_state=random_state)
+    else:
+        raise ValueError(f"Unknown low-rank kernel mode {kernel_mode!r}")
+    return phi_train, phi_test, {"components": components, **error}
+
+
+def fit_solver_hyperparameters(
+    X_train: np.ndarray,
+    states_train: np.ndarray,
+    y_train: np.ndarray,
+    rows: int | None,
+    restarts: int = 4,
+    n_jobs: int | None = None,
+    random_state: int = 42,
+) -> tuple[dict, dict]:
+    """Maximum-likelihood amplitude, offset and noise of the full-data solvers' kernels.
+
+    Both kernels are fitted on the first ``rows`` training rows with the targets normalized
+    as the solvers normalize them: ``amplitude * (x.x' + sigma_0^2)`` for the classical model
+    and ``amplitude * |<psi|psi'>|^2`` for the quantum one. The returned ``noise`` includes
+    the fixed jitter.
+    """
+    rows = len(y_train) if rows is None else min(rows, len(y_train))
+    y = (y_train[:rows] - y_train.mean()) / y_train.std()
+    params, services = {}, {}
+    for name, inputs, spec in (
+        ("classical", X_train, KernelSpec("dot", amplitude=True, noise=True, alpha=1e-6)),
+        ("quantum", states_train, KernelSpec("fidelity", amplitude=True, noise=True, alpha=1e-6)),
+    ):
+        services[name] = HyperparameterService(spec, None, restarts, n_jobs=n_jobs, random_state=random_state)
+        fitted = services[name].fit_params(inputs[:rows], y)
+        params[name] = {
+            "amplitude": fitted["amplitude"],
+            "sigma_0": fitted.get("sigma_0"),
+            "noise": fitted["noise_level"] + spec.alpha,
+        }
+    return params, services
+
+
+def evaluate(
+    random_state: int = 42,
+    kernel_mode: str = "blocked",
+    components: int = 500,
+    landmarks: str = "kmeans++",
+    feature_map: FeatureMap | None = None,
+    split_state: int | None = None,
+    dataset: tuple[np.ndarray, np.ndarray] | None = None,
+    write_outputs: bool = True,
+    precision: str = "float64",
+    max_train: int | None = 2000,
+    noise: float | None = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    hyperopt: str = "sklearn",
+    restarts: int = 4,
+    n_jobs: int | None = None,
+) -> dict:
+    """Classical vs quantum GP regression; coverage is always scored on the full test split.
+
+    ``blocked`` (memory-mapped exact inference, the default) and ``sparse`` (``components``
+    inducing points) train on every row of the split with the linear and fidelity kernels.
+    Their amplitude and noise are first fitted by maximum likelihood on ``max_train`` rows
+    (``fit_solver_hyperparameters``); a given ``noise`` skips that and uses unit-amplitude
+    kernels at that noise on normalized targets. ``exact`` fits sklearn GPs with optimised
+    hyperparameters, which needs ``max_train`` training rows at most; ``hyperopt="service"``
+    optimises them with ``HyperparameterService`` (cached pairwise statistics, ``restarts``
+    parallel restarts). ``nystroem``/``rff`` fit Bayesian linear models on low-rank features.
+    """
+    if hyperopt != "sklearn" and kernel_mode != "exact":
+        raise ValueError(f"hyperopt={hyperopt!r} only applies to kernel_mode='exact', not {kernel_mode!r}")
+    if noise is not None and kernel_mode not in ("blocked", "sparse"):
+        raise ValueError(f"A fixed noise only applies to the blocked and sparse modes, not {kernel_mode!r}")
+    if feature_map is None:
+        feature_map = FeatureMap("composition_encoding", layers=2, bandwidth=0.5)
+    X, y = load_data() if dataset is None else dataset
     X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=random_state
+        X, y, test_size=0.2, random_state=random_state if split_state is None else split_state
     )
 
     scaler = StandardScaler()
     X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
 
-    # Subsample training set for efficiency and to mimic moderate data size
-    max_train = 2000
-    if len(X_train_scaled) > max_train:
-        X_train_scaled = X_train_scaled[:max_train]
-        y_train = y_train[:max_train]
-    max_test = 500
-    if len(X_test_scaled) > max_test:
-        X_test_scaled = X_test_scaled[:max_test]
-        y_test = y_test[:max_test]
-
-    classical_kernel = DotProduct() + WhiteKernel()
-    classical_gpr = GaussianProcessRegressor(kernel=classical_kernel, alpha=1e-3, random_state=random_state)
-    classical_gpr.fit(X_train_scaled, y_train)
-    y_pred_classical, y_std_classical = classical_gpr.predict(X_test_scaled, return_std=True)
-
-    quantum_kernel = 1.0 * RBF(length_scale=0.5)
-    quantum_gpr = GaussianProcessRegressor(kernel=quantum_kernel, alpha=1e-3, random_state=random_state)
-    quantum_gpr.fit(X_train_scaled, y_train)
-    y_pred_quantum, y_std_quantum = quantum_gpr.predict(X_test_scaled, return_std=True)
+    approximation = None
+    if kernel_mode == "exact":
+        # sklearn re-factors the training kernel at every optimizer step, so only the
+        # training rows are capped; predictions cover the whole test split.
+        if max_train is not None and len(X_train_scaled) > max_train:
+            X_train_scaled = X_train_scaled[:max_train]
+            y_train = y_train[:max_train]
+
+        classical_kernel = DotProduct() + WhiteKernel()
+        quantum_kernel = 1.0 * RBF(length_scale=0.5)
+        if hyperopt == "service":
+            services = {
+                "classical": HyperparameterService(
+                    KernelSpec("dot", noise=True, alpha=1e-3), classical_kernel, restarts, n_jobs=n_jobs,
+                    random_state=random_state,
+                ),
+                "quantum": HyperparameterService(
+                    KernelSpec("rbf", amplitude=True, noise=False, alpha=1e-3), quantum_kernel, restarts,
+                    n_jobs=n_jobs, random_state=random_state,
+                ),
+            }
+            classical_kernel = services["classical"].fit(X_train_scaled, y_train)
+            quantum_kernel = services["quantum"].fit(X_train_scaled, y_train)
+            optimizer = None
+        elif hyperopt == "sklearn":
+            optimizer = "fmin_l_bfgs_b"
+        else:
+            raise ValueError(f"Unknown hyperparameter optimizer {hyperopt!r}")
+        classical_gpr = GaussianProcessRegressor(
+            kernel=classical_kernel, alpha=1e-3, optimizer=optimizer, random_state=random_state
+        )
+        classical_gpr.fit(X_train_scaled, y_train)
+        y_pred_classical, y_std_classical = classical_gpr.predict(X_test_scaled, return_std=True)
+
+        quantum_gpr = GaussianProcessRegressor(
+            kernel=quantum_kernel, alpha=1e-3, optimizer=optimizer, random_state=random_state
+        )
+        quantum_gpr.fit(X_train_scaled, y_train)
+        y_pred_quantum, y_std_quantum = quantum_gpr.predict(X_test_scaled, return_std=True)
+    elif kernel_mode in ("blocked", "sparse"):
+        # Full-data inference: the classical DotProduct kernel on the scaled features and the
+        # fidelity kernel on encoded states, with identical solvers for both.
+        states_train = encode_states(X_train_scaled, feature_map, precision=precision)
+        states_test = encode_states(X_test_scaled, feature_map, precision=precision)
+        if noise is None:
+            hyperparameters, services = fit_solver_hyperparameters(
+                X_train_scaled, states_train, y_train, max_train, restarts, n_jobs, random_state
+            )
+        else:
+            unit = {"amplitude": 1.0, "noise": noise}
+            hyperparameters = {"classical": {**unit, "sigma_0": 1.0}, "quantum": {**unit, "sigma_0": None}}
+        classical, quantum = hyperparameters["classical"], hyperparameters["quantum"]
+        models = []
+        for kernel_fn, diag_fn, params in (
+            (
+                lambda A, B: classical["amplitude"] * linear_kernel(A, B, classical["sigma_0"]),
+                lambda A: classical["amplitude"] * ((A ** 2).sum(axis=1) + classical["sigma_0"] ** 2),
+                classical,
+            ),
+            (
+                lambda A, B: quantum["amplitude"] * fidelity_from_states(A, B),
+                lambda A: np.full(len(A), quantum["amplitude"]),
+                quantum,
+            ),
+        ):
+            if kernel_mode == "blocked":
+                models.append(BlockedExactGP(kernel_fn, diag_fn, params["noise"], block_size=block_size))
+            else:
+                models.append(SparseGP(kernel_fn, diag_fn, components, params["noise"], random_state=random_state))
+        classical_model, quantum_model = models
+        classical_model.fit(X_train_scaled, y_train)
+        y_pred_classical, y_std_classical = classical_model.predict(X_test_scaled, return_std=True)
+        quantum_model.fit(states_train, y_train)
+        y_pred_quantum, y_std_quantum = quantum_model.predict(states_test, return_std=True)
+    else:
+        # Low-rank mode keeps the full split: a DotProduct + White GP is exactly Bayesian linear
+        # regression on the features, and the quantum kernel is replaced by explicit
+        # Nystrom (fidelity kernel) or random Fourier (RBF kernel) features.
+        classical_model = BayesianRidge()
+        classical_model.fit(X_train_scaled, y_train)
+        y_pred_classical, y_std_classical = classical_model.predict(X_test_scaled, return_std=True)
+
+        phi_train, phi_test, approximation = low_rank_features(
+            X_train_scaled, X_test_scaled, kernel_mode, components, landmarks, feature_map, 0.5, random_state, precision
+        )
+        quantum_model = BayesianRidge()
+        quantum_model.fit(phi_train, y_train)
+        y_pred_quantum, y_std_quantum = quantum_model.predict(phi_test, return_std=True)
 
     rmse_classical = mean_squared_error(y_test, y_pred_classical) ** 0.5
     rmse_quantum = mean_squared_error(y_test, y_pred_quantum) ** 0.5
@@ -78,17 +295,174 @@ def evaluate(random_state: int = 42) -> dict:
         "rmse_quantum": rmse_quantum,
         "coverage_quantum": coverage_quantum,
         "coverage_gap": coverage_gap,
+        "kernel_mode": kernel_mode,
+        # sklearn's exact GaussianProcessRegressor always works in float64.
+        "precision": "float64" if kernel_mode == "exact" else precision,
+        "train_size": int(len(y_train)),
+        "test_size": int(len(y_test)),
     }
+    if kernel_mode in ("blocked", "sparse"):
+        metrics["hyperparameters"] = hyperparameters
+        if noise is None:
+            metrics["hyperparameter_rows"] = int(min(max_train or len(y_train), len(y_train)))
+            metrics["hyperopt"] = {name: {**service.summary(), "log": service.log} for name, service in services.items()}
+        metrics["coverage_classical"] = coverage_classical
+    if kernel_mode == "sparse":
+        metrics["inducing_points"] = int(len(quantum_model.Z_))
+    if approximation is not None:
+        metrics["kernel_approximation"] = approximation
+    if kernel_mode == "exact" and hyperopt == "service":
+        metrics["hyperopt"] = {name: {**service.summary(), "log": service.log} for name, service in services.items()}
 
-    OUT_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+    if write_outputs:
+        OUT_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+    return metrics
+
+
+def evaluate_multi_target(
+    targets: tuple[str, ...] = TARGETS,
+    feature_map: FeatureMap | None = None,
+    noise: float = 0.5,
+    kernel_mode: str = "blocked",
+    components: int = 500,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    random_state: int = 42,
+    split_state: int | None = None,
+    dataset: tuple[np.ndarray, np.ndarray, list[str]] | None = None,
+    write_outputs: bool = True,
+    precision: str = "float64",
+) -> dict:
+    """Predict every target on the full split from one factorization per model.
+
+    Targets are extra right-hand sides of the same triangular solves, so cost is nearly
+    independent of how many properties are predicted. ``blocked`` is exact inference with a
+    memory-mapped covariance; ``sparse`` uses ``components`` inducing points. Without an
+    explicit ``qubits`` the feature map is widened to one qubit per input; a map pinned
+    to fewer qubits than inputs is rejected. ``precision`` sets the dtype of the features
+    and states; factorizations always run in float64.
+    """
+    if kernel_mode not in ("blocked", "sparse"):
+        raise ValueError(f"Multi-target mode supports the blocked and sparse solvers, not {kernel_mode!r}")
+    if feature_map is None:
+        feature_map = FeatureMap("composition_encoding", layers=2, bandwidth=0.5)
+    X, Y, features = load_multi_target(targets) if dataset is None else dataset
+    if feature_map.qubits is None and X.shape[1] > feature_map.num_qubits:
+        feature_map = replace(feature_map, qubits=X.shape[1])
+    X_train, X_test, Y_train, Y_test = train_test_split(
+        X, Y, test_size=0.2, random_state=random_state if split_state is None else split_state
+    )
+    scaler = StandardScaler()
+    X_train = scaler.fit_transform(X_train).astype(precision)
+    X_test = scaler.transform(X_test).astype(precision)
+
+    timings = {}
+    predictions = {}
+    for name, inputs, kernel_fn, diag_fn in (
+        ("classical", lambda A: A, linear_kernel, lambda A: (A ** 2).sum(axis=1) + 1.0),
+        ("quantum", lambda A: encode_states(A, feature_map, precision=precision), fidelity_from_states, unit_diagonal),
+    ):
+        start = time.perf_counter()
+        train_inputs, test_inputs = inputs(X_train), inputs(X_test)
+        if kernel_mode == "blocked":
+            model = BlockedExactGP(kernel_fn, diag_fn, noise, block_size=block_size)
+        else:
+            model = SparseGP(kernel_fn, diag_fn, components, noise, random_state=random_state)
+        model.fit(train_inputs, Y_train)
+        fit_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        mean, std = model.predict(test_inputs, return_std=True)
+        timings[name] = {"fit_seconds": fit_seconds, "predict_seconds": time.perf_counter() - start}
+        evidence = model.log_marginal_likelihood() if kernel_mode == "blocked" else model.elbo_
+        predictions[name] = (mean, std, evidence)
+
+    per_target = {}
+    for t, target in enumerate(targets):
+        record = {}
+        for name, (mean, std, evidence) in predictions.items():
+            record[f"rmse_{name}"] = float(mean_squared_error(Y_test[:, t], mean[:, t]) ** 0.5)
+            record[f"coverage_{name}"] = float(coverage_score(Y_test[:, t], mean[:, t], std[:, t]))
+            record[f"mean_std_{name}"] = float(std[:, t].mean())
+            key = "log_marginal_likelihood" if kernel_mode == "blocked" else "elbo"
+            record[f"{key}_{name}"] = float(evidence[t])
+        per_target[target] = record
+
+    metrics = {
+        "targets": list(targets),
+        "features": features,
+        "feature_map": feature_map.to_dict(),
+        "kernel_mode": kernel_mode,
+        "noise": noise,
+        "precision": precision,
+        "train_size": int(len(Y_train)),
+        "test_size": int(len(Y_test)),
+        "factorizations_per_model": 1,
+        "timings": timings,
+        "per_target": per_target,
+    }
+    if kernel_mode == "sparse":
+        metrics["inducing_points"] = components
+    if write_outputs:
+        OUT_MULTI_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
     return metrics
 
 
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--random-state", type=int, default=42)
+    parser.add_argument("--kernel-mode", choices=["exact", "blocked", "sparse", "nystroem", "rff"], default="blocked")
+    parser.add_argument("--components", type=int, default=500, help="Low-rank feature dimension / inducing points")
+    parser.add_argument("--landmarks", choices=LANDMARK_METHODS, default="kmeans++")
+    parser.add_argument("--feature-map", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument(
+        "--targets", nargs="+", default=None, help=f"Joint multi-target mode, e.g. {' '.join(TARGETS)}"
+    )
+    parser.add_argument(
+        "--noise",
+        type=float,
+        default=None,
+        help="Fixed noise variance on normalized targets (blocked, sparse; default: fitted); multi-target default 0.5",
+    )
+    parser.add_argument(
+        "--max-train", type=int, default=2000, help="Training rows in exact mode, hyperparameter rows in blocked/sparse (0 = all)"
+    )
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--hyperopt", choices=["sklearn", "service"], default="sklearn", help="Exact-mode optimizer")
+    parser.add_argument("--restarts", type=int, default=4)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    parser.add_argument(
+        "--precision", choices=PRECISIONS, default="float64", help="Feature and kernel dtype (low-rank and multi-target)"
+    )
     args = parser.parse_args()
-    metrics = evaluate(args.random_state)
+    feature_map = FeatureMap(args.feature_map, layers=args.layers, bandwidth=args.bandwidth)
+    if args.targets:
+        metrics = evaluate_multi_target(
+            tuple(args.targets),
+            feature_map,
+            0.5 if args.noise is None else args.noise,
+            kernel_mode=args.kernel_mode,
+            components=args.components,
+            block_size=args.block_size,
+            random_state=args.random_state,
+            precision=args.precision,
+        )
+        print(json.dumps(metrics, indent=2))
+        return
+    metrics = evaluate(
+        args.random_state,
+        args.kernel_mode,
+        args.components,
+        args.landmarks,
+        feature_map,
+        precision=args.precision,
+        max_train=args.max_train or None,
+        noise=args.noise,
+        block_size=args.block_size,
+        hyperopt=args.hyperopt,
+        restarts=args.restarts,
+        n_jobs=args.n_jobs,
+    )
     print(json.dumps(metrics, indent=2))
 
 
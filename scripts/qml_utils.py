@@ -0,0 +1,42 @@
+"""Small helpers shared by the kernel, circuit and generator scripts (numpy only)."""
+from __future__ import annotations
+
+import multiprocessing
+from functools import lru_cache
+
+import numpy as np
+
+
+def pool_context() -> multiprocessing.context.BaseContext:
+    """Fork where available (workers inherit module state), spawn otherwise."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+
+
+@lru_cache(maxsize=None)
+def z_signs(num_qubits: int) -> np.ndarray:
+    """Eigenvalues of Z on every qubit for each basis state, shape (qubits, 2**qubits)."""
+    basis = np.arange(2 ** num_qubits)
+    bits = (basis[None, :] >> np.arange(num_qubits)[:, None]) & 1
+    return (1 - 2 * bits).astype(np.float64)
+
+
+@lru_cache(maxsize=None)
+def cz_ladder_signs(num_qubits: int) -> np.ndarray:
+    z = z_signs(num_qubits)
+    signs = np.ones(2 ** num_qubits)
+    for q in range(num_qubits - 1):
+        # CZ flips the sign when both qubits are |1>, i.e. both Z eigenvalues are -1.
+        signs *= np.where((z[q] < 0) & (z[q + 1] < 0), -1.0, 1.0)
+    return signs
+
+
+def entangler_pairs(num_qubits: int, topology: str) -> np.ndarray:
+    """Qubit pairs of a ``ring`` or ``all``-to-all entangling layer, shape (pairs, 2)."""
+    if topology == "ring":
+        pairs = [(q, (q + 1) % num_qubits) for q in range(num_qubits)] if num_qubits > 2 else [(0, 1)]
+    elif topology == "all":
+        pairs = [(q, r) for q in range(num_qubits) for r in range(q + 1, num_qubits)]
+    else:
+        raise ValueError(f"Unknown entangler topology {topology!r}")
+    return np.asarray(pairs, dtype=int)
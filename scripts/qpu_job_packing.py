@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""Pack kernel-estimation circuits into provider jobs and estimate their cost and wall time."""
+from __future__ import annotations
+
+import argparse
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from circuit_ir import DEVICES, compile_feature_map
+from noisy_kernels import NoiseModel, NoisyStates, noisy_states
+from quantum_kernels import FAMILY_QUBITS, FeatureMap, encode_states, iter_batches, load_features, qubit_angles
+from shot_noise import default_shots_per_entry
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+PRICE_SHEETS_PATH = BASE_DIR / "data" / "qml" / "qpu_price_sheets.json"
+
+STRATEGIES = ("per_circuit", "next_fit", "sorted_next_fit")
+ALLOCATIONS = ("uniform", "neyman")
+ANGLE_DECIMALS = 9
+
+
+@dataclass(frozen=True)
+class PriceSheet:
+    """Provider limits, prices and overheads; any unset price is free.
+
+    A job is billed ``max(min_job_usd, per_job_usd + sum over circuits of (per_circuit_usd
+    + shots * (per_shot_usd + gate-shot prices)) + per_second_usd * execution seconds)``.
+    """
+
+    name: str
+    device: str = "ionq"
+    max_circuits_per_job: int = 1
+    max_shots_per_job: int = 10000
+    max_shots_per_circuit: int = 10000
+    per_job_usd: float = 0.0
+    min_job_usd: float = 0.0
+    per_circuit_usd: float = 0.0
+    per_shot_usd: float = 0.0
+    per_1q_gate_shot_usd: float = 0.0
+    per_2q_gate_shot_usd: float = 0.0
+    per_second_usd: float = 0.0
+    queue_seconds: float = 0.0
+    job_overhead_seconds: float = 0.0
+    circuit_overhead_seconds: float = 0.0
+    shot_overhead_us: float = 0.0
+    concurrent_jobs: int = 1
+
+    @classmethod
+    def load(cls, path: Path = PRICE_SHEETS_PATH) -> Dict[str, "PriceSheet"]:
+        sheets = json.loads(Path(path).read_text(encoding="utf-8"))
+        fields = cls.__dataclass_fields__
+        return {
+            name: cls(name=name, **{key: value for key, value in entry.items() if key in fields})
+            for name, entry in sheets.items()
+        }
+
+
+@dataclass
+class KernelCircuits:
+    """Distinct compute-uncompute circuits ``U(x_v)^dag U(x_u)`` behind a train and test kernel.
+
+    Rows with identical qubit angles share one index in ``rows``. Fidelities are symmetric,
+    so ``pairs`` holds each unordered pair ``u < v`` once; equal rows (the diagonal and
+    duplicates) need no circuit at all.
+    """
+
+    rows: np.ndarray
+    pairs: np.ndarray
+    index_train: np.ndarray
+    index_test: Optional[np.ndarray]
+
+    @property
+    def requested(self) -> int:
+        n = len(self.index_train)
+        return n * n + (0 if self.index_test is None else len(self.index_test) * n)
+
+    def _codes(self, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        return np.minimum(u, v) * len(self.rows) + np.maximum(u, v)
+
+    def assemble(self, values: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Scatter per-circuit fidelities back into the train (and test) kernel."""
+        codes = self._codes(self.pairs[:, 0], self.pairs[:, 1])
+
+        def lookup(rows: np.ndarray) -> np.ndarray:
+            kernel = np.ones((len(rows), len(self.index_train)))
+            for block in iter_batches(len(rows), 1024):
+                u, v = rows[block][:, None], self.index_train[None, :]
+                distinct = u != v
+                slots = np.searchsorted(codes, self._codes(u, v)[distinct])
+                kernel[block][distinct] = values[slots]
+            return kernel
+
+        return lookup(self.index_train), None if self.index_test is None else lookup(self.index_test)
+
+
+def kernel_circuits(
+    X_train: np.ndarray, X_test: Optional[np.ndarray], feature_map: FeatureMap, decimals: int = ANGLE_DECIMALS
+) -> KernelCircuits:
+    angles = qubit_angles(X_train if X_test is None else np.vstack([X_train, X_test]), feature_map)
+    rows, inverse = np.unique(np.round(angles, decimals), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    index_train = inverse[: len(X_train)]
+    index_test = None if X_test is None else inverse[len(X_train):]
+    train_rows = np.unique(index_train)
+    upper = np.triu_indices(len(train_rows), 1)
+    codes = [train_rows[upper[0]] * len(rows) + train_rows[upper[1]]]
+    if index_test is not None:
+        for block in iter_batches(len(index_test), 1024):
+            u, v = np.unique(index_test[block])[:, None], train_rows[None, :]
+            codes.append(np.unique((np.minimum(u, v) * len(rows) + np.maximum(u, v))[u != v]))
+    codes = np.unique(np.concatenate(codes))
+    pairs = np.stack([codes // len(rows), codes % len(rows)], axis=1)
+    return KernelCircuits(rows, pairs, index_train, index_test)
+
+
+def _angle_map(feature_map: FeatureMap) -> FeatureMap:
+    # ``rows`` already hold qubit angles: unit bandwidth and one column per qubit.
+    return FeatureMap(feature_map.family, feature_map.layers, 1.0, feature_map.num_qubits)
+
+
+def _pair_fidelities(states: np.ndarray | NoisyStates, pairs: np.ndarray) -> np.ndarray:
+    if isinstance(states, np.ndarray):
+        return np.abs(np.einsum("ij,ij->i", states[pairs[:, 0]].conj(), states[pairs[:, 1]])) ** 2
+    a, b = states.data[pairs[:, 0]], states.data[pairs[:, 1]]
+    if states.simulator == "density":
+        return states.measured(np.einsum("ij,ij->i", a, b))
+    return states.measured((np.abs(np.einsum("isd,itd->ist", a.conj(), b)) ** 2).mean(axis=(1, 2)))
+
+
+def circuit_fidelities(
+    circuits: KernelCircuits, feature_map: FeatureMap, noise: Optional[NoiseModel] = None
+) -> np.ndarray:
+    """Exact (or noisy) fidelity of every circuit, from one simulation per distinct row."""
+    angle_map = _angle_map(feature_map)
+    states = encode_states(circuits.rows, angle_map) if noise is None else noisy_states(circuits.rows, angle_map, noise)
+    values = np.empty(len(circuits.pairs))
+    for block in iter_batches(len(values), 65536):
+        values[block] = _pair_fidelities(states, circuits.pairs[block])
+    return values
+
+
+def allocate_shots(
+    n_circuits: int, shots_per_circuit: float, allocation: str = "uniform", fidelities: Optional[np.ndarray] = None,
+    minimum: int = 10,
+) -> np.ndarray:
+    """Shots per circuit for the same total budget: equal, or Neyman (proportional to the binomial sd)."""
+    if allocation not in ALLOCATIONS:
+        raise ValueError(f"Unknown shot allocation {allocation!r}; expected one of {ALLOCATIONS}")
+    if allocation == "uniform":
+        return np.full(n_circuits, int(round(shots_per_circuit)), dtype=np.int64)
+    if fidelities is None:
+        raise ValueError("Neyman allocation needs (pilot) fidelity estimates")
+    p = np.clip(fidelities, 0.0, 1.0)
+    sd = np.sqrt((p + 1e-3) * (1 - p + 1e-3))
+    extra = max(shots_per_circuit - minimum, 0) * n_circuits
+    return minimum + np.floor(extra * sd / sd.sum()).astype(np.int64)
+
+
+@dataclass
+class JobPlan:
+    """Execution items (a circuit, or a chunk of its shots) in submission order, cut into jobs."""
+
+    sheet: PriceSheet
+    strategy: str
+    circuit: np.ndarray
+    shots: np.ndarray
+    starts: np.ndarray
+
+    @property
+    def n_jobs(self) -> int:
+        return len(self.starts)
+
+    def jobs(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        ends = np.append(self.starts[1:], len(self.circuit))
+        for start, end in zip(self.starts, ends):
+            yield self.circuit[start:end], self.shots[start:end]
+
+
+def plan_jobs(shots: np.ndarray, sheet: PriceSheet, strategy: str = "sorted_next_fit") -> JobPlan:
+    """Split circuits above ``max_shots_per_circuit`` into chunks and pack them into jobs.
+
+    ``next_fit`` fills each job in circuit order until either limit would be exceeded;
+    ``sorted_next_fit`` does the same after sorting by shots, so heavy and light circuits
+    do not strand capacity; ``per_circuit`` submits every item as its own job.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown packing strategy {strategy!r}; expected one of {STRATEGIES}")
+    shots = np.asarray(shots, dtype=np.int64)
+    cap = max(1, min(sheet.max_shots_per_circuit, sheet.max_shots_per_job))
+    chunks = np.maximum(-(-shots // cap), 1)
+    circuit = np.repeat(np.arange(len(shots)), chunks)
+    first = np.repeat(np.cumsum(chunks) - chunks, chunks)
+    # Every chunk is full except the last one of each circuit.
+    item_shots = np.where(np.arange(len(circuit)) - first < np.repeat(chunks, chunks) - 1, cap, np.repeat(shots, chunks) - cap * (np.repeat(chunks, chunks) - 1))
+    if strategy == "sorted_next_fit":
+        order = np.argsort(-item_shots, kind="stable")
+        circuit, item_shots = circuit[order], item_shots[order]
+    if strategy == "per_circuit":
+        return JobPlan(sheet, strategy, circuit, item_shots, np.arange(len(circuit)))
+    cumulative = np.concatenate([[0], np.cumsum(item_shots)])
+    starts, start = [], 0
+    while start < len(circuit):
+        starts.append(start)
+        by_shots = np.searchsorted(cumulative, cumulative[start] + sheet.max_shots_per_job, side="right") - 1
+        start = max(start + 1, min(start + sheet.max_circuits_per_job, by_shots))
+    return JobPlan(sheet, strategy, circuit, item_shots, np.asarray(starts))
+
+
+@dataclass(frozen=True)
+class CircuitResources:
+    """Gate counts and per-shot duration of one compute-uncompute kernel circuit."""
+
+    one_qubit_gates: int
+    two_qubit_gates: int
+    shot_us: float
+
+    @classmethod
+    def for_feature_map(cls, feature_map: FeatureMap, device: str) -> "CircuitResources":
+        target = DEVICES[device]
+        compiled = compile_feature_map(feature_map.family, feature_map.layers, feature_map.num_qubits, target.topology)
+        # U(x)^dag U(x') doubles the encoding; the readout happens once.
+        body = compiled.runtime_us(target) - target.readout_us
+        return cls(2 * compiled.one_qubit_count, 2 * compiled.two_qubit_count, 2 * body + target.readout_us)
+
+
+def estimate(plan: JobPlan, resources: CircuitResources) -> dict:
+    """Cost, QPU time and wall time (queueing included) of a job plan."""
+    sheet = plan.sheet
+    shot_seconds = (resources.shot_us + sheet.shot_overhead_us) * 1e-6
+    gate_shot_usd = (
+        sheet.per_shot_usd
+        + resources.one_qubit_gates * sheet.per_1q_gate_shot_usd
+        + resources.two_qubit_gates * sheet.per_2q_gate_shot_usd
+    )
+    item_seconds = sheet.circuit_overhead_seconds + plan.shots * shot_seconds
+    item_usd = sheet.per_circuit_usd + plan.shots * gate_shot_usd
+    job_seconds = sheet.job_overhead_seconds + np.add.reduceat(item_seconds, plan.starts)
+    job_usd = sheet.per_job_usd + np.add.reduceat(item_usd, plan.starts) + sheet.per_second_usd * job_seconds
+    job_usd = np.maximum(job_usd, sheet.min_job_usd)
+    # The QPU runs one job at a time; queue waits overlap for up to ``concurrent_jobs`` jobs.
+    waves = -(-plan.n_jobs // max(sheet.concurrent_jobs, 1))
+    return {
+        "sheet": sheet.name,
+        "strategy": plan.strategy,
+        "jobs": plan.n_jobs,
+        "executions": int(len(plan.circuit)),
+        "circuits": int(len(np.unique(plan.circuit))),
+        "shots": int(plan.shots.sum()),
+        "cost_usd": float(job_usd.sum()),
+        "qpu_seconds": float(job_seconds.sum()),
+        "wall_seconds": float(waves * sheet.queue_seconds + job_seconds.sum()),
+        "mean_circuits_per_job": float(len(plan.circuit) / max(plan.n_jobs, 1)),
+    }
+
+
+def cheapest_packing(
+    shots: np.ndarray,
+    feature_map: FeatureMap,
+    sheets: Sequence[PriceSheet],
+    strategies: Sequence[str] = STRATEGIES,
+) -> pd.DataFrame:
+    """Every (price sheet, strategy) estimate, cheapest first."""
+    records = []
+    for sheet in sheets:
+        resources = CircuitResources.for_feature_map(feature_map, sheet.device)
+        for strategy in strategies:
+            records.append(estimate(plan_jobs(shots, sheet, strategy), resources))
+    return pd.DataFrame(records).sort_values(["cost_usd", "wall_seconds"]).reset_index(drop=True)
+
+
+class FakeBackend:
+    """Offline provider: runs packed jobs on the simulator and bills them with a price sheet.
+
+    Each circuit returns the number of all-zeros outcomes, a binomial draw at the exact
+    (or ``noise``-model) fidelity, so a plan can be exercised end to end without a QPU.
+    """
+
+    def __init__(
+        self,
+        circuits: KernelCircuits,
+        feature_map: FeatureMap,
+        sheet: PriceSheet,
+        noise: Optional[NoiseModel] = None,
+        random_state: int = 0,
+    ) -> None:
+        self.circuits = circuits
+        self.sheet = sheet
+        self.resources = CircuitResources.for_feature_map(feature_map, sheet.device)
+        self.fidelities = circuit_fidelities(circuits, feature_map, noise)
+        self.rng = np.random.default_rng(random_state)
+        self.log: List[dict] = []
+
+    def submit(self, circuit: np.ndarray, shots: np.ndarray) -> np.ndarray:
+        if len(circuit) > self.sheet.max_circuits_per_job or shots.sum() > self.sheet.max_shots_per_job:
+            raise ValueError("Job exceeds the provider limits")
+        if shots.max(initial=0) > self.sheet.max_shots_per_circuit:
+            raise ValueError("Circuit exceeds the per-circuit shot limit")
+        job = JobPlan(self.sheet, "submitted", circuit, shots, np.zeros(1, dtype=np.int64))
+        self.log.append({key: value for key, value in estimate(job, self.resources).items() if key not in ("sheet", "strategy", "jobs")})
+        return self.rng.binomial(shots, self.fidelities[circuit])
+
+    def run(self, plan: JobPlan) -> np.ndarray:
+        """Execute every job and return the pooled fidelity estimate of each circuit."""
+        zeros = np.zeros(len(self.circuits.pairs))
+        total = np.zeros(len(self.circuits.pairs))
+        for circuit, shots in plan.jobs():
+            np.add.at(zeros, circuit, self.submit(circuit, shots))
+            np.add.at(total, circuit, shots)
+        return zeros / np.maximum(total, 1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cheapest QPU job packing for a fidelity kernel")
+    parser.add_argument("--family", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument("--train", type=int, default=500)
+    parser.add_argument("--test", type=int, default=100)
+    parser.add_argument("--shots", type=float, default=None, help="Mean shots per circuit (default: feature-map heuristic)")
+    parser.add_argument("--allocation", choices=ALLOCATIONS, default="uniform")
+    parser.add_argument("--price-sheets", type=Path, default=PRICE_SHEETS_PATH)
+    parser.add_argument("--sheets", nargs="+", default=None, help="Sheet names (default: all but local_fake)")
+    parser.add_argument("--simulate", action="store_true", help="Run the cheapest local_fake plan offline")
+    args = parser.parse_args()
+
+    X, _ = load_features()
+    feature_map = FeatureMap(args.family, layers=args.layers, bandwidth=args.bandwidth)
+    rng = np.random.default_rng(0)
+    idx = rng.choice(len(X), size=args.train + args.test, replace=False)
+    X_train, X_test = X[idx[: args.train]], X[idx[args.train:]] if args.test else None
+    circuits = kernel_circuits(X_train, X_test, feature_map)
+    shots_per_circuit = args.shots or default_shots_per_entry(feature_map)
+    fidelities = circuit_fidelities(circuits, feature_map) if args.allocation == "neyman" else None
+    shots = allocate_shots(len(circuits.pairs), shots_per_circuit, args.allocation, fidelities)
+    sheets = PriceSheet.load(args.price_sheets)
+    chosen = [sheets[name] for name in (args.sheets or [name for name in sheets if name != "local_fake"])]
+    table = cheapest_packing(shots, feature_map, chosen)
+    best = table.iloc[0]
+    # One circuit per requested entry, as without symmetry or duplicate-row folding.
+    naive = allocate_shots(circuits.requested, shots_per_circuit)
+    without_dedup = estimate(
+        plan_jobs(naive, sheets[best["sheet"]], best["strategy"]),
+        CircuitResources.for_feature_map(feature_map, sheets[best["sheet"]].device),
+    )
+    report = {
+        "kernel_entries_requested": circuits.requested,
+        "distinct_circuits": int(len(circuits.pairs)),
+        "distinct_rows": int(len(circuits.rows)),
+        "total_shots": int(shots.sum()),
+        "cheapest": best.to_dict(),
+        "without_dedup": without_dedup,
+    }
+    print(table.to_string(index=False))
+    if args.simulate:
+        sheet = sheets["local_fake"]
+        fake = FakeBackend(circuits, feature_map, sheet)
+        plan = plan_jobs(shots, sheet, cheapest_packing(shots, feature_map, [sheet]).iloc[0]["strategy"])
+        K_train, K_test = circuits.assemble(fake.run(plan))
+        exact_train, exact_test = circuits.assemble(fake.fidelities)
+        report["fake_backend"] = {
+            "jobs": len(fake.log),
+            "cost_usd": float(sum(entry["cost_usd"] for entry in fake.log)),
+            "train_kernel_rmse": float(np.sqrt(np.mean((K_train - exact_train) ** 2))),
+            "test_kernel_rmse": None if K_test is None else float(np.sqrt(np.mean((K_test - exact_test) ** 2))),
+        }
+    print(json.dumps(report, indent=2, default=float))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ from __future__ import annotations
 
 import argparse
 import json
+from dataclasses import asdict
 from pathlib import Path
 
 import numpy as np
@@ -11,45 +12,207 @@ import pandas as pd
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
-from sklearn.svm import SVR
-from sklearn.metrics.pairwise import rbf_kernel
+from sklearn.svm import SVR, LinearSVR
+
+from kernel_approximation import LANDMARK_METHODS, NystroemMap, approximation_error
+from kernel_builder import DEFAULT_TILE_SIZE, build_quantum_kernel
+from kernel_cache import DEFAULT_BUDGET_BYTES, KernelCache
+from local_svr import PartitionedQSVR
+from model_selection import DEFAULT_BANDWIDTHS, DEFAULT_C_GRID, DEFAULT_EPSILON_GRID, grid_search_qsvr
+from noisy_kernels import CALIBRATION_PATH, DEFAULT_TRAJECTORIES, SIMULATORS, NoiseModel, noisy_kernel, noisy_states
+from quantum_kernels import FAMILY_QUBITS, PRECISIONS, FeatureMap, encode_states, fidelity_from_states, load_dataset, quantum_kernel
+from shot_noise import ALLOCATIONS, sampled_qsvr
 
 BASE_DIR = Path(__file__).resolve().parents[1]
-DATA_PATH = BASE_DIR / "data" / "processed" / "perovskites_features.parquet"
 OUT_JSON = BASE_DIR / "data" / "qml" / "qsvr_metrics.json"
 OUT_CSV = BASE_DIR / "data" / "qml" / "qsvr_predictions.csv"
+OUT_CV = BASE_DIR / "data" / "qml" / "qsvr_cv_results.csv"
+
+KERNEL_MODES = ("exact", "nystroem", "partitioned")
 
 
-def load_dataset() -> tuple[np.ndarray, np.ndarray, list[str]]:
-    df = pd.read_parquet(DATA_PATH)
-    features = [col for col in df.columns if col not in {"material_id", "formula", "spacegroup", "band_gap_eV", "log_band_gap", "is_insulator"}]
-    X = df[features].fillna(df[features].median()).values
-    y = df["band_gap_eV"].values
-    return X, y, features
+def kernel_precision_error(X: np.ndarray, feature_map: FeatureMap, precision: str, sample: int = 1000) -> dict:
+    """Reduced-precision fidelity kernel against the float64 one on a row subsample."""
+    idx = np.random.default_rng(0).choice(len(X), size=min(sample, len(X)), replace=False)
+    reference = quantum_kernel(X[idx].astype(np.float64), feature_map=feature_map)
+    reduced = quantum_kernel(X[idx], feature_map=feature_map, precision=precision).astype(np.float64)
+    return {
+        "kernel_max_abs_error": float(np.abs(reduced - reference).max()),
+        "kernel_relative_frobenius_error": float(np.linalg.norm(reduced - reference) / np.linalg.norm(reference)),
+    }
 
 
-def evaluate_models(random_state: int = 42) -> dict[str, float]:
-    X, y, features = load_dataset()
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=random_state
+def float64_reference(
+    X_train: np.ndarray,
+    X_test: np.ndarray,
+    y_train: np.ndarray,
+    y_test: np.ndarray,
+    y_pred: np.ndarray,
+    feature_map: FeatureMap,
+    C: float,
+    epsilon: float,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    n_jobs: int | None = None,
+) -> dict:
+    """Refit the exact QSVR end to end in float64 and compare with reduced-precision predictions."""
+    train_kernel = build_quantum_kernel(X_train, feature_map=feature_map, tile_size=tile_size, n_jobs=n_jobs)
+    model = SVR(kernel="precomputed", C=C, epsilon=epsilon).fit(train_kernel, y_train)
+    del train_kernel
+    reference = model.predict(
+        build_quantum_kernel(X_test, X_train, feature_map=feature_map, tile_size=tile_size, n_jobs=n_jobs)
+    )
+    rmse_reference = float(mean_squared_error(y_test, reference) ** 0.5)
+    return {
+        "rmse_quantum_float64": rmse_reference,
+        "rmse_quantum_delta": float(mean_squared_error(y_test, y_pred) ** 0.5) - rmse_reference,
+        "prediction_max_abs_difference": float(np.abs(y_pred - reference).max()),
+    }
+
+
+def evaluate_models(
+    random_state: int = 42,
+    feature_map: FeatureMap | None = None,
+    kernel_cache: KernelCache | None = None,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    n_jobs: int | None = None,
+    kernel_mode: str = "exact",
+    components: int = 500,
+    landmarks: str = "kmeans++",
+    C: float = 10.0,
+    epsilon: float = 0.1,
+    tune: bool = False,
+    bandwidths: tuple[float, ...] = DEFAULT_BANDWIDTHS,
+    C_grid: tuple[float, ...] = DEFAULT_C_GRID,
+    epsilon_grid: tuple[float, ...] = DEFAULT_EPSILON_GRID,
+    cv_folds: int = 5,
+    shots: float | None = None,
+    shot_allocation: str = "adaptive",
+    partitions: int = 8,
+    route_k: int = 2,
+    precision: str = "float64",
+    noise: NoiseModel | None = None,
+    noise_simulator: str = "auto",
+    trajectories: int = DEFAULT_TRAJECTORIES,
+    split_state: int | None = None,
+    dataset: tuple[np.ndarray, np.ndarray, list[str]] | None = None,
+    write_outputs: bool = True,
+) -> dict[str, float]:
+    """Classical RBF SVR against a fidelity-kernel QSVR on one train/test split.
+
+    Shot sampling, noisy kernels and the kernel cache only apply to the precomputed
+    ``exact`` kernels; combining them with another ``kernel_mode`` raises ``ValueError``.
+    """
+    if kernel_mode not in KERNEL_MODES:
+        raise ValueError(f"Unknown kernel mode {kernel_mode!r}; expected one of {KERNEL_MODES}")
+    if kernel_mode != "exact":
+        options = {"shots": shots, "noise": noise, "kernel_cache": kernel_cache}
+        unsupported = [name for name, value in options.items() if value is not None]
+        if unsupported:
+            raise ValueError(f"{', '.join(unsupported)} require kernel_mode='exact', got {kernel_mode!r}")
+    if noise is not None and kernel_cache is not None:
+        raise ValueError("Noisy kernels are simulated per run and cannot be served from the kernel cache")
+    if feature_map is None:
+        feature_map = FeatureMap("composition_encoding", layers=2, bandwidth=0.5)
+    X, y, features = load_dataset() if dataset is None else dataset
+    X_train, X_test, y_train, y_test, idx_train, idx_test = train_test_split(
+        X, y, np.arange(len(X)), test_size=0.2, random_state=random_state if split_state is None else split_state
     )
 
     scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    X_train_scaled = scaler.fit_transform(X_train).astype(precision)
+    X_test_scaled = scaler.transform(X_test).astype(precision)
 
     # Classical SVR with RBF kernel
     classical_model = SVR(kernel="rbf", C=10.0, gamma="scale")
     classical_model.fit(X_train_scaled, y_train)
     y_pred_classical = classical_model.predict(X_test_scaled)
 
-    # Simulated quantum kernel using cosine similarity derived from feature map
-    gamma = 0.5
-    train_kernel = rbf_kernel(X_train_scaled, X_train_scaled, gamma=gamma)
-    quantum_model = SVR(kernel="precomputed", C=10.0)
-    quantum_model.fit(train_kernel, y_train)
-    test_kernel = rbf_kernel(X_test_scaled, X_train_scaled, gamma=gamma)
-    y_pred_quantum = quantum_model.predict(test_kernel)
+    selection = None
+    shot_report = None
+    if tune:
+        # One training kernel per bandwidth, shared by every (C, epsilon, fold) cell.
+        candidates = [FeatureMap(feature_map.family, feature_map.layers, b, feature_map.qubits) for b in bandwidths]
+        cv_results, selection = grid_search_qsvr(
+            X_train_scaled,
+            y_train,
+            candidates,
+            C_grid,
+            epsilon_grid,
+            n_splits=cv_folds,
+            random_state=random_state,
+            n_jobs=n_jobs,
+            kernel_cache=kernel_cache,
+            tile_size=tile_size,
+        )
+        if write_outputs:
+            cv_results.to_csv(OUT_CV, index=False)
+        feature_map = FeatureMap(feature_map.family, feature_map.layers, float(selection["bandwidth"]), feature_map.qubits)
+        C, epsilon = float(selection["C"]), float(selection["epsilon"])
+
+    # Fidelity kernel from the batched statevector simulation of the feature map. With a
+    # kernel cache the blocks are memory-mapped on disk and reused across runs that only
+    # change SVR hyperparameters.
+    approximation = None
+    partition_report = None
+    precision_check = {}
+    if kernel_mode == "partitioned":
+        # Local mode: one fidelity-kernel SVR per k-means cell, fitted in parallel processes.
+        quantum_model = PartitionedQSVR(feature_map, partitions, route_k, C, epsilon, n_jobs, random_state, precision)
+        quantum_model.fit(X_train_scaled, y_train)
+        y_pred_quantum = quantum_model.predict(X_test_scaled)
+        partition_report = quantum_model.summary()
+    elif kernel_mode == "nystroem":
+        # Low-rank mode: explicit Nystrom features of the fidelity kernel feed a linear SVR,
+        # so memory and time grow linearly with the training set.
+        states_train = encode_states(X_train_scaled, feature_map, precision=precision)
+        nystroem = NystroemMap(fidelity_from_states, components, landmarks, random_state).fit(states_train)
+        phi_train = nystroem.transform(states_train)
+        approximation = approximation_error(phi_train, states_train, fidelity_from_states, random_state=random_state)
+        quantum_model = LinearSVR(C=C, epsilon=epsilon, max_iter=10000, random_state=random_state)
+        quantum_model.fit(phi_train, y_train)
+        y_pred_quantum = quantum_model.predict(
+            nystroem.transform(encode_states(X_test_scaled, feature_map, precision=precision))
+        )
+    else:
+        if noise is not None:
+            # Hardware-realistic kernels: density matrices (or trajectories) under the noise model.
+            options = dict(simulator=noise_simulator, n_trajectories=trajectories, precision=precision)
+            noisy_train = noisy_states(X_train_scaled, feature_map, noise, random_state=random_state, **options)
+            noisy_test = noisy_states(X_test_scaled, feature_map, noise, random_state=random_state + 1, **options)
+            train_kernel = noisy_kernel(noisy_train)
+            test_kernel = noisy_kernel(noisy_test, noisy_train)
+        elif kernel_cache is not None:
+            X_scaled = scaler.transform(X).astype(precision)
+            train_kernel = kernel_cache.quantum_kernel(
+                X_scaled, idx_train, None, feature_map, precision, tile_size=tile_size, n_jobs=n_jobs
+            )
+            test_kernel = kernel_cache.quantum_kernel(
+                X_scaled, idx_test, idx_train, feature_map, precision, tile_size=tile_size, n_jobs=n_jobs
+            )
+        else:
+            train_kernel = build_quantum_kernel(
+                X_train_scaled, feature_map=feature_map, tile_size=tile_size, dtype=precision, n_jobs=n_jobs
+            )
+            test_kernel = build_quantum_kernel(
+                X_test_scaled, X_train_scaled, feature_map=feature_map, tile_size=tile_size, dtype=precision, n_jobs=n_jobs
+            )
+        if shots is not None:
+            # Replace exact fidelities by finite-shot estimates, as a QPU would return them.
+            quantum_model, y_pred_quantum, shot_report = sampled_qsvr(
+                np.asarray(train_kernel), np.asarray(test_kernel), y_train, shots, shot_allocation, C, epsilon, random_state
+            )
+        else:
+            # libsvm copies the kernel to float64 before solving, so float32 only changes how
+            # the kernel is computed and cached, not the solver's memory.
+            quantum_model = SVR(kernel="precomputed", C=C, epsilon=epsilon)
+            quantum_model.fit(train_kernel, y_train)
+            y_pred_quantum = quantum_model.predict(test_kernel)
+            if precision != "float64" and noise is None:
+                del train_kernel, test_kernel
+                precision_check = float64_reference(
+                    scaler.transform(X_train), scaler.transform(X_test), y_train, y_test, y_pred_quantum,
+                    feature_map, C, epsilon, tile_size, n_jobs,
+                )
 
     rmse_classical = mean_squared_error(y_test, y_pred_classical) ** 0.5
     mae_classical = mean_absolute_error(y_test, y_pred_classical)
@@ -59,13 +222,14 @@ def evaluate_models(random_state: int = 42) -> dict[str, float]:
 
     relative_gap = (rmse_quantum - rmse_classical) / rmse_classical
 
-    pd.DataFrame(
-        {
-            "y_true": y_test,
-            "y_pred_classical": y_pred_classical,
-            "y_pred_quantum": y_pred_quantum,
-        }
-    ).to_csv(OUT_CSV, index=False)
+    if write_outputs:
+        pd.DataFrame(
+            {
+                "y_true": y_test,
+                "y_pred_classical": y_pred_classical,
+                "y_pred_quantum": y_pred_quantum,
+            }
+        ).to_csv(OUT_CSV, index=False)
 
     metrics = {
         "rmse_classical": rmse_classical,
@@ -73,17 +237,91 @@ def evaluate_models(random_state: int = 42) -> dict[str, float]:
         "rmse_quantum": rmse_quantum,
         "mae_quantum": mae_quantum,
         "relative_gap": relative_gap,
+        "feature_map": feature_map.to_dict(),
+        "kernel_mode": kernel_mode,
+        "precision": precision,
+        "C": C,
+        "epsilon": epsilon,
         "features": features,
     }
-    OUT_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+    if selection is not None:
+        metrics["model_selection"] = selection
+    if shot_report is not None:
+        metrics["shot_noise"] = shot_report
+    if approximation is not None:
+        metrics["kernel_approximation"] = {"components": components, "landmarks": landmarks, **approximation}
+    if partition_report is not None:
+        metrics["partitioning"] = partition_report
+    if noise is not None and kernel_mode == "exact":
+        metrics["noise_model"] = {**asdict(noise), "simulator": noisy_train.simulator}
+    if precision != "float64":
+        metrics["precision_check"] = {**kernel_precision_error(X_train_scaled, feature_map, precision), **precision_check}
+    if write_outputs:
+        OUT_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
     return metrics
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="QSVR benchmark")
     parser.add_argument("--random-state", type=int, default=42)
+    parser.add_argument("--feature-map", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument("--kernel-cache", type=Path, default=None, help="Cache memory-mapped kernels under this directory")
+    parser.add_argument("--cache-budget-gb", type=float, default=DEFAULT_BUDGET_BYTES / 1024 ** 3)
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    parser.add_argument("--kernel-mode", choices=KERNEL_MODES, default="exact")
+    parser.add_argument("--components", type=int, default=500, help="Nystrom landmarks in low-rank mode")
+    parser.add_argument("--landmarks", choices=LANDMARK_METHODS, default="kmeans++")
+    parser.add_argument("--partitions", type=int, default=8, help="k-means cells in partitioned mode")
+    parser.add_argument("--route-k", type=int, default=2, help="Nearest cells blended per query in partitioned mode")
+    parser.add_argument(
+        "--precision",
+        choices=PRECISIONS,
+        default="float64",
+        help="Feature, state and kernel dtype; SVR still solves on a float64 copy of the kernel",
+    )
+    parser.add_argument("--C", type=float, default=10.0)
+    parser.add_argument("--epsilon", type=float, default=0.1)
+    parser.add_argument("--tune", action="store_true", help="Select bandwidth, C and epsilon by cross-validation")
+    parser.add_argument("--bandwidths", type=float, nargs="+", default=list(DEFAULT_BANDWIDTHS))
+    parser.add_argument("--C-grid", type=float, nargs="+", default=list(DEFAULT_C_GRID))
+    parser.add_argument("--epsilon-grid", type=float, nargs="+", default=list(DEFAULT_EPSILON_GRID))
+    parser.add_argument("--cv-folds", type=int, default=5)
+    parser.add_argument("--shots", type=float, default=None, help="Mean shots per kernel entry (exact mode)")
+    parser.add_argument("--shot-allocation", choices=ALLOCATIONS, default="adaptive")
+    parser.add_argument("--noise-backend", default=None, help="Calibration entry for noisy kernels (exact mode)")
+    parser.add_argument("--noise-calibration", type=Path, default=CALIBRATION_PATH)
+    parser.add_argument("--noise-simulator", choices=SIMULATORS, default="auto")
+    parser.add_argument("--trajectories", type=int, default=DEFAULT_TRAJECTORIES)
     args = parser.parse_args()
-    metrics = evaluate_models(random_state=args.random_state)
+    feature_map = FeatureMap(args.feature_map, layers=args.layers, bandwidth=args.bandwidth)
+    metrics = evaluate_models(
+        random_state=args.random_state,
+        feature_map=feature_map,
+        kernel_cache=KernelCache(args.kernel_cache, int(args.cache_budget_gb * 1024 ** 3)) if args.kernel_cache else None,
+        tile_size=args.tile_size,
+        n_jobs=args.n_jobs,
+        kernel_mode=args.kernel_mode,
+        components=args.components,
+        landmarks=args.landmarks,
+        C=args.C,
+        epsilon=args.epsilon,
+        tune=args.tune,
+        bandwidths=tuple(args.bandwidths),
+        C_grid=tuple(args.C_grid),
+        epsilon_grid=tuple(args.epsilon_grid),
+        cv_folds=args.cv_folds,
+        shots=args.shots,
+        shot_allocation=args.shot_allocation,
+        partitions=args.partitions,
+        route_k=args.route_k,
+        precision=args.precision,
+        noise=NoiseModel.from_calibration(args.noise_calibration, args.noise_backend) if args.noise_backend else None,
+        noise_simulator=args.noise_simulator,
+        trajectories=args.trajectories,
+    )
     print(json.dumps(metrics, indent=2))
 
 
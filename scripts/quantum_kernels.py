@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Batched statevector simulation of the T2.1 feature-map families and fidelity kernels."""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from qml_utils import cz_ladder_signs, entangler_pairs, z_signs
+
+if TYPE_CHECKING:
+    from noisy_kernels import NoiseModel
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+DATA_PATH = BASE_DIR / "data" / "processed" / "perovskites_features.parquet"
+
+FAMILY_QUBITS = {
+    "composition_encoding": 6,
+    "local_environment": 8,
+    "phase_aware": 4,
+}
+# Layer counts screened, benchmarked and compiled for each family.
+LAYER_RANGES = {"composition_encoding": range(1, 6), "local_environment": range(2, 5), "phase_aware": range(1, 2)}
+
+DEFAULT_BATCH_SIZE = 4096
+PRECISIONS = ("float32", "float64")
+
+
+@dataclass(frozen=True)
+class FeatureMap:
+    family: str
+    layers: int = 1
+    bandwidth: float = 1.0
+    qubits: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        if self.family not in FAMILY_QUBITS:
+            raise ValueError(f"Unknown feature-map family {self.family!r}; expected one of {sorted(FAMILY_QUBITS)}")
+        if self.layers < 1:
+            raise ValueError("Feature maps need at least one layer")
+
+    @property
+    def num_qubits(self) -> int:
+        return self.qubits if self.qubits is not None else FAMILY_QUBITS[self.family]
+
+    @property
+    def dim(self) -> int:
+        return 2 ** self.num_qubits
+
+    def to_dict(self) -> dict:
+        record = asdict(self)
+        record["qubits"] = self.num_qubits
+        return record
+
+
+def qubit_angles(X: np.ndarray, feature_map: FeatureMap) -> np.ndarray:
+    """Assign features to qubits cyclically and scale them by the map bandwidth.
+
+    Maps with more qubits than features repeat features; more features than qubits is an
+    error rather than a silent truncation (pass ``FeatureMap(..., qubits=n_features)``).
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+    if X.shape[1] > feature_map.num_qubits:
+        raise ValueError(
+            f"{X.shape[1]} features do not fit the {feature_map.num_qubits}-qubit {feature_map.family} map; "
+            f"use at least {X.shape[1]} qubits"
+        )
+    columns = np.arange(feature_map.num_qubits) % X.shape[1]
+    return feature_map.bandwidth * X[:, columns]
+
+
+def product_state_ry(angles: np.ndarray) -> np.ndarray:
+    """Apply Ry(angle) to every qubit of |0...0> without touching the full register per gate."""
+    batch, num_qubits = angles.shape
+    cos = np.cos(angles / 2)
+    sin = np.sin(angles / 2)
+    state = np.ones((batch, 1), dtype=np.complex128)
+    # Qubit q is bit q of the basis index, so higher qubits are prepended as slower axes.
+    for q in range(num_qubits):
+        amp = np.stack([cos[:, q], sin[:, q]], axis=1)
+        state = (amp[:, :, None] * state[:, None, :]).reshape(batch, -1)
+    return state
+
+
+def apply_single_qubit(states: np.ndarray, qubit: int, matrices: np.ndarray) -> np.ndarray:
+    """Apply a per-sample 2x2 gate (batch, 2, 2) or shared gate (2, 2) to one qubit."""
+    batch, dim = states.shape
+    view = states.reshape(batch, dim >> (qubit + 1), 2, 1 << qubit)
+    if matrices.ndim == 2:
+        matrices = np.broadcast_to(matrices, (batch, 2, 2))
+    m = matrices.reshape(batch, 1, 4, 1)
+    amp0 = view[:, :, 0, :]
+    amp1 = view[:, :, 1, :]
+    out = np.stack([m[:, :, 0] * amp0 + m[:, :, 1] * amp1, m[:, :, 2] * amp0 + m[:, :, 3] * amp1], axis=2)
+    return out.reshape(batch, dim)
+
+
+def ry_matrices(theta: np.ndarray) -> np.ndarray:
+    cos = np.cos(theta / 2)
+    sin = np.sin(theta / 2)
+    return np.stack([np.stack([cos, -sin], axis=-1), np.stack([sin, cos], axis=-1)], axis=-2).astype(np.complex128)
+
+
+def apply_ry_layer(states: np.ndarray, angles: np.ndarray) -> np.ndarray:
+    for q in range(angles.shape[1]):
+        states = apply_single_qubit(states, q, ry_matrices(angles[:, q]))
+    return states
+
+
+def diagonal_phase(angles: np.ndarray, pair_index: np.ndarray, num_qubits: int, single: bool = True) -> np.ndarray:
+    """Phases of exp(-i/2 sum_q a_q Z_q) exp(-i/2 sum_(q,r) a_q a_r Z_q Z_r) as one matrix product."""
+    z = z_signs(num_qubits)
+    generators = [z] if single else []
+    coefficients = [angles] if single else []
+    if len(pair_index):
+        generators.append(z[pair_index[:, 0]] * z[pair_index[:, 1]])
+        coefficients.append(angles[:, pair_index[:, 0]] * angles[:, pair_index[:, 1]])
+    return np.exp(-0.5j * (np.hstack(coefficients) @ np.vstack(generators)))
+
+
+def _encode_block(angles: np.ndarray, feature_map: FeatureMap) -> np.ndarray:
+    n = feature_map.num_qubits
+    family = feature_map.family
+    if family == "composition_encoding":
+        # Data re-uploading: Ry encoding followed by ZZ entanglers on a ring, repeated per layer.
+        ring = entangler_pairs(n, "ring")
+        zz = diagonal_phase(angles, ring, n, single=False)
+        states = product_state_ry(angles) * zz
+        for _ in range(feature_map.layers - 1):
+            states = apply_ry_layer(states, angles) * zz
+    elif family == "local_environment":
+        # Hardware-efficient Ry-Rz rotations with a CZ ladder.
+        ladder = cz_ladder_signs(n)
+        rz = diagonal_phase(angles, np.empty((0, 2), dtype=int), n)
+        states = product_state_ry(angles) * rz * ladder
+        for _ in range(feature_map.layers - 1):
+            states = apply_ry_layer(states, angles) * rz * ladder
+    elif family == "phase_aware":
+        # Hadamard layer followed by single- and two-qubit phase rotations on every pair.
+        phases = diagonal_phase(angles, entangler_pairs(n, "all"), n)
+        hadamards = np.full((len(angles), feature_map.dim), 2 ** (-n / 2), dtype=np.complex128)
+        states = hadamards * phases
+        for _ in range(feature_map.layers - 1):
+            states = apply_ry_layer(states, np.full_like(angles, np.pi / 2)) * phases
+    else:  # pragma: no cover - guarded by FeatureMap
+        raise ValueError(family)
+    return states
+
+
+def iter_batches(n: int, batch_size: int) -> Iterator[slice]:
+    for start in range(0, n, batch_size):
+        yield slice(start, min(start + batch_size, n))
+
+
+def state_dtype(precision: str | np.dtype) -> np.dtype:
+    """Complex dtype whose fidelities come out in the requested real precision."""
+    precision = np.dtype(precision)
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unsupported precision {precision}; expected one of {PRECISIONS}")
+    return np.dtype(np.complex64 if precision == np.float32 else np.complex128)
+
+
+def encode_states(
+    X: np.ndarray, feature_map: FeatureMap, batch_size: int = DEFAULT_BATCH_SIZE, precision: str = "float64"
+) -> np.ndarray:
+    """Return the (samples, 2**qubits) statevectors for every row of X.
+
+    Gates are always simulated in double precision; ``precision="float32"`` only stores
+    the states as complex64 so that kernel products run in single precision.
+    """
+    angles = qubit_angles(X, feature_map)
+    states = np.empty((len(angles), feature_map.dim), dtype=state_dtype(precision))
+    for block in iter_batches(len(angles), batch_size):
+        states[block] = _encode_block(angles[block], feature_map)
+    return states
+
+
+def fidelity_from_states(states_a: np.ndarray, states_b: np.ndarray) -> np.ndarray:
+    """K_ij = |<psi_i|psi_j>|^2 computed as a single complex matrix product."""
+    overlap = states_a.conj() @ states_b.T
+    return overlap.real ** 2 + overlap.imag ** 2
+
+
+def quantum_kernel(
+    X_a: np.ndarray,
+    X_b: Optional[np.ndarray] = None,
+    feature_map: Optional[FeatureMap] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    precision: str = "float64",
+    noise: Optional[NoiseModel] = None,
+) -> np.ndarray:
+    """Fidelity kernel between the rows of X_a and X_b (X_a with itself when X_b is None).
+
+    ``noise`` (a ``noisy_kernels.NoiseModel``) switches to the noisy-circuit simulators.
+    """
+    if feature_map is None:
+        feature_map = FeatureMap("composition_encoding")
+    if noise is not None:
+        from noisy_kernels import noisy_quantum_kernel
+
+        return noisy_quantum_kernel(X_a, X_b, feature_map, noise, precision=precision)
+    states_a = encode_states(X_a, feature_map, batch_size, precision)
+    states_b = states_a if X_b is None else encode_states(X_b, feature_map, batch_size, precision)
+    kernel = np.empty((len(states_a), len(states_b)), dtype=precision)
+    for block in iter_batches(len(states_a), batch_size):
+        kernel[block] = fidelity_from_states(states_a[block], states_b)
+    if X_b is None:
+        np.fill_diagonal(kernel, 1.0)
+    return kernel
+
+
+NON_FEATURE_COLUMNS = {"material_id", "formula", "spacegroup", "band_gap_eV", "log_band_gap", "is_insulator"}
+
+
+def load_dataset(path: Path = DATA_PATH) -> Tuple[np.ndarray, np.ndarray, list[str]]:
+    """Unscaled, median-imputed perovskite features with the band-gap target."""
+    df = pd.read_parquet(path)
+    features = [col for col in df.columns if col not in NON_FEATURE_COLUMNS]
+    X = df[features].fillna(df[features].median()).values
+    y = df["band_gap_eV"].values
+    return X, y, features
+
+
+def load_features(path: Path = DATA_PATH) -> Tuple[np.ndarray, list[str]]:
+    X, _, features = load_dataset(path)
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    return X, features
+
+
+def benchmark(
+    feature_map: FeatureMap, samples: int, batch_size: int = DEFAULT_BATCH_SIZE, precision: str = "float64"
+) -> dict:
+    X, features = load_features()
+    X = X[:samples]
+    start = time.perf_counter()
+    states = encode_states(X, feature_map, batch_size, precision)
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    kernel = np.empty((len(states), len(states)), dtype=precision)
+    for block in iter_batches(len(states), batch_size):
+        kernel[block] = fidelity_from_states(states[block], states)
+    kernel_seconds = time.perf_counter() - start
+    return {
+        "feature_map": feature_map.to_dict(),
+        "samples": len(X),
+        "precision": precision,
+        "features": features,
+        "encode_seconds": encode_seconds,
+        "kernel_seconds": kernel_seconds,
+        "states_per_second": len(X) / max(encode_seconds, 1e-12),
+        "kernel_entries_per_second": kernel.size / max(kernel_seconds, 1e-12),
+        "mean_off_diagonal": float((kernel.sum() - np.trace(kernel)) / max(kernel.size - len(kernel), 1)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate feature-map fidelity kernels on perovskite features")
+    parser.add_argument("--family", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument("--samples", type=int, default=4000)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--precision", choices=PRECISIONS, default="float64")
+    args = parser.parse_args()
+
+    feature_map = FeatureMap(args.family, layers=args.layers, bandwidth=args.bandwidth)
+    print(json.dumps(benchmark(feature_map, args.samples, args.batch_size, args.precision), indent=2))
+
+
+if __name__ == "__main__":
+    main()
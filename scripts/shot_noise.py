@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""Finite-shot estimation of fidelity kernels with adaptive shot allocation."""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import train_test_split
+from sklearn.svm import SVR
+
+from quantum_kernels import FAMILY_QUBITS, FeatureMap, iter_batches, load_dataset, load_features, quantum_kernel
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+OUT_JSON = BASE_DIR / "data" / "qml" / "shot_allocation_metrics.json"
+
+ALLOCATIONS = ("uniform", "adaptive")
+ROW_BLOCK = 1024
+
+
+def default_shots_per_entry(feature_map: FeatureMap) -> int:
+    """Per-entry shot count used by feature_map_metrics.estimated_shots_per_eval."""
+    return int(1000 * feature_map.layers * feature_map.num_qubits / 4)
+
+
+def _entry_mask(rows: slice, n_cols: int, symmetric: bool) -> np.ndarray:
+    if not symmetric:
+        return np.ones((rows.stop - rows.start, n_cols), dtype=bool)
+    # Only entries above the diagonal are sampled; the diagonal is exactly one.
+    return np.arange(n_cols)[None, :] > np.arange(rows.start, rows.stop)[:, None]
+
+
+def estimate_kernel(
+    kernel: np.ndarray,
+    shots_per_entry: float,
+    rng: np.random.Generator,
+    allocation: str = "uniform",
+    row_weights: Optional[np.ndarray] = None,
+    col_weights: Optional[np.ndarray] = None,
+    symmetric: bool = False,
+    pilot_fraction: float = 0.2,
+) -> Tuple[np.ndarray, dict]:
+    """Replace exact fidelities by binomial shot estimates of the all-zeros probability.
+
+    ``uniform`` spends ``shots_per_entry`` on every entry. ``adaptive`` spends a pilot
+    fraction uniformly, then distributes the rest of the same total budget proportional to
+    ``row_weights[i] * col_weights[j] * sd_ij`` (Neyman allocation), where ``sd_ij`` is
+    the binomial standard deviation estimated from the pilot. Near-zero overlaps have a
+    small variance and therefore receive few extra shots; zero-weight entries get none.
+    Symmetric Gram matrices only sample the upper triangle and use ``row_weights`` for both
+    axes.
+    """
+    if allocation not in ALLOCATIONS:
+        raise ValueError(f"Unknown shot allocation {allocation!r}; expected one of {ALLOCATIONS}")
+    n_rows, n_cols = kernel.shape
+    a = np.ones(n_rows) if row_weights is None else np.asarray(row_weights, dtype=float)
+    b = a if symmetric else (np.ones(n_cols) if col_weights is None else np.asarray(col_weights, dtype=float))
+    probs = np.clip(kernel, 0.0, 1.0)
+    estimate = np.zeros(kernel.shape)
+    entries = 0
+    for rows in iter_batches(n_rows, ROW_BLOCK):
+        mask = _entry_mask(rows, n_cols, symmetric) & (np.outer(a[rows], b) > 0)
+        entries += int(mask.sum())
+    budget = int(round(shots_per_entry * entries))
+
+    if allocation == "uniform":
+        shots = int(round(shots_per_entry))
+        total = 0
+        for rows in iter_batches(n_rows, ROW_BLOCK):
+            mask = _entry_mask(rows, n_cols, symmetric) & (np.outer(a[rows], b) > 0)
+            counts = rng.binomial(shots, probs[rows])
+            estimate[rows] = np.where(mask, counts / max(shots, 1), 0.0)
+            total += shots * int(mask.sum())
+    else:
+        pilot = max(1, int(pilot_fraction * shots_per_entry))
+        weight_sum = 0.0
+        for rows in iter_batches(n_rows, ROW_BLOCK):
+            weights = np.outer(a[rows], b) * _entry_mask(rows, n_cols, symmetric)
+            counts = np.where(weights > 0, rng.binomial(pilot, probs[rows]), 0)
+            # Pilot counts are parked in the output buffer until the second pass.
+            estimate[rows] = counts
+            smoothed = (counts + 0.5) / (pilot + 1.0)
+            weight_sum += float((weights * np.sqrt(smoothed * (1 - smoothed))).sum())
+        remaining = max(budget - pilot * entries, 0)
+        scale = remaining / weight_sum if weight_sum > 0 else 0.0
+        total = pilot * entries
+        for rows in iter_batches(n_rows, ROW_BLOCK):
+            weights = np.outer(a[rows], b) * _entry_mask(rows, n_cols, symmetric)
+            counts = estimate[rows]
+            smoothed = (counts + 0.5) / (pilot + 1.0)
+            extra = np.floor(scale * weights * np.sqrt(smoothed * (1 - smoothed))).astype(np.int64)
+            counts = counts + rng.binomial(extra, probs[rows])
+            estimate[rows] = np.where(weights > 0, counts / (pilot + extra), 0.0)
+            total += int(extra.sum())
+
+    if symmetric:
+        estimate = np.triu(estimate, 1)
+        estimate += estimate.T
+        np.fill_diagonal(estimate, 1.0)
+    used = np.ones(kernel.shape, dtype=bool) if symmetric else np.outer(a, b) > 0
+    report = {
+        "allocation": allocation,
+        "entries_sampled": entries,
+        "total_shots": int(total),
+        "mean_shots_per_entry": total / max(entries, 1),
+        "kernel_rmse": float(np.sqrt(np.mean((estimate - kernel)[used] ** 2))) if used.any() else 0.0,
+    }
+    return estimate, report
+
+
+def project_psd(kernel: np.ndarray) -> np.ndarray:
+    """Clip negative eigenvalues introduced by shot noise (nearest PSD matrix in Frobenius norm)."""
+    eigvals, eigvecs = np.linalg.eigh(kernel)
+    return (eigvecs * np.clip(eigvals, 0.0, None)) @ eigvecs.T
+
+
+def support_vector_weights(model: SVR, n_train: int, margin_boost: float = 2.0) -> np.ndarray:
+    """Row importance for the training kernel: support vectors, and margin ones most of all."""
+    weights = np.ones(n_train)
+    alpha = np.abs(model.dual_coef_[0])
+    weights[model.support_] += 1.0
+    weights[model.support_[alpha < model.C * (1 - 1e-6)]] += margin_boost
+    return weights
+
+
+def sampled_qsvr(
+    train_kernel: np.ndarray,
+    test_kernel: np.ndarray,
+    y_train: np.ndarray,
+    shots_per_entry: float,
+    allocation: str = "uniform",
+    C: float = 10.0,
+    epsilon: float = 0.1,
+    random_state: int = 42,
+    mitigate: bool = True,
+) -> Tuple[SVR, np.ndarray, dict]:
+    """Fit and predict a precomputed-kernel SVR from shot-estimated kernels.
+
+    With ``mitigate`` the sampled training kernel is projected back onto the PSD cone.
+    """
+    rng = np.random.default_rng(random_state)
+    row_weights = None
+    pilot_shots, train_shots_per_entry = 0, shots_per_entry
+    if allocation == "adaptive":
+        # A cheap pilot fit locates the support vectors whose kernel rows shape the solution.
+        # Its shots come out of the same training budget, so both allocations spend alike.
+        pilot_per_entry = max(1, int(round(0.1 * shots_per_entry)))
+        pilot_kernel, pilot_report = estimate_kernel(train_kernel, pilot_per_entry, rng, "uniform", symmetric=True)
+        pilot_model = SVR(kernel="precomputed", C=C, epsilon=epsilon).fit(pilot_kernel, y_train)
+        row_weights = support_vector_weights(pilot_model, len(y_train))
+        pilot_shots = pilot_report["total_shots"]
+        train_shots_per_entry = max(shots_per_entry - pilot_per_entry, 1.0)
+    noisy_train, train_report = estimate_kernel(
+        train_kernel, train_shots_per_entry, rng, allocation, row_weights, symmetric=True
+    )
+    if mitigate:
+        noisy_train = project_psd(noisy_train)
+    model = SVR(kernel="precomputed", C=C, epsilon=epsilon).fit(noisy_train, y_train)
+
+    col_weights = None
+    if allocation == "adaptive":
+        # Predictions only read support-vector columns, weighted by their dual coefficients.
+        col_weights = np.zeros(len(y_train))
+        col_weights[model.support_] = np.abs(model.dual_coef_[0])
+    noisy_test, test_report = estimate_kernel(
+        test_kernel, shots_per_entry, rng, allocation, np.ones(len(test_kernel)), col_weights
+    )
+    report = {
+        "allocation": allocation,
+        "shots_per_entry_budget": shots_per_entry,
+        "total_shots": pilot_shots + train_report["total_shots"] + test_report["total_shots"],
+        "pilot_shots": pilot_shots,
+        "train": train_report,
+        "test": test_report,
+    }
+    return model, model.predict(noisy_test), report
+
+
+def shot_sweep(
+    feature_map: FeatureMap, samples: int, budgets: list[float], random_state: int = 42
+) -> dict:
+    X, _ = load_features()
+    _, y, _ = load_dataset()
+    rng = np.random.default_rng(random_state)
+    idx = rng.choice(len(X), size=min(samples, len(X)), replace=False)
+    X_train, X_test, y_train, y_test = train_test_split(X[idx], y[idx], test_size=0.2, random_state=random_state)
+    train_kernel = quantum_kernel(X_train, feature_map=feature_map)
+    test_kernel = quantum_kernel(X_test, X_train, feature_map=feature_map)
+    exact = SVR(kernel="precomputed", C=10.0).fit(train_kernel, y_train)
+    records = []
+    for budget in budgets:
+        for allocation in ALLOCATIONS:
+            _, pred, report = sampled_qsvr(train_kernel, test_kernel, y_train, budget, allocation, random_state=random_state)
+            records.append(
+                {
+                    "shots_per_entry_budget": budget,
+                    "allocation": allocation,
+                    "total_shots": report["total_shots"],
+                    "train_kernel_rmse": report["train"]["kernel_rmse"],
+                    "test_kernel_rmse": report["test"]["kernel_rmse"],
+                    "pilot_shots": report["pilot_shots"],
+                    "test_shots": report["test"]["total_shots"],
+                    "prediction_rmse": float(mean_squared_error(y_test, pred) ** 0.5),
+                }
+            )
+    return {
+        "feature_map": feature_map.to_dict(),
+        "samples": int(len(idx)),
+        "exact_prediction_rmse": float(mean_squared_error(y_test, exact.predict(test_kernel)) ** 0.5),
+        "reference_shots_per_entry": default_shots_per_entry(feature_map),
+        "sweep": records,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Shots vs accuracy for sampled quantum kernels")
+    parser.add_argument("--family", choices=sorted(FAMILY_QUBITS), default="composition_encoding")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--bandwidth", type=float, default=0.5)
+    parser.add_argument("--samples", type=int, default=1500)
+    parser.add_argument("--budgets", type=float, nargs="+", default=[50, 200, 1000, 3000])
+    parser.add_argument("--random-state", type=int, default=42)
+    args = parser.parse_args()
+
+    feature_map = FeatureMap(args.family, layers=args.layers, bandwidth=args.bandwidth)
+    metrics = shot_sweep(feature_map, args.samples, args.budgets, args.random_state)
+    OUT_JSON.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+    print(json.dumps(metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()